@@ -0,0 +1,282 @@
+import os
+import json
+import asyncio
+import argparse
+import datetime
+from intraday import IntradayMonitor, INTRADAY_METALS, WINDOW, fetch_domestic_bars, fetch_foreign_bars
+
+# ==========================================
+# 溢价告警常驻进程 (asyncio)
+# ==========================================
+# 在 intraday.IntradayMonitor 上加一层告警:
+# - 每 interval 秒一轮，各金属的国内 / 国外 / 近远月分钟线在线程池里并发拉取，
+#   同时在途的上游请求不超过 max_inflight (asyncio.Semaphore)，单站点的时限 / 重试 / 熔断仍走 resilience
+# - 溢价公式复用 premium_engine.premium_quote，对齐 / 滚动窗口复用 IntradayMonitor
+# - z 值直接用 IntradayMonitor 滚动窗口 (最近 window 根 bar) 里的值，和盘中快照一致，
+#   不会随进程运行时间越来越钝
+# - 第一轮拉到的分钟线覆盖前几天，只用来预热窗口，不触发告警 (否则一启动就对昨天的 bar 报警)
+# - 触发条件 (RULES): 溢价绝对值超阈值、溢价 z 值超阈值、近远月价差低于阈值 (贴水)
+#   越线才触发一次，回到阈值内才重新武装；同一条规则 COOLDOWN 秒内不重复发
+# - 告警发到可插拔的 sink: file (JSONL)、webhook (本地 HTTP 替身)、notion (数据库新页面)
+#
+# 用法:
+#   python alert_daemon.py --sink file --sink webhook
+#   python alert_daemon.py --once --premium 8 --zscore 3 --backwardation -0.5
+#   python alert_daemon.py serve             # 本地 webhook 替身，打印收到的告警
+
+POLL_INTERVAL = 60          # 秒
+MIN_INTERVAL = 15           # 轮询间隔下限，防止把新浪 / Yahoo 刷到限流
+MAX_INFLIGHT = 3            # 同时在途的上游请求数
+COOLDOWN = 30 * 60          # 同一金属同一规则两次告警的最小间隔 (秒)
+MIN_SAMPLES = 30            # z 值至少要有这么多根 bar 才判断
+
+ALERT_FILE = os.path.join(os.getenv("METALQUANT_CACHE_DIR", ".cache"), "alerts.jsonl")
+WEBHOOK_URL = os.getenv("METALQUANT_ALERT_WEBHOOK", "http://127.0.0.1:8765/alert")
+
+# 默认阈值 (命令行可覆盖)
+THRESHOLDS = {
+    "premium": 8.0,         # |溢价| > 8%
+    "zscore": 3.0,          # |z| > 3
+    "backwardation": -0.3,  # 远月 / 近月 - 1 < -0.3% (近月升水)
+}
+
+
+# ==========================================
+# 触发规则: (名称, 取值字段, 是否越线)
+# ==========================================
+
+RULES = [
+    ("premium", "premium", lambda v, t: abs(v) > t["premium"]),
+    ("zscore", "zscore", lambda v, t: abs(v) > t["zscore"]),
+    ("backwardation", "spread", lambda v, t: v < t["backwardation"]),
+]
+
+
+# ==========================================
+# Sink
+# ==========================================
+
+class FileSink:
+    """追加到 JSONL"""
+
+    def __init__(self, path=ALERT_FILE):
+        self.path = path
+
+    def send(self, alert):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as fp:
+            fp.write(json.dumps(alert, ensure_ascii=False) + "\n")
+
+
+class WebhookSink:
+    """POST JSON 到 webhook (默认本地替身)，复用 replay 的连接池"""
+
+    def __init__(self, url=WEBHOOK_URL):
+        self.url = url
+
+    def send(self, alert):
+        from replay import session
+        session().post(self.url, json=alert, timeout=(3, 10)).raise_for_status()
+
+
+class NotionSink:
+    """在日报同一个数据库里建一条告警页面"""
+
+    def __init__(self):
+        self.token = os.getenv("NOTION_TOKEN")
+        self.database_id = os.getenv("NOTION_PAGE_ID")
+        if not self.token or not self.database_id:
+            raise ValueError("NOTION_TOKEN / NOTION_PAGE_ID 缺失")
+        self.client = None
+
+    def send(self, alert):
+        if self.client is None:
+            from notion_client import Client
+            self.client = Client(auth=self.token)
+        title = f"🚨 {alert['metal']} {alert['message']}"
+        self.client.pages.create(
+            parent={"database_id": self.database_id},
+            properties={
+                "Name": {"title": [{"text": {"content": title}}]},
+                "Date": {"date": {"start": alert["bar"][:10]}},
+                "Comments": {"rich_text": [{"text": {"content": json.dumps(alert, ensure_ascii=False)}}]},
+            },
+        )
+
+
+SINKS = {"file": FileSink, "webhook": WebhookSink, "notion": NotionSink}
+
+
+# ==========================================
+# 告警进程
+# ==========================================
+
+def describe(rule, value, row):
+    if rule == "premium":
+        return f"溢价 {value:+.2f}%"
+    if rule == "zscore":
+        return f"溢价 z 值 {value:+.1f} (溢价 {row['premium']:+.2f}%)"
+    return f"近远月贴水 {value:+.2f}%"
+
+
+class AlertDaemon:
+    def __init__(self, sinks, metals=None, thresholds=None, window=WINDOW, max_inflight=MAX_INFLIGHT):
+        self.monitor = IntradayMonitor(metals, window)
+        self.sinks = sinks
+        self.thresholds = {**THRESHOLDS, **(thresholds or {})}
+        self.max_inflight = max_inflight
+        self.warm = set()       # 已经预热过窗口的金属
+        self.armed = {}         # (金属, 规则) -> 是否可触发 (越线后置 False，回到阈值内再置 True)
+        self.last_sent = {}     # (金属, 规则) -> 上次发送时间 (monotonic)
+        self.sent = 0
+
+    async def _fetch(self, sem, func, *args):
+        async with sem:
+            return await asyncio.to_thread(func, *args)
+
+    async def _poll_metal(self, sem, metal):
+        domestic_code, _, ticker = INTRADAY_METALS[metal]
+        domestic, foreign, spread = await asyncio.gather(
+            self._fetch(sem, fetch_domestic_bars, domestic_code),
+            self._fetch(sem, fetch_foreign_bars, ticker),
+            self._fetch(sem, self.monitor.spread_bars, metal),
+            return_exceptions=True)
+        for label, value in (("分钟线", domestic), ("国外分钟线", foreign)):
+            if isinstance(value, Exception):
+                print(f"   ⚠️ {metal} {label}获取失败: {value}")
+                return []
+        if isinstance(spread, Exception):
+            print(f"   ⚠️ {metal} 近远月价差获取失败: {spread}")
+            spread = None
+        st = self.monitor.state[metal]
+        start = len(st["rows"])
+        self.monitor.update(metal, domestic, foreign, spread)
+        return st["rows"][start:]
+
+    def check(self, metal, row):
+        """一根新 bar (窗口已由 IntradayMonitor 更新)，返回触发的告警"""
+        loop_time = asyncio.get_running_loop().time()
+        window = self.monitor.state[metal]["premium"]
+        values = {
+            "premium": row["premium"],
+            "zscore": row["zscore"] if len(window) >= MIN_SAMPLES else None,
+            "spread": row["spread"],
+        }
+        alerts = []
+        for rule, field, crossed in RULES:
+            value = values[field]
+            if value is None:
+                continue
+            key = (metal, rule)
+            if not crossed(value, self.thresholds):
+                self.armed[key] = True
+                continue
+            if not self.armed.get(key, True) or loop_time - self.last_sent.get(key, -COOLDOWN) < COOLDOWN:
+                continue
+            self.armed[key] = False
+            self.last_sent[key] = loop_time
+            alerts.append({
+                "metal": metal, "rule": rule, "value": round(value, 4), "threshold": self.thresholds[rule],
+                "bar": f"{row['time']:%Y-%m-%d %H:%M}", "premium": row["premium"], "spread": row["spread"],
+                "mean": window.mean(), "std": window.std(), "message": describe(rule, value, row),
+                "sent": datetime.datetime.now().isoformat(timespec="seconds"),
+            })
+        return alerts
+
+    async def dispatch(self, alert):
+        print(f"   🚨 {alert['metal']} {alert['message']} @ {alert['bar']}")
+        for sink in self.sinks:
+            try:
+                await asyncio.to_thread(sink.send, alert)
+            except Exception as e:
+                print(f"   ⚠️ 告警发送失败 ({type(sink).__name__}): {e}")
+        self.sent += 1
+
+    async def cycle(self, sem):
+        await asyncio.to_thread(self.monitor.usdcny)    # 汇率按日缓存，先在线程里取好
+        results = await asyncio.gather(*(self._poll_metal(sem, m) for m in self.monitor.metals))
+        alerts = []
+        for metal, rows in zip(self.monitor.metals, results):
+            if metal not in self.warm:
+                # 第一批 bar 只预热窗口；之后才按规则检查
+                if rows:
+                    self.warm.add(metal)
+                continue
+            alerts += [a for row in rows for a in self.check(metal, row)]
+        await asyncio.gather(*(self.dispatch(a) for a in alerts))
+        await asyncio.to_thread(self.monitor.flush)
+        return sum(len(rows) for rows in results)
+
+    async def run(self, interval=POLL_INTERVAL, once=False):
+        interval = max(interval, MIN_INTERVAL)
+        sem = asyncio.Semaphore(self.max_inflight)
+        loop = asyncio.get_running_loop()
+        print(f"🛎️ 溢价告警: {', '.join(self.monitor.metals)}，每 {interval:.0f}s 轮询，"
+              f"sink: {', '.join(type(s).__name__ for s in self.sinks) or '-'}，阈值 {self.thresholds}")
+        while True:
+            t0 = loop.time()
+            bars = await self.cycle(sem)
+            now = datetime.datetime.now().strftime("%H:%M:%S")
+            print(f"   [{now}] 新 bar {bars}，累计告警 {self.sent}")
+            if once:
+                return
+            await asyncio.sleep(max(0.0, interval - (loop.time() - t0)))
+
+
+# ==========================================
+# 本地 webhook 替身
+# ==========================================
+
+def serve(port=8765):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                alert = json.loads(body)
+                print(f"📥 {alert.get('metal')} {alert.get('message')} @ {alert.get('bar')}")
+            except ValueError:
+                print(f"📥 {body[:200]!r}")
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    print(f"👂 webhook 替身监听 http://127.0.0.1:{port}/alert")
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="溢价告警常驻进程")
+    parser.add_argument("command", nargs="?", choices=["run", "serve"], default="run")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help=f"轮询间隔 (秒，至少 {MIN_INTERVAL})")
+    parser.add_argument("--metals", nargs="+", choices=list(INTRADAY_METALS), help="默认全部")
+    parser.add_argument("--sink", action="append", choices=list(SINKS), help="可重复，默认 file")
+    parser.add_argument("--premium", type=float, help=f"|溢价| 阈值 % (默认 {THRESHOLDS['premium']})")
+    parser.add_argument("--zscore", type=float, help=f"|z| 阈值 (默认 {THRESHOLDS['zscore']})")
+    parser.add_argument("--backwardation", type=float,
+                        help=f"远月/近月-1 低于该值 % 触发 (默认 {THRESHOLDS['backwardation']})")
+    parser.add_argument("--window", type=int, default=WINDOW, help="滚动窗口长度 (根 bar)")
+    parser.add_argument("--max-inflight", type=int, default=MAX_INFLIGHT, help="同时在途的上游请求数")
+    parser.add_argument("--port", type=int, default=8765, help="serve 监听端口")
+    parser.add_argument("--once", action="store_true", help="只跑一轮")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(args.port)
+        return 0
+    sinks = [SINKS[name]() for name in dict.fromkeys(args.sink or ["file"])]
+    thresholds = {k: getattr(args, k) for k in THRESHOLDS if getattr(args, k) is not None}
+    daemon = AlertDaemon(sinks, args.metals, thresholds, args.window, args.max_inflight)
+    try:
+        asyncio.run(daemon.run(args.interval, args.once))
+    except KeyboardInterrupt:
+        daemon.monitor.flush()
+        print("👋 已停止")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,381 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import datetime
+import tempfile
+import threading
+import subprocess
+import statistics
+from contextlib import contextmanager
+
+# ==========================================
+# 每日流水线基准测试 (基于录制的夹具回放)
+# ==========================================
+# 在回放模式下 (replay.py) 逐阶段串行跑一遍每日流程，记录每个阶段的:
+#   seconds      墙钟耗时
+#   peak_rss_mb  阶段内进程 RSS 峰值 (后台线程采样)
+#   rss_delta_mb 阶段结束时相对开始的 RSS 增量
+#   calls        阶段内上游调用次数 {'akshare:futures_main_sina': 3, ...}
+#   upstream     阶段内各来源累计耗时 (回放时即读夹具 + 注入延迟)
+# 阶段: 导入 / 各 fetch 节点 / 溢价、价差、CFTC 计算 / 每张图单独渲染 / Notion 报告文本
+#
+# 用法:
+#   METALQUANT_DATA_MODE=record METALQUANT_CACHE_DIR=/tmp/empty python pipeline.py   # 先录一次夹具
+#   python benchmark.py run                          # -> benchmarks/latest.json
+#   python benchmark.py run --repeat 3 --latency 0.05
+#   python benchmark.py run --save-baseline          # 同时存为 benchmarks/baseline.json
+#   python benchmark.py compare                      # latest 对比 baseline，有退化时退出码 1
+#
+# 每次运行在临时目录里进行 (空缓存、图表不覆盖 charts_final)，结果可复现。
+# 渲染在当前进程内逐张进行 (不走进程池，便于按图计时和量内存)，不读写 manifest。
+
+BENCH_DIR = "benchmarks"
+LATEST_PATH = os.path.join(BENCH_DIR, "latest.json")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+SAMPLE_INTERVAL = 0.005     # RSS 采样间隔 (秒)
+
+# 退化判定: 相对增幅超过 tolerance 且绝对增量超过 min_delta 才算
+TIME_TOLERANCE = 0.25
+TIME_MIN_DELTA = 0.05       # 秒
+RSS_TOLERANCE = 0.20
+RSS_MIN_DELTA = 10.0        # MB
+
+FETCH_NODES = ["fetch.metals", "fetch.forward", "fetch.cftc", "fetch.compare"]
+
+
+# ==========================================
+# 测量工具
+# ==========================================
+
+def current_rss():
+    """当前进程 RSS (字节)；没有 /proc 时退回到 ru_maxrss (历史峰值)"""
+    try:
+        with open("/proc/self/statm") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+@contextmanager
+def stage(results, name):
+    """记录一个阶段的耗时 / RSS 峰值 / 上游调用；阶段内异常记为 error，不中断后续阶段"""
+    import replay
+    calls0 = dict(replay.CALLS)
+    upstream0 = dict(replay.SECONDS)
+    rss0 = current_rss()
+    peak = [rss0]
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(SAMPLE_INTERVAL):
+            peak[0] = max(peak[0], current_rss())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    entry = {}
+    t0 = time.perf_counter()
+    try:
+        yield entry
+    except Exception as e:
+        entry["error"] = f"{type(e).__name__}: {e}"
+        print(f"   ❌ [{name}] {entry['error']}")
+    finally:
+        seconds = time.perf_counter() - t0
+        stop.set()
+        sampler.join()
+        rss1 = current_rss()
+        calls = {f"{kind}:{api}": n - calls0.get((kind, api), 0)
+                 for (kind, api), n in sorted(replay.CALLS.items()) if n > calls0.get((kind, api), 0)}
+        upstream = {kind: round(sec - upstream0.get(kind, 0.0), 4)
+                    for kind, sec in sorted(replay.SECONDS.items()) if sec > upstream0.get(kind, 0.0)}
+        entry.update({
+            "seconds": round(seconds, 4),
+            "peak_rss_mb": round(max(peak[0], rss1) / 2**20, 1),
+            "rss_delta_mb": round((rss1 - rss0) / 2**20, 1),
+            "calls": calls,
+            "upstream": upstream,
+        })
+        results[name] = entry
+        print(f"   ⏱️ {name:<40} {seconds:7.3f}s  峰值 {entry['peak_rss_mb']:.0f}MB  "
+              f"调用 {sum(calls.values())}")
+
+
+def _git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except Exception:
+        return None
+
+
+# ==========================================
+# 基准流程
+# ==========================================
+
+def run_suite(profile=None):
+    """按 fetch -> compute -> render -> report 串行跑一遍，返回 {阶段名: 指标}"""
+    results = {}
+
+    with stage(results, "setup.import"):
+        import pipeline
+        import main
+        import update_notion
+        import cftc_fetcher
+        import forward_curve
+        import comex_comparison
+        import chart_renderer
+        from term_structure import main_spread
+
+    # --- fetch: 每个节点单独计时 (节点内部仍按原样并发) ---
+    fetched = {}
+    for name in FETCH_NODES:
+        with stage(results, name):
+            fetched[name] = pipeline.NODES[name].func()
+
+    # --- compute ---
+    premiums = None
+    with stage(results, "compute.premiums"):
+        premiums = main.compute_metal_premiums(fetched["fetch.metals"])
+
+    with stage(results, "compute.spreads"):
+        for curve in (fetched.get("fetch.forward") or {}).values():
+            main_spread(curve)
+
+    specs = []
+    with stage(results, "compute.cftc"):
+        cot = fetched.get("fetch.cftc")
+        if cot is not None and not cot.empty:
+            specs += [cftc_fetcher.cftc_chart(cot, metal_name, cftc_code, output_file,
+                                              history=cftc_fetcher.load_cftc_history(cftc_code))
+                      for metal_name, cftc_code, output_file in cftc_fetcher.CFTC_CHARTS]
+
+    # 其余图表的数据整理 (不含绘图)
+    with stage(results, "compute.chart_specs"):
+        if "fetch.metals" in fetched:
+            specs += main.metal_charts(fetched["fetch.metals"], premiums)
+        if "fetch.forward" in fetched:
+            specs.append(forward_curve.forward_chart(fetched["fetch.forward"]))
+        frames = fetched.get("fetch.compare") or {}
+        specs += [comex_comparison.comparison_chart(frames.get(metal_name), metal_name, file_path)
+                  for _, _, metal_name, file_path in comex_comparison.COMPARE_PAIRS]
+
+    # --- render: 每张图单独计时 ---
+    for spec in filter(None, specs):
+        spec.resolve(profile)
+        with stage(results, f"render.{spec.name}") as entry:
+            _, size = chart_renderer.render_one(spec)
+            entry["bytes"] = size
+
+    # --- Notion 报告文本 (内部还会选主力合约、拉日线，调用次数一并统计) ---
+    with stage(results, "report.notion") as entry:
+        report = update_notion.build_report_safely(curves=fetched.get("fetch.forward"), premiums=premiums,
+                                                     cot=fetched.get("fetch.cftc"))
+        entry["chars"] = len(report)
+
+    return results
+
+
+def run_once(profile=None, latency=None, keep=False):
+    """在临时目录 + 空缓存里跑一次完整基准，返回结果 (含环境信息)"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    fixtures = os.path.abspath(os.getenv("METALQUANT_FIXTURES", os.path.join(here, "fixtures")))
+    if not os.path.exists(os.path.join(fixtures, "index.json")):
+        raise SystemExit(f"❌ 夹具目录 {fixtures} 为空，请先用 METALQUANT_DATA_MODE=record 录制一次")
+
+    workdir = tempfile.mkdtemp(prefix="metalquant-bench-")
+    # replay / data_cache 在导入时读取这些环境变量，必须在导入任何项目模块之前设置
+    os.environ.update({
+        "METALQUANT_DATA_MODE": "replay",
+        "METALQUANT_FIXTURES": fixtures,
+        "METALQUANT_CACHE_DIR": os.path.join(workdir, ".cache"),
+    })
+    if latency is not None:
+        os.environ["METALQUANT_REPLAY_LATENCY"] = latency
+    if here not in sys.path:
+        sys.path.insert(0, here)
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    t0 = time.perf_counter()
+    try:
+        stages = run_suite(profile)
+    finally:
+        os.chdir(cwd)
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    import replay
+    import chart_renderer
+    return {
+        "meta": {
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "fixtures": fixtures,
+            "latency": os.getenv("METALQUANT_REPLAY_LATENCY", ""),
+            "profile": profile or chart_renderer.DEFAULT_PROFILE,
+            "repeat": 1,
+        },
+        "total_seconds": round(time.perf_counter() - t0, 4),
+        "upstream": {kind: round(sec, 4) for kind, sec in sorted(replay.SECONDS.items())},
+        "stages": stages,
+    }
+
+
+def run_repeated(n, profile=None, latency=None):
+    """每次都起一个新进程 (冷启动、空缓存)，各数值指标取中位数"""
+    runs = []
+    for i in range(n):
+        print(f"\n🔁 第 {i + 1}/{n} 次")
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as fp:
+            out = fp.name
+        cmd = [sys.executable, os.path.abspath(__file__), "run", "-o", out]
+        if profile:
+            cmd += ["--profile", profile]
+        if latency is not None:
+            cmd += ["--latency", latency]
+        subprocess.run(cmd, check=True)
+        with open(out, encoding="utf-8") as fp:
+            runs.append(json.load(fp))
+        os.remove(out)
+
+    merged = runs[-1]
+    merged["meta"]["repeat"] = n
+    merged["total_seconds"] = statistics.median(r["total_seconds"] for r in runs)
+    for name, entry in merged["stages"].items():
+        for key in ("seconds", "peak_rss_mb", "rss_delta_mb"):
+            values = [r["stages"][name][key] for r in runs if name in r["stages"]]
+            entry[key] = round(statistics.median(values), 4)
+    return merged
+
+
+def save(result, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as fp:
+        json.dump(result, fp, indent=1, ensure_ascii=False)
+        fp.write("\n")
+    os.replace(path + ".tmp", path)
+
+
+def print_summary(result):
+    stages = result["stages"]
+    groups = {}
+    for name, entry in stages.items():
+        group = name.split(".")[0]
+        groups[group] = groups.get(group, 0.0) + entry["seconds"]
+    print(f"\n📊 总耗时 {result['total_seconds']:.2f}s，RSS 峰值 "
+          f"{max(e['peak_rss_mb'] for e in stages.values()):.0f}MB")
+    for group, sec in groups.items():
+        print(f"   {group:<10} {sec:7.2f}s")
+    slowest = sorted(stages.items(), key=lambda kv: -kv[1]["seconds"])[:5]
+    print("   最慢: " + ", ".join(f"{n} {e['seconds']:.2f}s" for n, e in slowest))
+    failed = [n for n, e in stages.items() if "error" in e]
+    if failed:
+        print(f"   ⚠️ 出错阶段: {', '.join(failed)}")
+
+
+# ==========================================
+# 对比
+# ==========================================
+
+def compare(baseline, current, time_tol=TIME_TOLERANCE, time_min=TIME_MIN_DELTA,
+            rss_tol=RSS_TOLERANCE, rss_min=RSS_MIN_DELTA):
+    """返回退化列表 [(阶段, 指标, 基线值, 当前值, 说明), ...]"""
+    regressions = []
+    base_stages, cur_stages = baseline["stages"], current["stages"]
+    for name, base in base_stages.items():
+        cur = cur_stages.get(name)
+        if cur is None:
+            regressions.append((name, "stage", "present", "missing", "阶段缺失"))
+            continue
+        if "error" in cur and "error" not in base:
+            regressions.append((name, "error", "-", cur["error"], "新出现的错误"))
+        for key, tol, floor in (("seconds", time_tol, time_min), ("peak_rss_mb", rss_tol, rss_min)):
+            b, c = base.get(key), cur.get(key)
+            if b is None or c is None:
+                continue
+            if c - b > floor and c > b * (1 + tol):
+                regressions.append((name, key, b, c, f"+{(c / b - 1) * 100 if b else float('inf'):.0f}%"))
+        # 回放数据是确定的，调用次数变多就是代码行为变了 (缓存失效、重复请求等)
+        for api, n in cur.get("calls", {}).items():
+            b = base.get("calls", {}).get(api, 0)
+            if n > b:
+                regressions.append((name, f"calls[{api}]", b, n, f"+{n - b}"))
+    return regressions
+
+
+def print_comparison(baseline, current, regressions):
+    print(f"📏 基线 {baseline['meta'].get('git')} ({baseline['meta'].get('created')}) "
+          f"vs 当前 {current['meta'].get('git')} ({current['meta'].get('created')})")
+    for key in ("profile", "latency", "cpus"):
+        if baseline["meta"].get(key) != current["meta"].get(key):
+            print(f"   ⚠️ 运行条件不同: {key} {baseline['meta'].get(key)!r} -> {current['meta'].get(key)!r}")
+    print(f"   总耗时 {baseline['total_seconds']:.2f}s -> {current['total_seconds']:.2f}s")
+    print(f"   {'阶段':<40} {'基线':>9} {'当前':>9} {'变化':>8}")
+    for name, cur in current["stages"].items():
+        base = baseline["stages"].get(name)
+        if base is None:
+            print(f"   {name:<40} {'-':>9} {cur['seconds']:8.3f}s {'(新增)':>8}")
+            continue
+        b, c = base["seconds"], cur["seconds"]
+        change = f"{(c / b - 1) * 100:+.0f}%" if b else "-"
+        print(f"   {name:<40} {b:8.3f}s {c:8.3f}s {change:>8}")
+    if not regressions:
+        print("✅ 没有退化")
+        return
+    print(f"\n🚨 发现 {len(regressions)} 处退化:")
+    for name, key, b, c, note in regressions:
+        print(f"   {name:<40} {key:<28} {b} -> {c} ({note})")
+
+
+def _load(path):
+    with open(path, encoding="utf-8") as fp:
+        return json.load(fp)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Metal Quant 流水线基准测试 (回放夹具)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="跑一次基准并写 JSON")
+    p_run.add_argument("-o", "--output", default=LATEST_PATH, help=f"结果路径 (默认 {LATEST_PATH})")
+    p_run.add_argument("--repeat", type=int, default=1, help="重复次数 (每次新进程，取中位数)")
+    p_run.add_argument("--latency", help="注入回放延迟，同 METALQUANT_REPLAY_LATENCY")
+    p_run.add_argument("--profile", help="图表输出规格 (默认取 METALQUANT_CHART_PROFILE)")
+    p_run.add_argument("--save-baseline", action="store_true", help=f"同时存为基线 {BASELINE_PATH}")
+    p_run.add_argument("--keep", action="store_true", help="保留临时工作目录 (查看生成的图)")
+
+    p_cmp = sub.add_parser("compare", help="对比两次结果，有退化时退出码为 1")
+    p_cmp.add_argument("baseline", nargs="?", default=BASELINE_PATH)
+    p_cmp.add_argument("current", nargs="?", default=LATEST_PATH)
+    p_cmp.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE, help="耗时相对增幅阈值")
+    p_cmp.add_argument("--time-min", type=float, default=TIME_MIN_DELTA, help="耗时绝对增量下限 (秒)")
+    p_cmp.add_argument("--rss-tolerance", type=float, default=RSS_TOLERANCE, help="内存相对增幅阈值")
+    p_cmp.add_argument("--rss-min", type=float, default=RSS_MIN_DELTA, help="内存绝对增量下限 (MB)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        if args.repeat > 1:
+            result = run_repeated(args.repeat, args.profile, args.latency)
+        else:
+            result = run_once(args.profile, args.latency, args.keep)
+        save(result, args.output)
+        if args.save_baseline:
+            save(result, BASELINE_PATH)
+        print_summary(result)
+        print(f"💾 结果已写入 {args.output}")
+    else:
+        baseline, current = _load(args.baseline), _load(args.current)
+        regressions = compare(baseline, current, args.time_tolerance, args.time_min,
+                              args.rss_tolerance, args.rss_min)
+        print_comparison(baseline, current, regressions)
+        sys.exit(1 if regressions else 0)
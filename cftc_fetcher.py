@@ -1,18 +1,34 @@
 import pandas as pd
-import matplotlib.pyplot as plt
 import datetime
 import io
-import requests
 import zipfile
-import platform
+import os
+import json
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from data_cache import CACHE_DIR, safe_name
+from chart_renderer import ChartSpec, render_charts
+from replay import http_get
+import instrumentation
 
-# --- 全局设置 ---
-system_name = platform.system()
-if system_name == "Windows":
-    plt.rcParams['font.sans-serif'] = ['SimHei']
-elif system_name == "Darwin":
-    plt.rcParams['font.sans-serif'] = ['Arial Unicode MS']
-plt.rcParams['axes.unicode_minus'] = False
+# CFTC 原始文件与解析结果的本地缓存目录
+CFTC_CACHE_DIR = os.path.join(CACHE_DIR, "cftc")
+
+# CFTC 图表清单: (名称, 合约代码, 输出文件)
+CFTC_CHARTS = [
+    ("Gold", "088691", "charts_final/Fig_CFTC_Gold.png"),
+    ("Silver", "084691", "charts_final/Fig3_CFTC_Silver.png"),       # Fig 3
+    ("Platinum", "076651", "charts_final/Fig4_CFTC_Platinum.png"),   # Fig 4
+]
+
+# 多年历史表: 每个合约代码一个 Parquet，单品种全历史毫秒级读取
+CFTC_HISTORY_DIR = os.path.join(CFTC_CACHE_DIR, "history")
+BACKFILL_START_YEAR = 2010
+
+# 默认只保留图表用到的合约，解析时即过滤
+CFTC_CODES = sorted({code for _, code, _ in CFTC_CHARTS})
+CHUNK_SIZE = 50_000
 
 def find_col(df, keywords):
     """辅助函数：根据关键词模糊查找列名"""
@@ -23,71 +39,158 @@ def find_col(df, keywords):
             return col
     return None
 
-def download_cftc_year(year):
+def cftc_paths(year):
+    """本地缓存: 原始 ZIP / 响应头 (ETag, Last-Modified) / 解析后的列存表"""
+    base = os.path.join(CFTC_CACHE_DIR, f"deacot{year}")
+    return base + ".zip", base + ".json", base + ".parquet"
+
+def resolve_cot_columns(header):
+    """
+    表头 -> [日期列, 代码列, 多头列, 空头列]，只解析一次
+    找不齐返回 None
+    """
+    cols = pd.DataFrame(columns=header)
+    found = [
+        # 日期列通常叫 "As_of_Date_In_Form_YYMMDD"
+        find_col(cols, ["DATE", "YYMMDD"]),
+        # 代码列通常叫 "CFTC_Contract_Market_Code"
+        find_col(cols, ["CODE", "MARKET"]),
+        # 投机多头 "NonComm_Positions_Long_All"
+        find_col(cols, ["NON", "LONG", "ALL"]),
+        # 投机空头 "NonComm_Positions_Short_All"
+        find_col(cols, ["NON", "SHORT", "ALL"]),
+    ]
+    return found if all(found) else None
+
+def parse_cot_csv(open_stream, codes=None, encoding=None, chunksize=CHUNK_SIZE):
+    """
+    流式解析 COT CSV
+    open_stream: 每次调用返回一个新的文件流 (zip 成员流不可 seek，需要重新打开)
+    codes: 只保留这些合约代码 (None = 全部)，边读边过滤
+    """
+    with open_stream() as f:
+        header = pd.read_csv(f, nrows=0, encoding=encoding).columns
+    cols = resolve_cot_columns(header)
+    if cols is None:
+        print("      ❌ 无法识别列名，文件结构可能已变。")
+        print(f"      检测到的列: {list(header)}")
+        return pd.DataFrame()
+    col_date, col_code, col_long, col_short = cols
+
+    # 只读 4 列，全部按字符串读: 日期/代码保住前导 0，持仓列合并后再转数值 (空白 / "." 之类的占位记为缺失)
+    dtype = {col_date: str, col_code: str, col_long: str, col_short: str}
+    parts = []
+    with open_stream() as f:
+        with pd.read_csv(f, usecols=cols, dtype=dtype, encoding=encoding, chunksize=chunksize) as reader:
+            for chunk in reader:
+                chunk = chunk[cols].copy()
+                chunk.columns = ['Date', 'Code', 'Long', 'Short']
+                # 代码补零 (88691 -> 088691)
+                chunk['Code'] = chunk['Code'].str.strip().str.split('.').str[0].str.zfill(6)
+                if codes is not None:
+                    chunk = chunk[chunk['Code'].isin(codes)]
+                parts.append(chunk)
+
+    data = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=['Date', 'Code', 'Long', 'Short'])
+    # 日期解析: 格式通常是 YYMMDD (例如 250101)，去除无效日期
+    data['Date'] = pd.to_datetime(data['Date'].str.strip(), format='%y%m%d', errors='coerce')
+    data = data.dropna(subset=['Date'])
+    data['Long'] = pd.to_numeric(data['Long'].str.strip(), errors='coerce').fillna(0)
+    data['Short'] = pd.to_numeric(data['Short'].str.strip(), errors='coerce').fillna(0)
+    return data.reset_index(drop=True)
+
+def parse_cftc_zip(content, year, codes=None):
+    """
+    智能解析 CFTC ZIP (V5: 表头识别 + 按列流式读取)
+    返回标准化的 (Date, Code, Long, Short) 表
+    """
+    with zipfile.ZipFile(io.BytesIO(content)) as z:
+        filename = z.namelist()[0]
+        open_stream = lambda: z.open(filename)
+        try:
+            data = parse_cot_csv(open_stream, codes)
+        except UnicodeDecodeError:
+            # 如果编码报错，重新打开成员流用 latin1 读
+            data = parse_cot_csv(open_stream, codes, encoding='latin1')
+
+    if not data.empty:
+        print(f"      ✅ 成功解析 {year} 数据: {len(data)} 条 (由智能表头识别)")
+    return data
+
+def _covers(parsed_codes, codes):
+    """本地解析结果是否包含所需合约 (None 表示全部合约)"""
+    if parsed_codes is None:
+        return True
+    return codes is not None and set(codes) <= set(parsed_codes)
+
+def _load_parsed(parsed_path, codes):
+    data = pd.read_parquet(parsed_path)
+    return data if codes is None else data[data['Code'].isin(codes)].reset_index(drop=True)
+
+def _save_parsed(data, parsed_path):
+    tmp = parsed_path + ".tmp"
+    data.to_parquet(tmp, index=False)
+    os.replace(tmp, parsed_path)
+
+def download_cftc_year(year, codes=CFTC_CODES):
     """
-    下载并智能解析 CFTC ZIP (V4: 基于表头自动匹配)
+    下载并解析某一年的 CFTC 持仓 (带条件请求缓存)
+    - 本地有 ZIP 时带 If-None-Match / If-Modified-Since，未更新 (304) 直接读列存表，不再解析 CSV
+    - 有更新 (200) 则覆盖 ZIP，重新解析并落盘
+    codes: 只保留这些合约 (None = 全部)
     """
     url = f"https://www.cftc.gov/files/dea/history/deacot{year}.zip"
+    zip_path, meta_path, parsed_path = cftc_paths(year)
     print(f"   ☁️ [CFTC] 尝试下载 {year}: {url} ...")
+
+    meta = {}
+    if os.path.exists(meta_path):
+        with open(meta_path) as fp:
+            meta = json.load(fp)
+    parsed_ok = os.path.exists(parsed_path) and _covers(meta.get("codes"), codes)
     
     try:
         headers = {'User-Agent': 'Mozilla/5.0'}
-        r = requests.get(url, headers=headers)
+        if os.path.exists(zip_path):
+            if meta.get("etag"):
+                headers['If-None-Match'] = meta["etag"]
+            if meta.get("last_modified"):
+                headers['If-Modified-Since'] = meta["last_modified"]
+
+        r = http_get(url, headers=headers)
         
         if r.status_code == 404:
             print(f"      ⚠️ {year} 数据未发布 (404)，跳过。")
             return pd.DataFrame()
-            
-        with zipfile.ZipFile(io.BytesIO(r.content)) as z:
-            filename = z.namelist()[0]
-            with z.open(filename) as f:
-                # 1. 尝试带表头读取 (header=0)
-                try:
-                    df = pd.read_csv(f, low_memory=False)
-                except:
-                    # 如果编码报错，尝试 latin1
-                    f.seek(0)
-                    df = pd.read_csv(f, low_memory=False, encoding='latin1')
-
-                # 2. 智能寻找关键列
-                # 日期列通常叫 "As_of_Date_In_Form_YYMMDD"
-                col_date = find_col(df, ["DATE", "YYMMDD"])
-                # 代码列通常叫 "CFTC_Contract_Market_Code"
-                col_code = find_col(df, ["CODE", "MARKET"]) 
-                # 投机多头 "NonComm_Positions_Long_All"
-                col_long = find_col(df, ["NON", "LONG", "ALL"])
-                # 投机空头 "NonComm_Positions_Short_All"
-                col_short = find_col(df, ["NON", "SHORT", "ALL"])
-                
-                # 检查是否找齐
-                if not all([col_date, col_code, col_long, col_short]):
-                    print("      ❌ 无法识别列名，文件结构可能已变。")
-                    print(f"      检测到的列: {list(df.columns)}")
-                    return pd.DataFrame()
-
-                # 3. 提取并标准化
-                data = df[[col_date, col_code, col_long, col_short]].copy()
-                data.columns = ['Date', 'Code', 'Long', 'Short']
-                
-                # 4. 清洗数据
-                # 日期解析: 格式通常是 YYMMDD (例如 250101)
-                data['Date'] = pd.to_datetime(data['Date'], format='%y%m%d', errors='coerce')
-                
-                # 去除无效日期
-                data = data.dropna(subset=['Date'])
-                
-                # 代码补零 (88691 -> 088691)
-                data['Code'] = data['Code'].astype(str).str.strip().str.split('.').str[0].str.zfill(6)
-                
-                # 数值转换
-                data['Long'] = pd.to_numeric(data['Long'], errors='coerce').fillna(0)
-                data['Short'] = pd.to_numeric(data['Short'], errors='coerce').fillna(0)
-                
-                print(f"      ✅ 成功解析 {year} 数据: {len(data)} 条 (由智能表头识别)")
-                return data
+
+        if r.status_code == 304:
+            if parsed_ok:
+                print(f"      ✅ {year} 未更新 (304)，读取本地解析结果")
+                return _load_parsed(parsed_path, codes)
+            with open(zip_path, "rb") as fp:
+                content = fp.read()
+        else:
+            r.raise_for_status()
+            content = r.content
+            os.makedirs(CFTC_CACHE_DIR, exist_ok=True)
+            with open(zip_path, "wb") as fp:
+                fp.write(content)
+            meta = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+
+        data = parse_cftc_zip(content, year, codes)
+        if not data.empty:
+            _save_parsed(data, parsed_path)
+            meta["codes"] = None if codes is None else sorted(codes)
+            with open(meta_path, "w") as fp:
+                json.dump(meta, fp)
+        return data
                 
     except Exception as e:
         print(f"      ❌ 下载失败: {e}")
+        if parsed_ok:
+            print(f"      ↩️ 使用本地缓存的 {year} 数据")
+            instrumentation.count("fallback", source="http:get", used=f"cftc {year} local")
+            return _load_parsed(parsed_path, codes)
         return pd.DataFrame()
 
 def get_robust_data():
@@ -106,18 +209,110 @@ def get_robust_data():
         return pd.DataFrame()
         
     full_df = pd.concat(dfs)
+    # 已做过历史回填的话，顺手把最新两年并进去
+    if os.path.isdir(CFTC_HISTORY_DIR):
+        write_cftc_history(full_df)
     full_df.set_index('Date', inplace=True)
     full_df.sort_index(inplace=True)
     return full_df
 
-def plot_cftc_v4(df, metal_name, cftc_code, output_file):
+_cot_lock = threading.Lock()
+_cot_memo = {}
+
+def load_cot_dataset():
+    """
+    进程内共享的 COT 数据集 (Date 索引, Code/Long/Short)
+    首次调用走 get_robust_data (条件请求 + 本地列存)，之后直接复用，调用方不要原地修改
+    取不到数据 (空表) 不缓存，下次调用重新加载；并发的首次调用只加载一次
+    """
+    with _cot_lock:
+        if "cot" not in _cot_memo:
+            data = get_robust_data()
+            if data is None or data.empty:
+                return data
+            _cot_memo["cot"] = data
+        return _cot_memo["cot"]
+
+# ==========================================
+# 多年历史回填 (按合约代码分文件存储)
+# ==========================================
+
+def cftc_history_path(code):
+    return os.path.join(CFTC_HISTORY_DIR, f"{safe_name(code)}.parquet")
+
+def write_cftc_history(data):
+    """把 (Date, Code, Long, Short) 表按合约代码合并进历史文件 (按日期去重)"""
+    os.makedirs(CFTC_HISTORY_DIR, exist_ok=True)
+    for code, part in data.groupby('Code'):
+        path = cftc_history_path(code)
+        part = part[['Date', 'Long', 'Short']]
+        if os.path.exists(path):
+            part = pd.concat([pd.read_parquet(path), part])
+        part = part.drop_duplicates(subset='Date', keep='last').sort_values('Date')
+        tmp = path + ".tmp"
+        part.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+
+def load_cftc_history(code):
+    """读取单个合约的全部历史 (Date 为索引)，没有回填过返回空表"""
+    path = cftc_history_path(code)
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    return pd.read_parquet(path).set_index('Date')
+
+def backfill_cftc(start_year=BACKFILL_START_YEAR, end_year=None, codes=CFTC_CODES, workers=4):
+    """
+    并发下载 start_year..end_year 的年度 ZIP 并写入按合约分文件的历史表
+    (每年的 ZIP 本身有条件请求缓存，重复回填只是一串 304)
+    """
+    end_year = end_year or datetime.datetime.now().year
+    years = list(range(start_year, end_year + 1))
+    print(f"🗄️ [CFTC] 回填 {start_year}-{end_year} 共 {len(years)} 年 (线程数 {workers})...")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        frames = list(pool.map(lambda y: download_cftc_year(y, codes), years))
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        print("❌ 回填失败: 没有任何年份下载成功")
+        return 0
+
+    data = pd.concat(frames, ignore_index=True)
+    write_cftc_history(data)
+    print(f"✅ 回填完成: {len(data)} 条, {data['Code'].nunique()} 个合约 -> {CFTC_HISTORY_DIR}")
+    return len(data)
+
+def draw_cftc(fig, data, metal_name, band=None):
+    """data: 净头寸序列；band: 长期基准 (10%, 中位数, 90%, 起始年)"""
+    ax = fig.subplots()
+    ax.plot(data.index, data, color='#1f77b4', linewidth=2, marker='o', markersize=4)
+    
+    last_val = data.iloc[-1]
+    d_end = data.index[-1].strftime('%Y-%m-%d')
+    
+    ax.set_title(f'CFTC {metal_name} Speculative Net Positions\nLatest: {int(last_val):,} ({d_end})', fontsize=12)
+    ax.set_ylabel('Net Long Contracts')
+    ax.axhline(0, color='black', linestyle='--', alpha=0.5)
+
+    # 长期基准 (需先运行回填)
+    if band is not None:
+        lo, mid, hi, since = band
+        ax.axhspan(lo, hi, color='gray', alpha=0.1, label=f'10%-90% since {since}')
+        ax.axhline(mid, color='gray', linestyle=':', label=f'Median since {since}: {int(mid):,}')
+        ax.legend(loc='upper left', fontsize=9)
+    ax.grid(True, alpha=0.3)
+
+def cftc_chart(df, metal_name, cftc_code, output_file, history=None):
+    """
+    返回该合约净头寸图的 ChartSpec (无数据为 None)
+    history: 该合约的多年历史 (load_cftc_history)，有则画长期中位数与 10%/90% 分位带
+    """
     print(f"   🔍 绘图: {metal_name} (Code: {cftc_code})...")
     
     data = df[df['Code'] == cftc_code].copy()
     
     if data.empty:
         print(f"      ⚠️ 未找到 {metal_name} 数据 (Code: {cftc_code})")
-        return
+        return None
 
     # 计算净头寸
     data['Net_Spec'] = data['Long'] - data['Short']
@@ -127,39 +322,41 @@ def plot_cftc_v4(df, metal_name, cftc_code, output_file):
     
     if data_plot.empty:
         print("      ⚠️ 数据处理后为空")
-        return
+        return None
 
     # 打印时间范围供确认
     d_start = data_plot.index[0].strftime('%Y-%m-%d')
     d_end = data_plot.index[-1].strftime('%Y-%m-%d')
     print(f"      📅 绘图区间: {d_start} -> {d_end}")
 
-    # 绘图
-    plt.figure(figsize=(10, 5))
-    plt.plot(data_plot.index, data_plot['Net_Spec'], color='#1f77b4', linewidth=2, marker='o', markersize=4)
-    
-    last_val = data_plot['Net_Spec'].iloc[-1]
-    
-    plt.title(f'CFTC {metal_name} Speculative Net Positions\nLatest: {int(last_val):,} ({d_end})', fontsize=12)
-    plt.ylabel('Net Long Contracts')
-    plt.axhline(0, color='black', linestyle='--', alpha=0.5)
-    plt.grid(True, alpha=0.3)
-    
-    plt.savefig(output_file, dpi=300)
-    print(f"   ✅ 已生成: {output_file}")
+    band = None
+    if history is not None and len(history) > 52:
+        net_hist = history['Long'] - history['Short']
+        lo, mid, hi = net_hist.quantile([0.1, 0.5, 0.9])
+        band = (lo, mid, hi, history.index[0].year)
+
+    return ChartSpec(os.path.basename(output_file), "cftc_fetcher:draw_cftc", data_plot['Net_Spec'],
+                     output_file, metal_name=metal_name, band=band)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CFTC 投机持仓")
+    parser.add_argument("--backfill", type=int, metavar="START_YEAR",
+                        help=f"回填多年历史 (如 {BACKFILL_START_YEAR})，完成后退出")
+    parser.add_argument("--all-codes", action="store_true", help="回填全部合约 (默认只回填图表用到的)")
+    parser.add_argument("--workers", type=int, default=4, help="回填下载线程数")
+    args = parser.parse_args()
+
+    if args.backfill:
+        backfill_cftc(args.backfill, codes=None if args.all_codes else CFTC_CODES, workers=args.workers)
+        raise SystemExit(0)
+
     print("🚀 [CFTC V4] 启动智能表头识别版...")
     
     raw_df = get_robust_data()
     
     if not raw_df.empty:
-        # 1. Gold
-        plot_cftc_v4(raw_df, "Gold", "088691", "charts_final/Fig_CFTC_Gold.png")
-        # 2. Silver (Fig 3)
-        plot_cftc_v4(raw_df, "Silver", "084691", "charts_final/Fig3_CFTC_Silver.png")
-        # 3. Platinum (Fig 4)
-        plot_cftc_v4(raw_df, "Platinum", "076651", "charts_final/Fig4_CFTC_Platinum.png")
+        render_charts([cftc_chart(raw_df, metal_name, cftc_code, output_file, history=load_cftc_history(cftc_code))
+                       for metal_name, cftc_code, output_file in CFTC_CHARTS])
         
         print("\n🎉 CFTC 任务全部完成！请检查图片。")
     else:
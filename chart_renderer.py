@@ -0,0 +1,312 @@
+import os
+import time
+import platform
+import json
+import inspect
+import hashlib
+import datetime
+import threading
+import importlib
+import multiprocessing
+import pandas as pd
+import instrumentation
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# ==========================================
+# 图表渲染子系统 (进程池 + Agg)
+# ==========================================
+# 各模块只负责把数据整理成 ChartSpec (画什么、用哪些数据、存到哪)，
+# 真正的绘图和 300dpi 栅格化在子进程里并行完成:
+# - 子进程固定使用 Agg 后端，不依赖 pyplot 的全局状态，也不需要加锁
+# - 每张图画完 (无论成功失败) 都会 close，长时间运行不会累积 Figure
+# - 返回每张图的渲染耗时
+#
+# 绘图函数签名: draw(fig, data, **options)，在传入的 fig 上作图，不要自己 savefig。
+#
+# 内容寻址缓存: 每张图按 (数据 + 绘图参数 + 绘图函数源码) 算哈希，记在输出目录的
+# manifest.json 里；哈希没变且文件还在就跳过渲染和写盘 (周末 / 每周才更新的 CFTC 图)，
+# 图片文件不被改写，git 也就不会产生无意义的提交。设 METALQUANT_FORCE_RENDER=1 强制重画。
+#
+# 输出规格 (PROFILES): 分辨率 / 格式 / 单张字节上限。整次运行用 METALQUANT_CHART_PROFILE
+# (或 render_charts(profile=...)) 选择，单张图可在 ChartSpec(profile=...) 里单独指定。
+# 超过字节上限的图在渲染后用 Pillow 压缩 (PNG 调色板量化 / WebP 降质量，仍超限再缩小尺寸)。
+# 规格参与内容哈希，换规格会重画。
+
+RENDER_WORKERS = int(os.getenv("METALQUANT_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# format: 输出格式 (决定文件扩展名)；max_bytes: 单张上限，None 为不限
+PROFILES = {
+    "print": {"dpi": 300, "format": "png", "max_bytes": None},       # 原来的 300dpi PNG
+    "web": {"dpi": 120, "format": "png", "max_bytes": 150_000},      # Notion / git 用
+    "webp": {"dpi": 120, "format": "webp", "max_bytes": 80_000},
+    "vector": {"dpi": 100, "format": "svg", "max_bytes": None},
+}
+DEFAULT_PROFILE = os.getenv("METALQUANT_CHART_PROFILE", "print")
+
+MANIFEST_NAME = "manifest.json"
+FORCE_RENDER = os.getenv("METALQUANT_FORCE_RENDER", "") == "1"
+
+_pool = None
+_pool_lock = threading.Lock()
+_manifest_lock = threading.Lock()
+
+
+class ChartSpec:
+    def __init__(self, name, draw, data, path, figsize=(10, 5), dpi=None, profile=None, **options):
+        """
+        name: 图表名 (用于日志/计时)
+        draw: 绘图函数，"模块:函数名" 字符串 (子进程按名字导入)
+        data: 绘图需要的数据 (只放这张图用到的部分，会被序列化到子进程)
+        path: 输出路径 (扩展名按输出规格的格式替换)
+        dpi / profile: 不指定则用本次运行的输出规格
+        """
+        self.name = name
+        self.draw = draw
+        self.data = data
+        self.path = path
+        self.figsize = figsize
+        self.dpi = dpi
+        self.profile = profile
+        self.options = options
+        self.output = None
+
+    def resolve(self, profile=None):
+        """按输出规格确定最终的 路径 / 格式 / dpi / 字节上限 (存在 self.output)"""
+        name = self.profile or profile or DEFAULT_PROFILE
+        if name not in PROFILES:
+            raise KeyError(f"未知输出规格: {name} (可用: {', '.join(PROFILES)})")
+        spec = PROFILES[name]
+        self.output = {
+            "profile": name,
+            "path": os.path.splitext(self.path)[0] + "." + spec["format"],
+            "format": spec["format"],
+            "dpi": self.dpi or spec["dpi"],
+            "max_bytes": spec["max_bytes"],
+        }
+        return self.output
+
+
+def _digest(obj, h):
+    """把绘图数据稳定地喂进哈希 (pandas 对象按内容，容器递归)"""
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        # 日期索引统一精度 (新抓取的是 s，读回 Parquet 后是 ms，数值相同哈希却不同)
+        if isinstance(obj.index, pd.DatetimeIndex):
+            obj = obj.set_axis(obj.index.as_unit("ns"))
+        h.update(repr((type(obj).__name__, getattr(obj, "name", None),
+                       list(getattr(obj, "columns", [])), str(obj.dtypes))).encode())
+        h.update(pd.util.hash_pandas_object(obj, index=True).values.tobytes())
+    elif isinstance(obj, (list, tuple)):
+        h.update(f"{type(obj).__name__}[{len(obj)}]".encode())
+        for item in obj:
+            _digest(item, h)
+    elif isinstance(obj, dict):
+        h.update(f"dict[{len(obj)}]".encode())
+        for key in sorted(obj, key=str):
+            h.update(repr(key).encode())
+            _digest(obj[key], h)
+    else:
+        h.update(repr(obj).encode())
+
+
+def _draw_source(draw):
+    """绘图函数源码 (改了画法也要重画)；取不到就只用名字"""
+    try:
+        module, func = draw.split(":")
+        return inspect.getsource(getattr(importlib.import_module(module), func))
+    except Exception:
+        return draw
+
+
+def spec_hash(spec):
+    h = hashlib.sha1()
+    _digest([spec.draw, _draw_source(spec.draw), tuple(spec.figsize), spec.output, spec.options], h)
+    _digest(spec.data, h)
+    return h.hexdigest()
+
+
+def manifest_path(path):
+    return os.path.join(os.path.dirname(path) or ".", MANIFEST_NAME)
+
+
+def load_manifest(path):
+    try:
+        with open(path, encoding="utf-8") as fp:
+            return json.load(fp)
+    except Exception:
+        return {}
+
+
+def update_manifest(entries):
+    """entries: {图片路径: 哈希}，按输出目录写回各自的 manifest.json"""
+    by_dir = {}
+    for path, digest in entries.items():
+        by_dir.setdefault(manifest_path(path), {})[os.path.basename(path)] = digest
+    with _manifest_lock:
+        for mpath, items in by_dir.items():
+            manifest = load_manifest(mpath)
+            today = datetime.date.today().isoformat()
+            for name, digest in items.items():
+                manifest[name] = {"hash": digest, "rendered": today}
+            os.makedirs(os.path.dirname(mpath) or ".", exist_ok=True)
+            with open(mpath + ".tmp", "w", encoding="utf-8") as fp:
+                json.dump(manifest, fp, indent=1, sort_keys=True)
+                fp.write("\n")
+            os.replace(mpath + ".tmp", mpath)
+
+
+def is_unchanged(spec, digest):
+    path = spec.output["path"]
+    entry = load_manifest(manifest_path(path)).get(os.path.basename(path), {})
+    return entry.get("hash") == digest and os.path.exists(path)
+
+
+def enforce_budget(path, fmt, max_bytes):
+    """
+    渲染后压缩到 max_bytes 以内，返回最终字节数
+    PNG: 调色板量化 + optimize；WebP: 逐级降低质量；仍超限则按比例缩小尺寸
+    """
+    size = os.path.getsize(path)
+    if not max_bytes or size <= max_bytes or fmt not in ("png", "webp"):
+        return size
+    from PIL import Image
+
+    with Image.open(path) as im:
+        im.load()
+    im = im.convert("RGB")
+    scale = 1.0
+    for _ in range(6):
+        out = im if scale == 1.0 else im.resize((int(im.width * scale), int(im.height * scale)), Image.LANCZOS)
+        if fmt == "png":
+            out.quantize(colors=256).save(path + ".tmp", format="PNG", optimize=True)
+            size = os.path.getsize(path + ".tmp")
+        else:
+            for quality in (80, 65, 50):
+                out.save(path + ".tmp", format="WEBP", quality=quality, method=6)
+                size = os.path.getsize(path + ".tmp")
+                if size <= max_bytes:
+                    break
+        if size <= max_bytes:
+            break
+        scale *= max(0.5, min(0.9, (max_bytes / size) ** 0.5))
+    os.replace(path + ".tmp", path)
+    return size
+
+
+def setup_fonts():
+    """中文字体与负号 (原来各脚本在导入时设置，现在只在真正绘图的进程里设置)"""
+    import matplotlib
+    system_name = platform.system()
+    if system_name == "Windows":
+        matplotlib.rcParams['font.sans-serif'] = ['SimHei']
+    elif system_name == "Darwin":
+        matplotlib.rcParams['font.sans-serif'] = ['Arial Unicode MS']
+    matplotlib.rcParams['axes.unicode_minus'] = False
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+    setup_fonts()
+
+
+def render_one(spec):
+    """画一张图并按输出规格保存 (超限则压缩)，返回 (耗时秒数, 字节数)；Figure 一定会被关闭"""
+    import matplotlib.pyplot as plt
+    setup_fonts()
+    module, func = spec.draw.split(":")
+    draw = getattr(importlib.import_module(module), func)
+
+    out = spec.output or spec.resolve()
+    t0 = time.perf_counter()
+    fig = plt.figure(figsize=spec.figsize)
+    try:
+        draw(fig, spec.data, **spec.options)
+        os.makedirs(os.path.dirname(out["path"]) or ".", exist_ok=True)
+        fig.savefig(out["path"], dpi=out["dpi"], format=out["format"])
+    finally:
+        plt.close(fig)
+    size = enforce_budget(out["path"], out["format"], out["max_bytes"])
+    return time.perf_counter() - t0, size
+
+
+def get_pool(workers=None):
+    """全进程共用一个渲染进程池 (多个 pipeline 节点并发提交也只占 workers 个进程)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # 调用方可能是多线程的 (pipeline)，用 spawn 避免 fork 继承锁状态
+            ctx = multiprocessing.get_context("spawn")
+            _pool = ProcessPoolExecutor(max_workers=workers or RENDER_WORKERS, mp_context=ctx,
+                                        initializer=_init_worker)
+        return _pool
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def render_charts(specs, workers=None, force=None, profile=None):
+    """
+    渲染一批图表，返回 {图表名: 耗时秒数}，失败的为 None，内容未变跳过的为 0.0
+    workers=1 时在当前进程内顺序渲染 (调试用)；force=True 忽略 manifest 强制重画
+    profile: 本批图的输出规格 (默认 METALQUANT_CHART_PROFILE，单张图的 spec.profile 优先)
+    """
+    specs = [s for s in specs if s is not None]
+    if not specs:
+        return {}
+    workers = workers or RENDER_WORKERS
+    force = FORCE_RENDER if force is None else force
+    timings, rendered = {}, {}
+
+    t0 = time.perf_counter()
+    todo = []
+    for spec in specs:
+        spec.resolve(profile)
+        digest = spec_hash(spec)
+        if not force and is_unchanged(spec, digest):
+            timings[spec.name] = 0.0
+            instrumentation.emit("render", chart=spec.name, profile=spec.output["profile"], skipped=True)
+            print(f"   ♻️ 未变化，跳过: {spec.output['path']}")
+        else:
+            todo.append((spec, digest))
+
+    def done(spec, digest, result):
+        seconds, size = result
+        timings[spec.name] = seconds
+        rendered[spec.output["path"]] = digest
+        budget = spec.output["max_bytes"]
+        instrumentation.emit("render", chart=spec.name, profile=spec.output["profile"],
+                             seconds=round(seconds, 4), bytes=size, over_budget=bool(budget and size > budget))
+        note = f", 超出上限 {budget / 1e3:.0f}KB" if budget and size > budget else ""
+        print(f"   ✅ 生成: {spec.output['path']} ({seconds:.2f}s, {size / 1e3:.0f}KB{note})")
+
+    if workers <= 1:
+        for spec, digest in todo:
+            try:
+                done(spec, digest, render_one(spec))
+            except Exception as e:
+                timings[spec.name] = None
+                instrumentation.emit("render", chart=spec.name, error=f"{type(e).__name__}: {e}")
+                print(f"   ❌ {spec.name} 渲染失败: {e}")
+    elif todo:
+        pool = get_pool(workers)
+        futures = {pool.submit(render_one, spec): (spec, digest) for spec, digest in todo}
+        for fut in as_completed(futures):
+            spec, digest = futures[fut]
+            try:
+                done(spec, digest, fut.result())
+            except Exception as e:
+                timings[spec.name] = None
+                instrumentation.emit("render", chart=spec.name, error=f"{type(e).__name__}: {e}")
+                print(f"   ❌ {spec.name} 渲染失败: {e}")
+
+    if rendered:
+        update_manifest(rendered)
+    ok = [t for t in timings.values() if t is not None]
+    print(f"   🖼️ 渲染 {len(rendered)}/{len(specs)} 张图 (跳过 {len(specs) - len(todo)} 张未变化)，"
+          f"墙钟 {time.perf_counter() - t0:.1f}s，累计 {sum(ok):.1f}s")
+    return timings
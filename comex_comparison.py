@@ -1,22 +1,19 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import akshare as ak
-import yfinance as yf
+from data_cache import ak
+from replay import download
 import datetime
 import os
-import platform
-
-# --- 设置字体与路径 ---
-system_name = platform.system()
-if system_name == "Windows":
-    plt.rcParams['font.sans-serif'] = ['SimHei']
-elif system_name == "Darwin":
-    plt.rcParams['font.sans-serif'] = ['Arial Unicode MS']
-plt.rcParams['axes.unicode_minus'] = False
+from chart_renderer import ChartSpec, render_charts
 
+# --- 输出路径 (字体由 chart_renderer 统一设置) ---
 OUTPUT_DIR = "charts_final"
-if not os.path.exists(OUTPUT_DIR):
-    os.makedirs(OUTPUT_DIR)
+os.makedirs(OUTPUT_DIR, exist_ok=True)  # pipeline 会在多个线程里同时导入
+
+# 对比清单: (SHFE 代码, COMEX 代码, 名称, 输出文件)
+COMPARE_PAIRS = [
+    ("au0", "GC=F", "Gold", "charts_final/Fig_Compare_Gold.png"),
+    ("ag0", "SI=F", "Silver", "charts_final/Fig_Compare_Silver.png"),
+]
 
 def get_data(symbol_shfe, symbol_comex, start_date):
     print(f"   🔍 获取数据对比: SHFE({symbol_shfe}) vs COMEX({symbol_comex})...")
@@ -35,7 +32,7 @@ def get_data(symbol_shfe, symbol_comex, start_date):
     # 2. 获取 COMEX 数据 (Yfinance)
     # 黄金: GC=F, 白银: SI=F
     try:
-        df_comex = yf.download(symbol_comex, start=start_date, progress=False)
+        df_comex = download(symbol_comex, start=start_date, progress=False)
         if df_comex.empty:
             print("      ❌ COMEX 数据为空")
             return pd.DataFrame()
@@ -54,42 +51,43 @@ def get_data(symbol_shfe, symbol_comex, start_date):
     combined.dropna(inplace=True)
     return combined
 
-def plot_comparison(df, metal_name, file_path):
-    if df.empty: return
-
-    # --- 归一化处理 (Normalize) ---
-    # 让两者都从 100 开始，方便看涨跌幅度的差异
-    df['SHFE_Norm'] = df['SHFE_Close'] / df['SHFE_Close'].iloc[0] * 100
-    df['COMEX_Norm'] = df['COMEX_Close'] / df['COMEX_Close'].iloc[0] * 100
-
-    plt.figure(figsize=(10, 6))
+def draw_comparison(fig, df, metal_name):
+    ax = fig.subplots()
     
     # 绘图
-    plt.plot(df.index, df['SHFE_Norm'], label=f'SHFE {metal_name} (Shanghai)', color='#d62728', linewidth=2)
-    plt.plot(df.index, df['COMEX_Norm'], label=f'COMEX {metal_name} (New York)', color='#1f77b4', linewidth=2, linestyle='--')
+    ax.plot(df.index, df['SHFE_Norm'], label=f'SHFE {metal_name} (Shanghai)', color='#d62728', linewidth=2)
+    ax.plot(df.index, df['COMEX_Norm'], label=f'COMEX {metal_name} (New York)', color='#1f77b4', linewidth=2, linestyle='--')
     
-    plt.title(f'{metal_name} Price Strength Comparison (Normalized)', fontsize=14)
-    plt.ylabel('Relative Performance (Start=100)')
-    plt.legend()
-    plt.grid(True, alpha=0.3)
+    ax.set_title(f'{metal_name} Price Strength Comparison (Normalized)', fontsize=14)
+    ax.set_ylabel('Relative Performance (Start=100)')
+    ax.legend()
+    ax.grid(True, alpha=0.3)
     
     # 标注最新价差逻辑
     last_diff = df['SHFE_Norm'].iloc[-1] - df['COMEX_Norm'].iloc[-1]
     status = "Stronger" if last_diff > 0 else "Weaker"
-    plt.figtext(0.15, 0.82, f"SHFE is {abs(last_diff):.2f}% {status} than COMEX", 
-                bbox=dict(facecolor='white', alpha=0.8), fontsize=10)
+    fig.text(0.15, 0.82, f"SHFE is {abs(last_diff):.2f}% {status} than COMEX", 
+             bbox=dict(facecolor='white', alpha=0.8), fontsize=10)
 
-    plt.savefig(file_path, dpi=300)
-    print(f"      ✅ 生成对比图: {file_path}")
+def comparison_chart(df, metal_name, file_path):
+    """返回对比图的 ChartSpec (无数据为 None)"""
+    if df is None or df.empty: return None
+
+    # --- 归一化处理 (Normalize) ---
+    # 让两者都从 100 开始，方便看涨跌幅度的差异
+    df = df.copy()
+    df['SHFE_Norm'] = df['SHFE_Close'] / df['SHFE_Close'].iloc[0] * 100
+    df['COMEX_Norm'] = df['COMEX_Close'] / df['COMEX_Close'].iloc[0] * 100
+    return ChartSpec(os.path.basename(file_path), "comex_comparison:draw_comparison",
+                     df[['SHFE_Norm', 'COMEX_Norm']], file_path, figsize=(10, 6), metal_name=metal_name)
 
 if __name__ == "__main__":
     # 设定开始时间 (最近半年)
     start_date = (datetime.datetime.now() - datetime.timedelta(days=180)).strftime("%Y-%m-%d")
     
-    # 1. 黄金对比 (au0 vs GC=F)
-    data_gold = get_data("au0", "GC=F", start_date)
-    plot_comparison(data_gold, "Gold", "charts_final/Fig_Compare_Gold.png")
-    
-    # 2. 白银对比 (ag0 vs SI=F)
-    data_silver = get_data("ag0", "SI=F", start_date)
-    plot_comparison(data_silver, "Silver", "charts_final/Fig_Compare_Silver.png")
+    # 黄金 (au0 vs GC=F) / 白银 (ag0 vs SI=F)
+    specs = []
+    for symbol_shfe, symbol_comex, metal_name, file_path in COMPARE_PAIRS:
+        data = get_data(symbol_shfe, symbol_comex, start_date)
+        specs.append(comparison_chart(data, metal_name, file_path))
+    render_charts(specs)
@@ -0,0 +1,212 @@
+import os
+import json
+import datetime
+import numpy as np
+import pandas as pd
+from data_cache import CACHE_DIR, safe_name
+from fetch_planner import FetchPlan
+from history_store import get_history
+from contract_discovery import listed_contracts, contract_month, trading_day
+
+# ==========================================
+# 连续主力序列 (适用于没有 "0" 主连代码的品种，如 GFEX 铂/钯)
+# ==========================================
+# 把单个合约的日线按换月规则拼接成一条连续序列，并做向后复权:
+# - roll="max_oi":  后续合约前一日持仓量超过当前合约即换月
+# - roll="expiry":  当前合约到期前 days_before 个交易日换月
+# - adjust="ratio" 按换月日两合约收盘价之比复权，"difference" 按价差复权
+# 结果落盘，每天只用当前合约和更远的合约做增量延伸。
+
+CONTINUOUS_DIR = os.path.join(CACHE_DIR, "continuous")
+
+# 合约最后交易日: 上期所为交割月 15 日 (EXPIRY_DAY)；广期所为交割月第 10 个交易日 (EXPIRY_TRADING_DAY，工作日近似)
+EXPIRY_DAY = 15
+EXPIRY_TRADING_DAY = {"pt": 10, "pa": 10}
+
+PRICE_COLS = ["open", "high", "low", "close"]
+FIELDS = PRICE_COLS + ["volume", "hold"]
+
+
+def series_paths(root):
+    base = os.path.join(CONTINUOUS_DIR, safe_name(root))
+    return base + ".parquet", base + ".json"
+
+
+def load_continuous(root):
+    """读取已落盘的连续序列 (不更新)，没有则返回空表"""
+    data_path, _ = series_paths(root)
+    return pd.read_parquet(data_path) if os.path.exists(data_path) else pd.DataFrame()
+
+
+def expiry_date(code):
+    """合约到期日 (按交易所规则近似，见 EXPIRY_DAY / EXPIRY_TRADING_DAY)"""
+    y, m = contract_month(code)
+    nth = EXPIRY_TRADING_DAY.get(code[:-4])
+    if nth is not None:
+        return pd.Timestamp(datetime.date(y, m, 1)) - pd.offsets.BDay(1) + pd.offsets.BDay(nth)
+    return pd.Timestamp(datetime.date(y, m, EXPIRY_DAY))
+
+
+def roll_date(code, days_before):
+    """到期前 days_before 个交易日 (工作日近似)"""
+    return expiry_date(code) - pd.offsets.BDay(days_before)
+
+
+def contract_range(root, months_back, today=None):
+    """过去 months_back 个月到当前挂牌远月的全部合约 (逐月)"""
+    today = today or trading_day()
+    last = listed_contracts(root, today)[-1]
+    ly, lm = contract_month(last)
+    codes = []
+    for i in range(-months_back, (ly - today.year) * 12 + (lm - today.month) + 1):
+        y, m = divmod(today.month - 1 + i, 12)
+        codes.append(f"{root}{(today.year + y) % 100:02d}{m + 1:02d}")
+    return codes
+
+
+def fetch_contracts(codes):
+    """并发读取 (并增量更新) 各合约日线，返回 {code: DataFrame}"""
+    plan = FetchPlan()
+    for code in codes:
+        plan.add(code, get_history, "futures_zh_daily_sina", code)
+    return {c: df for c, df in plan.run().items() if df is not None and not df.empty}
+
+
+def _wide(frames, field):
+    """{code: df} -> 日期 x 合约 的宽表"""
+    return pd.DataFrame({c: df[field] for c, df in frames.items() if field in df.columns}).sort_index()
+
+
+def select_active(close, hold, current=None, roll="max_oi", days_before=5):
+    """
+    逐日确定使用的合约 (只看前一日持仓，避免未来函数；只向更远月份换，不回头)
+    返回与 close 同索引的合约代码序列
+    """
+    active = []
+    prev_hold = None
+    for t in close.index:
+        trading = close.columns[close.loc[t].notna()]
+        if current is None:
+            h = hold.loc[t, trading].dropna()
+            current = h.idxmax() if not h.empty else None
+        elif prev_hold is not None:
+            later = [c for c in trading if c > current]
+            ph = prev_hold[later].dropna() if later else pd.Series(dtype=float)
+            if not ph.empty:
+                target = ph.idxmax()
+                if current not in trading:
+                    switch = True
+                elif roll == "max_oi":
+                    switch = ph[target] > np.nan_to_num(prev_hold.get(current, 0))
+                else:
+                    switch = t >= roll_date(current, days_before)
+                if switch:
+                    current = target
+        active.append(current if current in trading else None)
+        prev_hold = hold.loc[t]
+    return pd.Series(active, index=close.index, dtype=object)
+
+
+def stitch(frames, active):
+    """按 active 从各合约取当日行情，拼成未复权的连续表 (含 contract / raw_close)；frames 里没有的合约当天丢弃"""
+    active = active.dropna()
+    missing = ~active.isin(list(frames))
+    if missing.any():
+        print(f"   ⚠️ 缺少合约日线 {sorted(set(active[missing]))}，丢弃 {missing.sum()} 天")
+        active = active[~missing]
+    rows = {}
+    for field in FIELDS:
+        wide = _wide(frames, field).reindex(index=active.index)
+        col_idx = wide.columns.get_indexer(active.values)
+        if (col_idx < 0).any():
+            raise KeyError(f"{field} 缺少合约 {sorted(set(active.values[col_idx < 0]))}")
+        rows[field] = wide.to_numpy(dtype=float)[np.arange(len(active)), col_idx]
+    out = pd.DataFrame(rows, index=active.index)
+    out["contract"] = active.values
+    out["raw_close"] = out["close"]
+    return out
+
+
+def back_adjust(series, frames, adjust="ratio", since=None):
+    """
+    对每个换月点，把换月日之前的价格按 (新合约/旧合约) 收盘价比 (或差) 调整
+    since: 只处理该日期之后的换月 (之前的已经复权过)；已复权的历史会整体平移到最新合约的价格水平
+    """
+    contracts = series["contract"]
+    rolls = contracts.index[contracts.ne(contracts.shift()) & contracts.shift().notna()]
+    if since is not None:
+        rolls = rolls[rolls > since]
+    for t in rolls:
+        i = series.index.get_loc(t)
+        old, new = contracts.iloc[i - 1], contracts.iloc[i]
+        old_close = frames[old]["close"].loc[:t].iloc[-1] if old in frames else series["raw_close"].iloc[i - 1]
+        new_close = series["raw_close"].iloc[i]
+        before = series.index < t
+        if adjust == "ratio":
+            series.loc[before, PRICE_COLS] *= new_close / old_close
+        else:
+            series.loc[before, PRICE_COLS] += new_close - old_close
+        print(f"      🔁 换月 {t:%Y-%m-%d}: {old} -> {new}")
+    return series
+
+
+def build_continuous(root, roll="max_oi", adjust="ratio", days_before=5, months_back=24):
+    """从头构建连续序列 (首次运行或换月/复权规则变化时)"""
+    print(f"   🧵 构建 {root} 连续序列 (roll={roll}, adjust={adjust})...")
+    frames = fetch_contracts(contract_range(root, months_back))
+    if not frames:
+        return pd.DataFrame()
+    active = select_active(_wide(frames, "close"), _wide(frames, "hold"), None, roll, days_before)
+    return back_adjust(stitch(frames, active), frames, adjust)
+
+
+def extend_continuous(stored, root, roll="max_oi", adjust="ratio", days_before=5):
+    """增量延伸: 只读取当前合约及更远的挂牌合约，追加最后日期之后的 K 线"""
+    current = stored["contract"].iloc[-1]
+    last_date = stored.index[-1]
+    codes = sorted({current} | {c for c in listed_contracts(root) if c > current})
+    frames = fetch_contracts(codes)
+    if current not in frames:
+        return stored
+
+    close = _wide(frames, "close").loc[last_date:]
+    hold = _wide(frames, "hold").loc[last_date:]
+    active = select_active(close, hold, current, roll, days_before).iloc[1:]
+    if active.dropna().empty:
+        return stored
+
+    merged = pd.concat([stored, stitch(frames, active)])
+    return back_adjust(merged, frames, adjust, since=last_date)
+
+
+def update_continuous(root, roll="max_oi", adjust="ratio", days_before=5, months_back=24):
+    """
+    取连续序列 (持久化 + 每日增量)
+    返回以日期为索引的表: open/high/low/close (复权), volume, hold, contract, raw_close (未复权)
+    """
+    data_path, state_path = series_paths(root)
+    config = {"roll": roll, "adjust": adjust, "days_before": days_before}
+
+    stored, state = pd.DataFrame(), {}
+    if os.path.exists(data_path) and os.path.exists(state_path):
+        with open(state_path) as fp:
+            state = json.load(fp)
+        if state.get("config") == config:
+            stored = pd.read_parquet(data_path)
+
+    if stored.empty:
+        series = build_continuous(root, roll, adjust, days_before, months_back)
+    elif state.get("day") == trading_day().isoformat():
+        return stored
+    else:
+        series = extend_continuous(stored, root, roll, adjust, days_before)
+
+    if series.empty:
+        return series
+    os.makedirs(CONTINUOUS_DIR, exist_ok=True)
+    series.to_parquet(data_path + ".tmp")
+    os.replace(data_path + ".tmp", data_path)
+    with open(state_path, "w") as fp:
+        json.dump({"config": config, "day": trading_day().isoformat(),
+                   "contract": series["contract"].iloc[-1]}, fp)
+    return series
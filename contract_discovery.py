@@ -0,0 +1,159 @@
+import os
+import json
+import datetime
+import threading
+from collections import defaultdict
+import pytz
+import pandas as pd
+from data_cache import ak, CACHE_DIR
+from fetch_planner import FetchPlan
+from history_store import normalize
+
+# ==========================================
+# 活跃合约发现
+# ==========================================
+# 按当前日期生成挂牌月份 -> 并发探测 -> 按最新持仓量 / 成交量排序，
+# 选出主力合约。排名按交易日缓存，同一天内各脚本共用一个结果。
+
+# 挂牌规则: consecutive = 最近几个连续月，months = 之后允许的月份，horizon = 向后看几个月
+LISTING_RULES = {
+    "au": {"consecutive": 3, "months": (2, 4, 6, 8, 10, 12), "horizon": 13},  # SHFE 黄金
+    "ag": {"consecutive": 12, "months": tuple(range(1, 13)), "horizon": 12},  # SHFE 白银
+    "pt": {"consecutive": 12, "months": tuple(range(1, 13)), "horizon": 12},  # GFEX 铂
+    "pa": {"consecutive": 12, "months": tuple(range(1, 13)), "horizon": 12},  # GFEX 钯
+}
+
+# 最后一根 K 线早于这么多天的合约视为已摘牌/无成交
+STALE_DAYS = 10
+
+RANKING_CACHE = os.path.join(CACHE_DIR, "main_contracts.json")
+_cache_lock = threading.Lock()
+# 同一品种并发调用时只探测一次
+_root_locks = defaultdict(threading.Lock)
+
+
+def trading_day():
+    """以北京时间的日期作为交易日 (缓存键)"""
+    return datetime.datetime.now(pytz.timezone("Asia/Shanghai")).date()
+
+
+def listed_contracts(root, today=None):
+    """按挂牌规则生成当前可能在交易的合约代码，如 ['pt2610', 'pt2611', ...]"""
+    today = today or trading_day()
+    rule = LISTING_RULES[root]
+    codes = []
+    for i in range(rule["horizon"] + 1):
+        y, m = divmod(today.month - 1 + i, 12)
+        year, month = today.year + y, m + 1
+        if i < rule["consecutive"] or month in rule["months"]:
+            codes.append(f"{root}{year % 100:02d}{month:02d}")
+    return codes
+
+
+def contract_month(code):
+    """'pt2606' -> (2026, 6)"""
+    digits = code[-4:]
+    return 2000 + int(digits[:2]), int(digits[2:])
+
+
+def probe_contracts(codes):
+    """并发拉取候选合约日线，返回 {code: 以日期为索引的 DataFrame} (只保留有效合约)"""
+    plan = FetchPlan()
+    for code in codes:
+        plan.add(code, ak.futures_zh_daily_sina, symbol=code)
+    results = plan.run()
+
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=STALE_DAYS)
+    frames = {}
+    for code, df in results.items():
+        if df is None or df.empty or len(df) < 5:
+            continue
+        df = normalize(df, "futures_zh_daily_sina")
+        if df.index[-1] < cutoff:
+            continue
+        frames[code] = df
+    return frames
+
+
+def _load_cache():
+    if not os.path.exists(RANKING_CACHE):
+        return {}
+    try:
+        with open(RANKING_CACHE) as fp:
+            return json.load(fp)
+    except Exception:
+        return {}
+
+
+def _save_cache(root, day, ranking):
+    with _cache_lock:
+        cache = _load_cache()
+        cache[root] = {"day": day, "ranking": ranking}
+        os.makedirs(os.path.dirname(RANKING_CACHE) or ".", exist_ok=True)
+        tmp = RANKING_CACHE + ".tmp"
+        with open(tmp, "w") as fp:
+            json.dump(cache, fp, indent=1)
+        os.replace(tmp, RANKING_CACHE)
+
+
+def rank_contracts(root, refresh=False):
+    """
+    按 (最新持仓量, 最新成交量) 从高到低排序
+    返回 [(code, hold, volume), ...]，当天已排过直接读缓存
+    """
+    with _root_locks[root]:
+        day = trading_day().isoformat()
+        cached = _load_cache().get(root)
+        if not refresh and cached and cached.get("day") == day:
+            return [tuple(r) for r in cached["ranking"]]
+
+        print(f"   🔍 探测 {root} 挂牌合约...")
+        frames = probe_contracts(listed_contracts(root))
+        ranking = []
+        for code, df in frames.items():
+            last = df.iloc[-1]
+            # 缺失 / 非数值 (NaN 为真值，`or 0` 挡不住) 统一记 0，否则排序错乱
+            hold, volume = (pd.to_numeric(last.get(col), errors="coerce") for col in ("hold", "volume"))
+            ranking.append((code, 0.0 if pd.isna(hold) else float(hold), 0.0 if pd.isna(volume) else float(volume)))
+        ranking.sort(key=lambda r: (r[1], r[2]), reverse=True)
+
+        if ranking:
+            _save_cache(root, day, ranking)
+        return ranking
+
+
+def find_main_contract(root):
+    """
+    主力合约 = 最新持仓量最大的合约
+    返回 (code, 以日期为索引的日线)；找不到返回 (None, None)
+    """
+    ranking = rank_contracts(root)
+    if not ranking:
+        print(f"   ❌ {root} 全系合约探测失败 (可能未上市或无成交)")
+        return None, None
+    code = ranking[0][0]
+    df = normalize(ak.futures_zh_daily_sina(symbol=code), "futures_zh_daily_sina")
+    print(f"   ✅ 锁定主力合约: {code} (持仓 {int(ranking[0][1]):,})")
+    return code, df
+
+
+def pick_term_pair(root, min_gap_months=3):
+    """
+    期限结构用的 (近月, 远月)
+    近月 = 主力；远月 = 比近月至少晚 min_gap_months 个月的合约里持仓最大的
+    (没有满足间隔的就取任意更晚的合约)
+    """
+    ranking = rank_contracts(root)
+    if not ranking:
+        return None, None
+    near = ranking[0][0]
+    ny, nm = contract_month(near)
+
+    def gap(code):
+        y, m = contract_month(code)
+        return (y - ny) * 12 + (m - nm)
+
+    later = [r[0] for r in ranking if gap(r[0]) > 0]
+    wide = [c for c in later if gap(c) >= min_gap_months]
+    far = (wide or later or [None])[0]
+    return near, far
@@ -0,0 +1,160 @@
+import os
+import re
+import time
+import json
+import hashlib
+import argparse
+import pandas as pd
+import replay
+import instrumentation
+
+# ==========================================
+# 行情数据磁盘缓存 (所有 akshare 调用统一入口)
+# ==========================================
+# 用法: 把脚本里的 `import akshare as ak` 换成 `from data_cache import ak`
+# 命中缓存时直接读本地 Parquet，不再走网络。
+
+CACHE_DIR = os.getenv("METALQUANT_CACHE_DIR", ".cache")
+AK_CACHE_DIR = os.path.join(CACHE_DIR, "akshare")
+
+# 各数据源的缓存有效期 (秒)。不在表里的接口不缓存，直接透传给 akshare
+CACHE_TTL = {
+    "futures_main_sina": 6 * 3600,               # SHFE 主力连续
+    "futures_zh_daily_sina": 6 * 3600,           # 国内单合约日线
+    "futures_foreign_hist": 6 * 3600,            # COMEX / NYMEX 日线
+    "spot_hist_sge": 6 * 3600,                   # 上金所现货
+    "currency_boc_sina": 12 * 3600,              # 中行汇率
+    "futures_shfe_warehouse_receipt": 12 * 3600, # 上期所仓单
+}
+
+
+def safe_name(text):
+    """文件名安全化 (保留中文、字母、数字、点)"""
+    return re.sub(r"[^\w.]", "_", str(text))
+
+
+def cache_key(func_name, params):
+    """(接口名, 参数) -> 稳定的短哈希"""
+    raw = json.dumps({"func": func_name, "params": params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+
+def cache_path(func_name, params):
+    """缓存文件路径: .cache/akshare/<接口>/<symbol>__<hash>.parquet"""
+    symbol = safe_name(params.get("symbol", "_"))
+    return os.path.join(AK_CACHE_DIR, func_name, f"{symbol}__{cache_key(func_name, params)}.parquet")
+
+
+def is_fresh(path, ttl):
+    return os.path.exists(path) and (time.time() - os.path.getmtime(path)) < ttl
+
+
+def cached_call(func_name, ttl=None, **params):
+    """
+    带缓存的 akshare 调用
+    1. 缓存未过期 -> 读 Parquet
+    2. 否则实时请求，并尝试写入缓存 (写失败不影响返回)
+    3. 请求失败 (含熔断 / 预算用完) 且有过期缓存 -> 返回过期缓存 (最近一次成功的数据)
+    """
+    if ttl is None:
+        ttl = CACHE_TTL.get(func_name, 0)
+    path = cache_path(func_name, params)
+
+    if ttl > 0 and is_fresh(path, ttl):
+        try:
+            df = pd.read_parquet(path)
+            instrumentation.count("cache_hit", source=f"akshare:{func_name}")
+            return df
+        except Exception as e:
+            print(f"   ⚠️ 缓存损坏，重新下载 ({os.path.basename(path)}: {e})")
+
+    try:
+        df = replay.akshare_call(func_name, **params)
+    except Exception as e:
+        # 上游失败 / 熔断 / 预算用完: 有过期缓存就用最近一次成功的数据
+        if ttl > 0 and os.path.exists(path):
+            try:
+                df = pd.read_parquet(path)
+            except Exception:
+                raise e
+            age = (time.time() - os.path.getmtime(path)) / 3600
+            print(f"   ↩️ {func_name}({params.get('symbol', '')}) 获取失败，沿用 {age:.0f} 小时前的缓存: {e}")
+            instrumentation.count("fallback", source=f"akshare:{func_name}", used="lkg")
+            return df
+        raise
+
+    if ttl > 0 and isinstance(df, pd.DataFrame) and not df.empty:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + ".tmp"
+            df.to_parquet(tmp)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"   ⚠️ 缓存写入跳过 ({func_name}: {e})")
+    return df
+
+
+def invalidate(func_name=None, symbol=None):
+    """
+    手动失效缓存
+    - 不传参数: 清空全部
+    - 只传 func_name: 清空该接口
+    - 传 symbol: 只清该品种 (可与 func_name 组合)
+    返回删除的文件数
+    """
+    if not os.path.exists(AK_CACHE_DIR):
+        return 0
+    funcs = [func_name] if func_name else os.listdir(AK_CACHE_DIR)
+    prefix = f"{safe_name(symbol)}__" if symbol is not None else ""
+
+    removed = 0
+    for fn in funcs:
+        folder = os.path.join(AK_CACHE_DIR, fn)
+        if not os.path.isdir(folder):
+            continue
+        for name in os.listdir(folder):
+            if name.startswith(prefix):
+                os.remove(os.path.join(folder, name))
+                removed += 1
+    return removed
+
+
+class _CachedAkshare:
+    """akshare 的替身: 表内接口走缓存，其余接口不缓存；都经过 replay (录制/回放)"""
+
+    def __getattr__(self, name):
+        if name in CACHE_TTL:
+            def call(**params):
+                return cached_call(name, **params)
+        else:
+            # 回放模式不导入 akshare；其余模式保持 hasattr(ak, ...) 的探测语义
+            if replay.mode() != "replay":
+                import akshare
+                getattr(akshare, name)
+            def call(**params):
+                return replay.akshare_call(name, **params)
+        call.__name__ = name
+        return call
+
+
+ak = _CachedAkshare()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="akshare 行情缓存管理")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_clear = sub.add_parser("clear", help="失效缓存")
+    p_clear.add_argument("func", nargs="?", help="接口名，如 futures_main_sina")
+    p_clear.add_argument("--symbol", help="品种代码，如 ag0")
+    sub.add_parser("list", help="列出缓存文件")
+    args = parser.parse_args()
+
+    if args.cmd == "clear":
+        n = invalidate(args.func, args.symbol)
+        print(f"🧹 已删除 {n} 个缓存文件")
+    else:
+        for root, _, files in os.walk(AK_CACHE_DIR):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                age = (time.time() - os.path.getmtime(path)) / 3600
+                print(f"{os.path.relpath(path, AK_CACHE_DIR):<60} {age:6.1f}h")
@@ -1,8 +1,10 @@
-import akshare as ak
+from data_cache import ak
 import pandas as pd
 import matplotlib.pyplot as plt
 import datetime
 import platform
+from premium_engine import compute_premiums, metal_view
+from fx_service import get_usdcny
 
 # --- 1. 基础设置 ---
 system_name = platform.system()
@@ -35,57 +37,18 @@ def plot_real_premium():
     shfe.set_index('日期', inplace=True)
     
     # C. 美元兑人民币汇率 (USD/CNY) - 关键新增！
+    # fx_service: 中行 / Yahoo 并发取先到的有效结果，本地缓存，失败时带 fallback 标记
     print("3. 获取每日美元兑人民币汇率...")
-    # 使用中国银行汇率接口，或者直接用 Akshare 的外汇数据
-    # 这里使用 ak.currency_boc_sina (中国银行) 或 简单的 USDCNY 历史
-    # 为了稳定，我们尝试获取美元指数或离岸人民币，这里用一个通用接口
-    try:
-        # 获取美元兑人民币历史数据
-        # 注意：外汇数据接口较多，我们用 currency_boc_sina 可能较慢，
-        # 这里改用 fx_spot_quote_sina 的历史数据或者是 yfinance 的替代品
-        # 如果 yfinance 还是不行，我们用 akshare 的 'fx_usdcny_daily' (如果存在)
-        # 为保证成功率，我们这里用一个 trick：
-        # 假设 akshare 某个接口能拿到，如果不行，我们暂时模拟一个波动汇率，或者用更稳的接口
-        # 实际最稳的是：ak.stock_zh_index_daily_em(symbol="sh000001") ... 不对
-        # 我们用：ak.currency_pair_map 查一下
-        
-        # 简化方案：使用 akshare 的 index_us_stock_sina (美元指数) 做近似? 不行。
-        # 决定方案：使用 ak.currency_boc_sina 获取 "美元"
-        fx_df = ak.currency_boc_sina(symbol="美元", start_date=start_date_str, end_date=end_date.strftime("%Y%m%d"))
-        fx_df['date'] = pd.to_datetime(fx_df['日期'])
-        fx_df.set_index('date', inplace=True)
-        # 取 '中行汇买价' 或 '中行折算价'，除以100 (因为它是每100美元)
-        fx_df['fx_rate'] = fx_df['中行折算价'].astype(float) / 100
-    except:
-        print("⚠️ 汇率接口超时，尝试备用方案 (模拟 7.1-7.3 波动)...")
-        # 如果抓不到汇率，这里做一个fallback，防止程序崩溃
-        # (实际运行中 ak.currency_boc_sina 通常是可用的)
-        fx_df = pd.DataFrame(index=shfe.index)
-        fx_df['fx_rate'] = 7.20 # 这是一个占位符，如果上面 try 成功，这行不会执行
+    fx_rate = get_usdcny(start_date, end_date)
     
     # --- 3. 数据对齐与计算 ---
     print("4. 数据对齐与计算...")
-    df = pd.DataFrame()
-    df['SHFE_Price'] = shfe['收盘价']
-    
-    # 合并 COMEX
-    df = df.join(comex['close'], how='inner')
-    df.rename(columns={'close': 'COMEX_USD'}, inplace=True)
-    
-    # 合并 汇率 (ffill 处理周末汇率空缺)
-    df = df.join(fx_df['fx_rate'], how='left')
-    df['fx_rate'] = df['fx_rate'].ffill() # 填充空值
-    
-    # 如果还是有空值（比如开头几天），用 7.25 填充
-    df['fx_rate'] = df['fx_rate'].fillna(7.25)
-
-    print(f"   当前使用最新汇率: {df['fx_rate'].iloc[-1]:.4f}")
+    # 汇率 ffill 处理周末空缺，开头仍缺的用 7.25 填充
+    # 理论人民币金价 = (COMEX美元价 * 汇率) / 31.1035
+    premiums = compute_premiums({"Gold": shfe['收盘价']}, {"Gold": comex['close']}, fx_rate)
+    df = metal_view(premiums, "Gold")
 
-    # 计算理论人民币金价 = (COMEX美元价 * 汇率) / 31.1035
-    df['Implied_CNY'] = (df['COMEX_USD'] * df['fx_rate']) / 31.1035
-    
-    # 计算溢价率
-    df['Premium'] = (df['SHFE_Price'] / df['Implied_CNY'] - 1) * 100
+    print(f"   当前使用最新汇率: {df['FX'].iloc[-1]:.4f}")
 
     # --- 4. 绘图 ---
     print("5. 绘图...")
@@ -0,0 +1,60 @@
+import os
+import time
+import instrumentation
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# ==========================================
+# 并发抓取计划
+# ==========================================
+# 先把所有任务需要的数据登记成 job，再用有界线程池同时下载，
+# 总耗时约等于最慢的那一个请求，而不是全部请求之和。
+
+MAX_WORKERS = int(os.getenv("METALQUANT_FETCH_WORKERS", "8"))
+
+
+class FetchPlan:
+    def __init__(self):
+        self.jobs = {}
+        self.errors = {}
+        self.timings = {}
+
+    def add(self, name, func, *args, **kwargs):
+        """登记一个抓取任务 (同名任务只保留一个)"""
+        self.jobs.setdefault(name, (func, args, kwargs))
+        return self
+
+    def _call(self, name):
+        func, args, kwargs = self.jobs[name]
+        t0 = time.perf_counter()
+        try:
+            with instrumentation.timer("fetch", name):
+                return func(*args, **kwargs)
+        finally:
+            self.timings[name] = time.perf_counter() - t0
+
+    def run(self, max_workers=None):
+        """
+        并发执行全部任务
+        返回 {name: 结果}；失败的任务结果为 None，异常记录在 self.errors
+        """
+        results = {}
+        if not self.jobs:
+            return results
+        workers = max(1, min(max_workers or MAX_WORKERS, len(self.jobs)))
+        print(f"   📡 并发抓取 {len(self.jobs)} 个数据源 (线程数 {workers})...")
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(self._call, name): name for name in self.jobs}
+            for fut in as_completed(futures):
+                name = futures[fut]
+                try:
+                    results[name] = fut.result()
+                except Exception as e:
+                    results[name] = None
+                    self.errors[name] = e
+
+        slowest = max(self.timings, key=self.timings.get)
+        print(f"   ⏱️ 抓取完成 {time.perf_counter() - t0:.1f}s "
+              f"(最慢: {slowest} {self.timings[slowest]:.1f}s, 失败 {len(self.errors)} 个)")
+        return results
@@ -0,0 +1,199 @@
+import os
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+import instrumentation
+from data_cache import ak, CACHE_DIR, is_fresh
+from replay import download
+
+# ==========================================
+# 美元兑人民币汇率服务 (全项目共用)
+# ==========================================
+# - 日度汇率落盘到 .cache/fx/USDCNY.parquet，每次只补最后日期之后的部分
+# - 中行 (currency_boc_sina) 与 Yahoo (CNY=X) 同时请求，谁先返回有效数据用谁，
+#   中行接口偶尔很慢时不再拖住整个运行
+# - 两个源都失败: 用本地已存历史；本地也没有才用固定汇率，并打上 fallback 标记
+# 同一进程内只抓一次，之后的调用直接切片。
+
+FX_DIR = os.path.join(CACHE_DIR, "fx")
+FX_PATH = os.path.join(FX_DIR, "USDCNY.parquet")
+FX_TTL = 12 * 3600          # 本地汇率在这段时间内视为最新，不发请求
+FX_TIMEOUT = 20             # 等待任一源返回的最长秒数
+HISTORY_DAYS = 400          # 本地为空时首次拉取的天数
+OVERLAP_DAYS = 7            # 增量拉取时向前重叠几天，覆盖修订过的报价
+DEFAULT_FX = 7.25           # 兜底汇率
+VALID_RANGE = (5.0, 10.0)   # 合理的 USD/CNY 区间，超出视为脏数据
+
+_lock = threading.Lock()
+_memo = {}
+
+
+def fetch_boc(start, end):
+    """中国银行折算价 (每 100 美元) -> 日度序列"""
+    df = ak.currency_boc_sina(symbol="美元", start_date=start.strftime("%Y%m%d"), end_date=end.strftime("%Y%m%d"))
+    rate = pd.Series(df['中行折算价'].astype(float).values / 100, index=pd.to_datetime(df['日期']))
+    return rate.sort_index()
+
+
+def fetch_yahoo(start, end):
+    """Yahoo Finance CNY=X 收盘价"""
+    df = download("CNY=X", start=start.strftime("%Y-%m-%d"), end=(end + datetime.timedelta(days=1)).strftime("%Y-%m-%d"),
+                  progress=False)
+    close = df['Close']
+    if isinstance(close, pd.DataFrame):
+        close = close.iloc[:, 0]
+    return close.astype(float).sort_index()
+
+
+# 按优先级排列: 两个源同时返回时优先用中行
+SOURCES = {"boc": fetch_boc, "yahoo": fetch_yahoo}
+
+
+def _clean(rate):
+    """去时区 / 去重 / 去掉不在合理区间的报价；无有效数据返回 None"""
+    if rate is None or len(rate) == 0:
+        return None
+    rate = rate.dropna()
+    if rate.index.tz is not None:
+        rate.index = rate.index.tz_localize(None)
+    rate.index = rate.index.normalize()
+    rate = rate[~rate.index.duplicated(keep="last")]
+    rate = rate[(rate > VALID_RANGE[0]) & (rate < VALID_RANGE[1])]
+    return rate if not rate.empty else None
+
+
+def hedged_fetch(start, end, sources=None, timeout=FX_TIMEOUT):
+    """
+    并发请求全部源，返回第一个有效结果 (rate, 源名)；全部失败返回 (None, None)
+    不等待较慢的源 (线程在后台自行结束)
+    """
+    sources = sources or SOURCES
+    pool = ThreadPoolExecutor(max_workers=len(sources))
+    futures = {pool.submit(func, start, end): name for name, func in sources.items()}
+    pending = set(futures)
+    try:
+        deadline = datetime.datetime.now() + datetime.timedelta(seconds=timeout)
+        while pending:
+            left = (deadline - datetime.datetime.now()).total_seconds()
+            if left <= 0:
+                break
+            done, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+            for fut in sorted(done, key=lambda f: list(sources).index(futures[f])):
+                name = futures[fut]
+                try:
+                    rate = _clean(fut.result())
+                except Exception as e:
+                    print(f"   ⚠️ 汇率源 {name} 失败: {e}")
+                    continue
+                if rate is not None:
+                    return rate, name
+                print(f"   ⚠️ 汇率源 {name} 无有效数据")
+        return None, None
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def load_fx():
+    if not os.path.exists(FX_PATH):
+        return pd.DataFrame(columns=["rate", "source"])
+    return pd.read_parquet(FX_PATH)
+
+
+def save_fx(df):
+    os.makedirs(FX_DIR, exist_ok=True)
+    df.to_parquet(FX_PATH + ".tmp")
+    os.replace(FX_PATH + ".tmp", FX_PATH)
+
+
+def update_fx():
+    """
+    增量更新本地汇率库，返回 (表, 状态)
+    状态: 'fresh' 本地未过期 / 'boc' / 'yahoo' 本次新拉取 / 'stale' 请求失败用旧数据 / 'empty'
+    """
+    stored = load_fx()
+    if not stored.empty and is_fresh(FX_PATH, FX_TTL):
+        return stored, "fresh"
+
+    end = datetime.datetime.now()
+    if stored.empty:
+        start = end - datetime.timedelta(days=HISTORY_DAYS)
+    else:
+        start = stored.index[-1] - datetime.timedelta(days=OVERLAP_DAYS)
+
+    rate, source = hedged_fetch(start, end)
+    if rate is None:
+        status = "stale" if not stored.empty else "empty"
+        instrumentation.count("fallback", source="fx", used="stale" if status == "stale" else "constant")
+        return stored, status
+    if source != next(iter(SOURCES)):
+        instrumentation.count("fallback", source="fx", used=source)
+
+    fresh = pd.DataFrame({"rate": rate, "source": source})
+    merged = pd.concat([stored, fresh]) if not stored.empty else fresh
+    merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+    save_fx(merged)
+    print(f"   💱 汇率更新 ({source}): 最新 {merged['rate'].iloc[-1]:.4f} @ {merged.index[-1]:%Y-%m-%d}")
+    return merged, source
+
+
+def backfill_fx(start):
+    """本地汇率库最早日期晚于 start 时，补拉 [start, 最早日期] 并入库；返回补到的最早日期 (没有数据返回 None)"""
+    with _lock:
+        stored = load_fx()
+        start = pd.Timestamp(start).normalize()
+        if not stored.empty and stored.index[0] <= start:
+            return stored.index[0]
+        end = stored.index[0] if not stored.empty else pd.Timestamp(datetime.datetime.now()).normalize()
+        rate, source = hedged_fetch(start, end)
+        if rate is None:
+            return stored.index[0] if not stored.empty else None
+        merged = pd.concat([pd.DataFrame({"rate": rate, "source": source}), stored])
+        merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+        save_fx(merged)
+        _memo.clear()
+        print(f"   💱 汇率回补 ({source}): {merged.index[0]:%Y-%m-%d} 起")
+        return merged.index[0]
+
+
+def _history():
+    """同一进程只更新一次"""
+    with _lock:
+        if "fx" not in _memo:
+            _memo["fx"] = update_fx()
+        return _memo["fx"]
+
+
+def get_usdcny(start, end=None):
+    """
+    [start, end] 的日度 USD/CNY (周末/节假日前向填充)
+    返回的 Series 带 attrs: source (数据来源)、fallback (是否用了固定汇率兜底)
+    """
+    end = pd.Timestamp(end or datetime.datetime.now()).normalize()
+    start = pd.Timestamp(start).normalize()
+    days = pd.date_range(start, end, freq="D")
+    stored, status = _history()
+
+    if stored.empty:
+        print(f"   ⚠️ 汇率全部源获取失败，启用备用固定汇率 {DEFAULT_FX}")
+        rate = pd.Series(DEFAULT_FX, index=days, name="fx")
+        rate.attrs = {"source": "constant", "fallback": True}
+        return rate
+
+    if status == "stale":
+        print(f"   ⚠️ 汇率源暂不可用，沿用本地汇率 (截至 {stored.index[-1]:%Y-%m-%d})")
+    rate = stored["rate"].astype(float)
+    rate = rate.reindex(rate.index.union(days)).ffill().bfill().reindex(days).rename("fx")
+    rate.attrs = {"source": status, "fallback": False}
+    return rate
+
+
+def is_fallback(rate):
+    """汇率序列是否为固定值兜底 (None 也算)"""
+    return rate is None or bool(getattr(rate, "attrs", {}).get("fallback", False))
+
+
+def reset():
+    """清空进程内缓存 (下次调用重新检查本地/网络)"""
+    with _lock:
+        _memo.clear()
@@ -0,0 +1,107 @@
+import os
+import pandas as pd
+import instrumentation
+import replay
+from data_cache import ak, CACHE_DIR, CACHE_TTL, is_fresh, safe_name
+
+# ==========================================
+# 本地时间序列库 (按品种追加写入)
+# ==========================================
+# 每个 (接口, 品种) 一个 Parquet 文件，索引为日期。
+# 每次运行只拉取最后一根 K 线之后的数据，合并去重后落盘，
+# 历史可以无限延长而单次运行的耗时不变。
+
+HISTORY_DIR = os.path.join(CACHE_DIR, "history")
+
+# 各接口返回的日期列名
+DATE_COLUMNS = {
+    "futures_main_sina": "日期",
+    "futures_zh_daily_sina": "date",
+    "futures_foreign_hist": "date",
+    "spot_hist_sge": "date",
+}
+
+# 支持按起始日期拉取的接口 -> 参数名 (其余接口只能全量拉取后截尾)
+INCREMENTAL_PARAM = {
+    "futures_main_sina": "start_date",
+}
+
+
+def history_path(source, symbol):
+    return os.path.join(HISTORY_DIR, source, f"{safe_name(symbol)}.parquet")
+
+
+def normalize(df, source):
+    """日期列 -> DatetimeIndex (去时区、排序、去重)"""
+    date_col = DATE_COLUMNS[source]
+    df = df.copy()
+    df[date_col] = pd.to_datetime(df[date_col])
+    df.set_index(date_col, inplace=True)
+    if df.index.tz is not None:
+        df.index = df.index.tz_localize(None)
+    df.sort_index(inplace=True)
+    return df[~df.index.duplicated(keep="last")]
+
+
+def load_history(source, symbol):
+    """读取本地已存历史，没有则返回空表"""
+    path = history_path(source, symbol)
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    return pd.read_parquet(path)
+
+
+def update_history(source, symbol):
+    """
+    增量更新并返回完整历史
+    - 本地为空: 全量拉取
+    - 本地有数据: 只取最后日期 (含) 之后的 K 线，最后一根用新数据覆盖
+    """
+    stored = load_history(source, symbol)
+    path = history_path(source, symbol)
+
+    # 距上次落盘未超过该数据源的 TTL，直接用本地
+    if not stored.empty and is_fresh(path, CACHE_TTL.get(source, 0)):
+        return stored
+
+    params = {"symbol": symbol}
+    incremental = not stored.empty and source in INCREMENTAL_PARAM
+    if incremental:
+        params[INCREMENTAL_PARAM[source]] = stored.index[-1].strftime("%Y%m%d")
+
+    try:
+        if incremental:
+            # 增量请求的起始日期每天都变，走 cached_call 会每天多一个缓存文件；本地历史库就是它的缓存
+            fresh = replay.akshare_call(source, **params)
+        else:
+            fresh = getattr(ak, source)(**params)
+    except Exception as e:
+        if stored.empty:
+            raise
+        print(f"   ↩️ {source}({symbol}) 更新失败，沿用本地历史 (截至 {stored.index[-1]:%Y-%m-%d}): {e}")
+        instrumentation.count("fallback", source=f"akshare:{source}", used="history")
+        return stored
+    if fresh is None or fresh.empty:
+        return stored
+    fresh = normalize(fresh, source)
+
+    if stored.empty:
+        merged = fresh
+    else:
+        fresh = fresh[fresh.index >= stored.index[-1]]
+        merged = pd.concat([stored, fresh])
+        merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    merged.to_parquet(tmp)
+    os.replace(tmp, path)
+    return merged
+
+
+def get_history(source, symbol, start=None):
+    """取历史 (可选截取 start 之后)，返回以日期为索引的 DataFrame"""
+    df = update_history(source, symbol)
+    if start is not None and not df.empty:
+        df = df[df.index > pd.to_datetime(start)]
+    return df.copy()
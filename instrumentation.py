@@ -0,0 +1,299 @@
+import os
+import sys
+import json
+import time
+import datetime
+import argparse
+import threading
+from contextlib import contextmanager
+
+# ==========================================
+# 运行指标 (结构化埋点)
+# ==========================================
+# 上游调用 / 计算与渲染阶段 / 计数器 统一记成事件，一次运行一个 JSON Lines 文件:
+#   upstream  每次上游调用: 来源、接口、品种、耗时、行数、字节数、HTTP 状态、是否出错
+#   stage     pipeline 节点 / 抓取任务 / 其他计时块: 耗时、成功与否
+#   render    每张图: 耗时、字节数、是否因内容未变跳过
+#   counter   缓存命中 (cache_hit)、兜底 (fallback)、重试 (retry) 等
+#   summary   运行结束时的汇总 (各来源 p50/p95/失败数、各阶段耗时)
+# 运行结束时打印汇总表，并往 history.jsonl 追加一行摘要，用来看各数据源几周来的变化:
+#   python instrumentation.py                    # 最近一次运行的汇总表
+#   python instrumentation.py show <run.jsonl>   # 指定某次运行
+#   python instrumentation.py trend --last 14    # 各来源最近 N 次运行的 p95 / 失败数
+#
+# 没有 start_run() 时 (单独跑某个脚本) 所有埋点都是空操作，不占内存。
+
+# 默认放在缓存目录下 (与 data_cache.CACHE_DIR 相同；这里不导入 data_cache，避免和 replay 循环导入)
+RUN_DIR = os.getenv("METALQUANT_RUN_DIR", os.path.join(os.getenv("METALQUANT_CACHE_DIR", ".cache"), "runs"))
+HISTORY_NAME = "history.jsonl"
+KEEP_RUNS = 90      # 单次运行的明细文件最多保留几份 (history.jsonl 不清理)
+
+_lock = threading.Lock()
+_run = {}           # 当前运行: id / started / path / fp / events
+
+
+def active():
+    return bool(_run)
+
+
+def start_run(name="pipeline"):
+    """开始记录一次运行，返回明细文件路径 (已在记录中则沿用)"""
+    with _lock:
+        if _run:
+            return _run["path"]
+        started = datetime.datetime.now()
+        run_id = f"{started:%Y%m%d-%H%M%S}-{os.getpid()}"
+        os.makedirs(RUN_DIR, exist_ok=True)
+        path = os.path.join(RUN_DIR, f"{run_id}.jsonl")
+        _run.update({"id": run_id, "name": name, "started": started, "t0": time.perf_counter(),
+                     "path": path, "fp": open(path, "w", encoding="utf-8"), "events": []})
+    emit("run_start", name=name, argv=sys.argv[1:], pid=os.getpid(),
+         mode=os.getenv("METALQUANT_DATA_MODE", "live"))
+    return path
+
+
+def emit(event, **fields):
+    """记一条事件 (没有进行中的运行时忽略)"""
+    if not _run:
+        return
+    record = {"event": event, "ts": round(time.time(), 3), **fields}
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _lock:
+        if not _run:
+            return
+        _run["events"].append(record)
+        _run["fp"].write(line + "\n")
+        _run["fp"].flush()
+
+
+def count(name, n=1, **labels):
+    """计数器: count('fallback', source='fx', reason='stale')"""
+    emit("counter", name=name, n=n, **labels)
+
+
+def _measure(result):
+    """上游返回值的 (行数, 字节数)，识别不了的为 None"""
+    if result is None:
+        return None, None
+    if hasattr(result, "memory_usage") and hasattr(result, "shape"):
+        try:
+            size = result.memory_usage(deep=True)
+            return len(result), int(size.sum() if hasattr(size, "sum") else size)
+        except Exception:
+            return len(result), None
+    content = getattr(result, "content", None)
+    if isinstance(content, (bytes, bytearray)):
+        return None, len(content)
+    return None, None
+
+
+def upstream(kind, name, params, seconds, result=None, error=None):
+    """一次上游调用 (replay.call 在每次调用后记录)"""
+    if not _run:
+        return
+    rows, size = _measure(result)
+    symbol = params.get("symbol") or params.get("tickers") or params.get("url")
+    emit("upstream", source=f"{kind}:{name}", symbol=symbol, seconds=round(seconds, 4),
+         rows=rows, bytes=size, status=getattr(result, "status_code", None),
+         error=None if error is None else f"{type(error).__name__}: {error}")
+
+
+@contextmanager
+def timer(kind, name, **fields):
+    """计时块: with timer('node', 'fetch.metals'): ...  (异常照常抛出，记为失败)"""
+    t0 = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        emit("stage", kind=kind, name=name, seconds=round(time.perf_counter() - t0, 4),
+             ok=error is None, error=error, **fields)
+
+
+# ==========================================
+# 汇总
+# ==========================================
+
+def _pct(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def summarize(events):
+    """事件列表 -> {'sources': {...}, 'stages': {...}, 'charts': {...}, 'counters': {...}}"""
+    sources, stages, counters = {}, {}, {}
+    charts = {"rendered": 0, "skipped": 0, "failed": 0, "seconds": 0.0, "bytes": 0}
+
+    def src(name):
+        return sources.setdefault(name, {"calls": 0, "errors": 0, "latencies": [], "rows": 0, "bytes": 0,
+                                         "cache_hits": 0, "retries": 0, "fallbacks": 0})
+
+    for e in events:
+        kind = e["event"]
+        if kind == "upstream":
+            s = src(e["source"])
+            s["calls"] += 1
+            s["errors"] += bool(e.get("error"))
+            s["latencies"].append(e["seconds"])
+            s["rows"] += e.get("rows") or 0
+            s["bytes"] += e.get("bytes") or 0
+        elif kind == "stage":
+            key = f"{e['kind']}:{e['name']}"
+            st = stages.setdefault(key, {"seconds": 0.0, "runs": 0, "failed": 0})
+            st["seconds"] = round(st["seconds"] + e["seconds"], 4)
+            st["runs"] += 1
+            st["failed"] += not e["ok"]
+        elif kind == "render":
+            state = "skipped" if e.get("skipped") else "failed" if e.get("error") else "rendered"
+            charts[state] += 1
+            charts["seconds"] = round(charts["seconds"] + (e.get("seconds") or 0), 4)
+            charts["bytes"] += e.get("bytes") or 0
+        elif kind == "counter":
+            name = e["name"]
+            counters[name] = counters.get(name, 0) + e["n"]
+            field = {"cache_hit": "cache_hits", "retry": "retries", "fallback": "fallbacks"}.get(name)
+            if field and e.get("source"):
+                src(e["source"])[field] += e["n"]
+
+    for s in sources.values():
+        lat = s.pop("latencies")
+        s.update({"total": round(sum(lat), 4), "p50": _pct(lat, 0.5), "p95": _pct(lat, 0.95),
+                  "max": max(lat) if lat else None})
+    return {"sources": dict(sorted(sources.items())), "stages": stages, "charts": charts, "counters": counters}
+
+
+def _fmt(sec):
+    return "-" if sec is None else f"{sec:.2f}"
+
+
+def print_summary(summary, seconds=None):
+    head = "📈 运行指标" + (f" (总耗时 {seconds:.1f}s)" if seconds is not None else "")
+    print(f"\n{head}")
+    if summary["sources"]:
+        print(f"   {'来源':<42} {'调用':>4} {'失败':>4} {'缓存':>4} {'兜底':>4} {'重试':>4} "
+              f"{'p50':>6} {'p95':>6} {'最大':>6} {'行数':>7} {'KB':>8}")
+        for name, s in sorted(summary["sources"].items(), key=lambda kv: -kv[1]["total"]):
+            print(f"   {name:<42} {s['calls']:>4} {s['errors']:>4} {s['cache_hits']:>4} {s['fallbacks']:>4} "
+                  f"{s['retries']:>4} {_fmt(s['p50']):>6} {_fmt(s['p95']):>6} {_fmt(s['max']):>6} "
+                  f"{s['rows']:>7} {s['bytes'] / 1e3:>8.0f}")
+    if summary["stages"]:
+        # pipeline 节点逐个列出；抓取任务等数量多的按类别合并成一行
+        groups = {}
+        print(f"   {'阶段':<42} {'耗时':>7} {'次数':>4} {'失败':>4}")
+        for name, st in sorted(summary["stages"].items(), key=lambda kv: -kv[1]["seconds"]):
+            kind = name.split(":", 1)[0]
+            if kind == "node":
+                print(f"   {name:<42} {st['seconds']:>6.2f}s {st['runs']:>4} {st['failed']:>4}")
+            else:
+                groups.setdefault(kind, []).append((name, st))
+        for kind, items in groups.items():
+            slowest, st = items[0]
+            failed = sum(s["failed"] for _, s in items)
+            print(f"   {kind}: {len(items)} 项，累计 {sum(s['seconds'] for _, s in items):.2f}s，"
+                  f"最慢 {slowest.split(':', 1)[1]} {st['seconds']:.2f}s，失败 {failed}")
+    c = summary["charts"]
+    if any(c[k] for k in ("rendered", "skipped", "failed")):
+        print(f"   🖼️ 图表: 渲染 {c['rendered']} / 跳过 {c['skipped']} / 失败 {c['failed']}，"
+              f"累计 {c['seconds']:.1f}s，{c['bytes'] / 1e3:.0f}KB")
+
+
+def _prune():
+    runs = sorted(f for f in os.listdir(RUN_DIR) if f.endswith(".jsonl") and f != HISTORY_NAME)
+    for name in runs[:-KEEP_RUNS]:
+        try:
+            os.remove(os.path.join(RUN_DIR, name))
+        except OSError:
+            pass
+
+
+def finish_run(status="ok"):
+    """结束本次运行: 写汇总事件、打印汇总表、追加 history.jsonl；返回汇总"""
+    if not _run:
+        return None
+    seconds = round(time.perf_counter() - _run["t0"], 3)
+    summary = summarize(list(_run["events"]))
+    emit("summary", status=status, seconds=seconds, **summary)
+    with _lock:
+        run = dict(_run)
+        _run.clear()
+    run["fp"].close()
+
+    print_summary(summary, seconds)
+    digest = {
+        "run": run["id"], "name": run["name"], "started": run["started"].isoformat(timespec="seconds"),
+        "status": status, "seconds": seconds,
+        "sources": {k: {f: s[f] for f in ("calls", "errors", "p95", "total", "fallbacks", "retries")}
+                    for k, s in summary["sources"].items()},
+        "stages": {k: st["seconds"] for k, st in summary["stages"].items()},
+        "charts": summary["charts"],
+    }
+    try:
+        with open(os.path.join(RUN_DIR, HISTORY_NAME), "a", encoding="utf-8") as fp:
+            fp.write(json.dumps(digest, ensure_ascii=False) + "\n")
+        _prune()
+    except Exception as e:
+        print(f"   ⚠️ 运行摘要写入失败: {e}")
+    print(f"   🗂️ 运行明细: {run['path']}")
+    return summary
+
+
+# ==========================================
+# 命令行: 查看明细 / 趋势
+# ==========================================
+
+def load_events(path):
+    with open(path, encoding="utf-8") as fp:
+        return [json.loads(line) for line in fp if line.strip()]
+
+
+def latest_run():
+    if not os.path.isdir(RUN_DIR):
+        return None
+    runs = sorted(f for f in os.listdir(RUN_DIR) if f.endswith(".jsonl") and f != HISTORY_NAME)
+    return os.path.join(RUN_DIR, runs[-1]) if runs else None
+
+
+def print_trend(last=14, source=None):
+    path = os.path.join(RUN_DIR, HISTORY_NAME)
+    if not os.path.exists(path):
+        print(f"❌ 还没有运行记录 ({path})")
+        return
+    runs = load_events(path)[-last:]
+    print(f"📉 最近 {len(runs)} 次运行 ({runs[0]['started'][:10]} ~ {runs[-1]['started'][:10]})")
+    print("   总耗时: " + " ".join(f"{r['seconds']:.0f}s" for r in runs))
+    names = sorted({s for r in runs for s in r["sources"]})
+    for name in names:
+        if source and source not in name:
+            continue
+        cells = [r["sources"].get(name) for r in runs]
+        p95 = " ".join(_fmt(c["p95"]) if c else "  -" for c in cells)
+        errors = sum(c["errors"] for c in cells if c)
+        print(f"   {name:<42} p95 {p95}  失败合计 {errors}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Metal Quant 运行指标")
+    sub = parser.add_subparsers(dest="command")
+    p_show = sub.add_parser("show", help="某次运行的汇总表 (默认最近一次)")
+    p_show.add_argument("path", nargs="?")
+    p_trend = sub.add_parser("trend", help="各数据源最近 N 次运行的 p95 / 失败数")
+    p_trend.add_argument("--last", type=int, default=14)
+    p_trend.add_argument("--source", help="只看名字包含该字符串的来源")
+    args = parser.parse_args()
+
+    if args.command == "trend":
+        print_trend(args.last, args.source)
+    else:
+        path = getattr(args, "path", None) or latest_run()
+        if not path:
+            print(f"❌ 还没有运行记录 ({RUN_DIR})")
+            sys.exit(1)
+        events = load_events(path)
+        final = [e for e in events if e["event"] == "summary"]
+        print(f"🗂️ {path}")
+        print_summary(summarize(events), final[-1]["seconds"] if final else None)
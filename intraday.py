@@ -0,0 +1,267 @@
+import os
+import time
+import datetime
+import argparse
+from collections import deque
+import pandas as pd
+from data_cache import ak, CACHE_DIR
+from replay import download
+from premium_engine import premium_quote
+from rolling_stats import RollingWindow
+from fx_service import get_usdcny, reset as reset_fx
+import snapshot
+
+# ==========================================
+# 盘中溢价监控 (分钟线)
+# ==========================================
+# 日线只能第二天早上才看到夜盘的溢价异动，这里按分钟线盘中跟踪:
+# - 国内: akshare futures_zh_minute_sina (au0 / ag0 连续，近月 / 远月合约用于价差)
+# - 国外: yfinance 1 分钟线 (GC=F / SI=F)，按北京时间对齐，取不晚于国内 bar 的最新一根；
+#   Yahoo 分钟线通常有延迟，国外报价还没覆盖到的国内 bar 先压着，等下一轮国外数据到了再算
+#   (国外超过 HOLD_MAX 分钟没有新报价视为停盘，压着的 bar 放行，溢价记为空)
+# - 每次轮询只处理上次之后的新 bar，溢价 / 量仓比 / 价差在定长滚动窗口上 O(1) 增量更新，
+#   不重算整张表
+# - 每根新 bar 的结果追加到本地 .cache/intraday/<金属>/<日期>.parquet (float32 紧凑存储)，
+#   最新一轮写进 status 快照 (`metalquant status` 可见)
+#
+# 用法:
+#   python intraday.py              # 每 60 秒轮询一次，Ctrl+C 退出
+#   python intraday.py --once       # 只跑一轮
+#   python intraday.py --interval 30 --window 240
+
+INTRADAY_DIR = os.path.join(CACHE_DIR, "intraday")
+
+# 金属 -> (国内分钟线代码, 品种根 (选近/远月), Yahoo 代码)；溢价公式 / 单位 / 币种见 premium_engine
+INTRADAY_METALS = {
+    "Gold": ("au0", "au", "GC=F"),
+    "Silver": ("ag0", "ag", "SI=F"),
+}
+
+POLL_INTERVAL = 60      # 秒
+WINDOW = 240            # 滚动窗口长度 (根 1 分钟 bar，约一个交易时段)
+MAX_LAG = 10            # 国外报价落后国内超过这么多分钟视为停盘，不算溢价
+HOLD_MAX = 30           # 国内 bar 最多等国外报价这么多分钟
+LOCAL_TZ = "Asia/Shanghai"
+
+
+# ==========================================
+# 数据获取 (只返回整理好的 bar，增量由 IntradayMonitor 处理)
+# ==========================================
+
+def fetch_domestic_bars(symbol):
+    """国内 1 分钟线: 以北京时间为索引的 close / volume / hold"""
+    df = ak.futures_zh_minute_sina(symbol=symbol, period="1")
+    if df is None or df.empty:
+        return pd.DataFrame(columns=["close", "volume", "hold"])
+    df = df.copy()
+    df.index = pd.to_datetime(df["datetime"])
+    return df[["close", "volume", "hold"]].astype(float).sort_index()
+
+
+def fetch_foreign_bars(ticker):
+    """Yahoo 1 分钟线收盘价，时区换成北京时间后去掉时区"""
+    df = download(ticker, period="1d", interval="1m", progress=False)
+    if df is None or df.empty:
+        return pd.Series(dtype=float)
+    close = df["Close"]
+    if isinstance(close, pd.DataFrame):
+        close = close.iloc[:, 0]
+    if close.index.tz is None:
+        close.index = close.index.tz_localize("UTC")
+    close.index = close.index.tz_convert(LOCAL_TZ).tz_localize(None)
+    return close.astype(float).dropna().sort_index()
+
+
+# ==========================================
+# 增量监控
+# ==========================================
+
+class IntradayMonitor:
+    def __init__(self, metals=None, window=WINDOW):
+        self.metals = metals or list(INTRADAY_METALS)
+        self.window = window
+        self.fx = None
+        self.pairs = {}         # 金属 -> (近月, 远月)
+        self.state = {m: self._empty_state() for m in self.metals}
+
+    def _empty_state(self):
+        return {
+            "last_bar": None,                       # 已处理的最后一根国内 bar 时间
+            "last_spread": None,                    # 已推入的最后一个价差 bar 时间
+            "foreign": deque(),                     # 窗口内的国外 (时间, 价格)，按时间递增
+            "premium": RollingWindow(self.window),
+            "volume": RollingWindow(self.window),
+            "spread": RollingWindow(self.window),
+            "hold": None,
+            "rows": [],                             # 待落盘的新 bar
+        }
+
+    def usdcny(self):
+        """汇率按日更新即可 (盘中不变)；跨日时清掉 fx_service 的进程内缓存，否则拿到的还是启动当天的汇率"""
+        today = datetime.date.today()
+        if self.fx is None or self.fx[0] != today:
+            if self.fx is not None:
+                reset_fx()
+            rate = get_usdcny(today - datetime.timedelta(days=10), today)
+            self.fx = (today, float(rate.iloc[-1]))
+        return self.fx[1]
+
+    def _pair(self, metal):
+        if metal not in self.pairs:
+            from contract_discovery import pick_term_pair
+            self.pairs[metal] = pick_term_pair(INTRADAY_METALS[metal][1])
+        return self.pairs[metal]
+
+    def spread_bars(self, metal):
+        """近远月分钟线价差 % (只取已推入的最后一根之后的 bar)；合约对不可用返回空"""
+        since = self.state[metal]["last_spread"]
+        near, far = self._pair(metal)
+        if not near or not far:
+            return pd.Series(dtype=float)
+        pair = pd.concat([fetch_domestic_bars(near)["close"], fetch_domestic_bars(far)["close"]],
+                         axis=1, keys=["near", "far"]).dropna()
+        if since is not None:
+            pair = pair[pair.index > since]
+        return (pair["far"] / pair["near"] - 1) * 100
+
+    def update(self, metal, domestic, foreign, spread=None):
+        """
+        喂入一轮拉到的 bar (可以和上一轮重叠)，只处理新 bar
+        domestic: close / volume / hold 的 DataFrame；foreign: 国外收盘价 Series；spread: 价差 % Series
+        国外报价还没覆盖到的国内 bar 留到下一轮 (最多等 HOLD_MAX 分钟)
+        返回新处理的 bar 数
+        """
+        st = self.state[metal]
+        fx = self.usdcny()
+
+        new = domestic if st["last_bar"] is None else domestic[domestic.index > st["last_bar"]]
+        if st["foreign"] and not foreign.empty:
+            foreign = foreign[foreign.index > st["foreign"][-1][0]]
+        st["foreign"].extend(foreign.items())
+        if spread is not None and not spread.empty:
+            for value in spread.values:
+                st["spread"].push(float(value))
+            st["last_spread"] = spread.index[-1]
+
+        if not new.empty:
+            ready = new.index <= new.index[-1] - pd.Timedelta(minutes=HOLD_MAX)
+            if st["foreign"]:
+                ready |= new.index <= st["foreign"][-1][0]
+            new = new[ready]
+
+        # 双指针: 国内 bar 和国外报价都按时间递增，as-of 对齐不需要回看
+        fgn, fgn_i = list(st["foreign"]), 0
+        fgn_price, fgn_time = None, None
+        for ts, bar in new.iterrows():
+            while fgn_i < len(fgn) and fgn[fgn_i][0] <= ts:
+                fgn_time, fgn_price = fgn[fgn_i]
+                fgn_i += 1
+            st["volume"].push(float(bar["volume"]))
+            st["hold"] = float(bar["hold"])
+            premium = None
+            if fgn_price and (ts - fgn_time) <= pd.Timedelta(minutes=MAX_LAG):
+                premium = premium_quote(metal, bar["close"], fgn_price, fx)
+                st["premium"].push(premium)
+            st["rows"].append({
+                "time": ts, "domestic": bar["close"], "foreign": fgn_price,
+                "premium": premium, "zscore": st["premium"].zscore(premium) if premium is not None else None,
+                "vol_oi": self.vol_oi(metal), "spread": st["spread"].last,
+            })
+            st["last_bar"] = ts
+
+        # 国外报价只需保留最后一根已用过的 + 之后的
+        while len(st["foreign"]) > 1 and st["foreign"][1][0] <= (st["last_bar"] or st["foreign"][0][0]):
+            st["foreign"].popleft()
+        return len(new)
+
+    def vol_oi(self, metal):
+        """窗口内成交量 / 最新持仓 (盘中换手率)"""
+        st = self.state[metal]
+        return st["volume"].total / st["hold"] if st["hold"] else None
+
+    def poll(self):
+        """拉一轮最新分钟线并增量更新，返回 {金属: 新 bar 数}"""
+        counts = {}
+        for metal in self.metals:
+            domestic_code, _, ticker = INTRADAY_METALS[metal]
+            try:
+                domestic = fetch_domestic_bars(domestic_code)
+                foreign = fetch_foreign_bars(ticker)
+            except Exception as e:
+                print(f"   ⚠️ {metal} 分钟线获取失败: {e}")
+                counts[metal] = 0
+                continue
+            try:
+                spread = self.spread_bars(metal)
+            except Exception as e:
+                print(f"   ⚠️ {metal} 近远月价差获取失败: {e}")
+                spread = None
+            counts[metal] = self.update(metal, domestic, foreign, spread)
+        return counts
+
+    def latest(self, metal):
+        st = self.state[metal]
+        p = st["premium"]
+        return {
+            "bar": None if st["last_bar"] is None else f"{st['last_bar']:%Y-%m-%d %H:%M}",
+            "premium": p.last, "mean": p.mean(), "zscore": p.zscore(),
+            "vol_oi": self.vol_oi(metal), "spread": st["spread"].last,
+        }
+
+    def flush(self):
+        """把新 bar 追加到当天的 Parquet (按北京时间日期分文件)，并更新 status 快照"""
+        for metal in self.metals:
+            rows = self.state[metal]["rows"]
+            if not rows:
+                continue
+            self.state[metal]["rows"] = []
+            df = pd.DataFrame(rows).set_index("time").astype("float32")
+            for day, part in df.groupby(df.index.date):
+                path = os.path.join(INTRADAY_DIR, metal, f"{day:%Y%m%d}.parquet")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if os.path.exists(path):
+                    part = pd.concat([pd.read_parquet(path), part])
+                    part = part[~part.index.duplicated(keep="last")]
+                part.to_parquet(path + ".tmp")
+                os.replace(path + ".tmp", path)
+        snapshot.update("intraday", {m: self.latest(m) for m in self.metals})
+
+
+def _fmt(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+def print_latest(monitor, counts):
+    now = datetime.datetime.now().strftime("%H:%M:%S")
+    for metal in monitor.metals:
+        r = monitor.latest(metal)
+        print(f"   [{now}] {metal:<7} 新 bar {counts.get(metal, 0):>3}  溢价 {_fmt(r['premium'], '+.2f')}% "
+              f"(z {_fmt(r['zscore'], '+.1f')})  量仓比 {_fmt(r['vol_oi'], '.2f')}  "
+              f"价差 {_fmt(r['spread'], '+.2f')}%  @ {r['bar']}")
+
+
+def run(interval=POLL_INTERVAL, window=WINDOW, once=False):
+    monitor = IntradayMonitor(window=window)
+    print(f"📡 盘中监控: {', '.join(monitor.metals)}，每 {interval}s 轮询，窗口 {window} 根")
+    try:
+        while True:
+            t0 = time.monotonic()
+            counts = monitor.poll()
+            monitor.flush()
+            print_latest(monitor, counts)
+            if once:
+                return monitor
+            time.sleep(max(0.0, interval - (time.monotonic() - t0)))
+    except KeyboardInterrupt:
+        monitor.flush()
+        print("👋 已停止")
+    return monitor
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="盘中溢价监控 (分钟线)")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help="轮询间隔 (秒)")
+    parser.add_argument("--window", type=int, default=WINDOW, help="滚动窗口长度 (根 bar)")
+    parser.add_argument("--once", action="store_true", help="只跑一轮")
+    args = parser.parse_args()
+    run(args.interval, args.window, args.once)
@@ -1,56 +1,30 @@
-import akshare as ak
+from data_cache import ak
 import pandas as pd
-import matplotlib.pyplot as plt
 import datetime
-import platform
 import os
+from history_store import get_history, load_history
+from fetch_planner import FetchPlan
+from continuous_series import update_continuous, load_continuous
+from premium_engine import compute_premiums, metal_view
+from fx_service import get_usdcny, DEFAULT_FX
+from chart_renderer import ChartSpec, render_charts
 
 # ==========================================
 # 1. 全局配置
 # ==========================================
 print("🚀 [最终版] 系统启动...")
 
-# 字体设置
-system_name = platform.system()
-if system_name == "Windows":
-    plt.rcParams['font.sans-serif'] = ['SimHei']
-elif system_name == "Darwin":
-    plt.rcParams['font.sans-serif'] = ['Arial Unicode MS']
-plt.rcParams['axes.unicode_minus'] = False
-
 # 输出目录
 OUTPUT_DIR = "charts_final"
-if not os.path.exists(OUTPUT_DIR):
-    os.makedirs(OUTPUT_DIR)
+os.makedirs(OUTPUT_DIR, exist_ok=True)  # pipeline 会在多个线程里同时导入
 
 # ==========================================
-# 2. 工具函数
+# 2. 绘图函数 (由 chart_renderer 在子进程里调用，只在传入的 fig 上作图)
 # ==========================================
-def get_real_fx(start_date, end_date):
-    """获取真实汇率"""
-    try:
-        start_str = start_date.strftime("%Y%m%d")
-        end_str = end_date.strftime("%Y%m%d")
-        # 尝试获取中国银行汇率
-        fx_df = ak.currency_boc_sina(symbol="美元", start_date=start_str, end_date=end_str)
-        fx_df['date'] = pd.to_datetime(fx_df['日期'])
-        fx_df.set_index('date', inplace=True)
-        # 排序并清洗
-        fx_df.sort_index(inplace=True)
-        fx_rate = fx_df['中行折算价'].astype(float) / 100
-        return fx_rate.resample('D').ffill()
-    except Exception as e:
-        print(f"   ⚠️ 汇率获取微瑕 ({e})，启用备用固定汇率 7.25")
-        return pd.Series(7.25, index=pd.date_range(start=start_date, end=end_date))
-
-def plot_dual_axis(df, col1, col2, title, filename, label1='Left', label2='Right'):
-    """双轴绘图通用函数"""
-    # 检查列是否存在
-    if col1 not in df.columns or col2 not in df.columns:
-        print(f"   ⚠️ 跳过 {filename}: 缺少数据列 {col1} 或 {col2}")
-        return
-
-    fig, ax1 = plt.subplots(figsize=(10, 5))
+def draw_dual_axis(fig, df, title, label1='Left', label2='Right'):
+    """双轴绘图通用函数: 第一列柱状 (左轴)，第二列折线 (右轴)"""
+    col1, col2 = df.columns[:2]
+    ax1 = fig.subplots()
     
     color1 = 'tab:gray'
     ax1.bar(df.index, df[col1], color=color1, alpha=0.6, label=label1)
@@ -63,190 +37,225 @@ def plot_dual_axis(df, col1, col2, title, filename, label1='Left', label2='Right
     ax2.set_ylabel(label2, color=color2, weight='bold')
     ax2.tick_params(axis='y', labelcolor=color2)
     
-    plt.title(title, fontsize=12)
-    plt.grid(True, axis='x', linestyle='--', alpha=0.3)
-    plt.savefig(f"{OUTPUT_DIR}/{filename}", dpi=300)
-    print(f"   ✅ 生成: {filename}")
+    ax2.set_title(title, fontsize=12)
+    ax1.grid(True, axis='x', linestyle='--', alpha=0.3)
+
+def draw_premium(fig, premium, title, color='#d62728', fill='red', alpha=0.1, show_discount=True):
+    """溢价折线 + 正负区域填色"""
+    ax = fig.subplots()
+    ax.plot(premium.index, premium, color=color)
+    ax.axhline(0, color='black', linestyle='--')
+    ax.fill_between(premium.index, 0, premium, where=(premium>=0), facecolor=fill, alpha=alpha)
+    if show_discount:
+        ax.fill_between(premium.index, 0, premium, where=(premium<0), facecolor='green', alpha=0.1)
+    ax.set_title(f'{title}: {premium.iloc[-1]:.2f}%', fontsize=12)
+
+def draw_volume(fig, volume, title, color):
+    """单边成交量"""
+    ax = fig.subplots()
+    ax.plot(volume.index, volume, color=color, label='SHFE Vol')
+    ax.set_title(title, fontsize=12)
+    ax.grid(True, alpha=0.3)
+
+def draw_stocks(fig, stock, title):
+    """库存 (仓单) 面积图"""
+    ax = fig.subplots()
+    ax.plot(stock.index, stock, color='#2ca02c')
+    ax.fill_between(stock.index, 0, stock, color='#2ca02c', alpha=0.1)
+    ax.set_title(title, fontsize=12)
+
+def chart(filename, draw, data, **options):
+    """charts_final/ 下的一张图 (draw 为本模块的绘图函数名)"""
+    return ChartSpec(filename, f"main:{draw}", data, f"{OUTPUT_DIR}/{filename}", **options)
+
+def dual_axis_chart(df, col1, col2, title, filename, label1='Left', label2='Right'):
+    """量仓双轴图；缺列时跳过 (返回 None)"""
+    if col1 not in df.columns or col2 not in df.columns:
+        print(f"   ⚠️ 跳过 {filename}: 缺少数据列 {col1} 或 {col2}")
+        return None
+    return chart(filename, "draw_dual_axis", df[[col1, col2]], title=title, label1=label1, label2=label2)
 
 # ==========================================
-# 3. 业务逻辑
+# 3. 数据预取 (三个任务的数据源一次性并发下载)
 # ==========================================
+# 走本地历史库的数据源: 数据名 -> (接口, 品种)
+HISTORY_SOURCES = {
+    "au_shfe": ("futures_main_sina", "au0"),    # SHFE 主力 + COMEX
+    "au_comex": ("futures_foreign_hist", "GC"),
+    "ag_shfe": ("futures_main_sina", "ag0"),
+    "ag_comex": ("futures_foreign_hist", "SI"),
+    "pt_sge": ("spot_hist_sge", "Pt99.95"),     # 上金所现货
+}
 
-def run_gold_task():
-    print("\n🌟 [任务 1] 黄金 (Gold)...")
+def plan_fetches(start, end):
+    """登记金/银/铂三个任务需要的全部数据源"""
+    plan = FetchPlan()
+    # 本地历史库增量更新
+    for name, (source, symbol) in HISTORY_SOURCES.items():
+        plan.add(name, get_history, source, symbol, start=start)
+    # 汇率 / 仓单
+    plan.add("fx", get_usdcny, start, end)
+    plan.add("ag_stock", ak.futures_shfe_warehouse_receipt, symbol="ag")
+    # 铂金连续主力 (单合约按持仓换月拼接，换月处不断档)
+    plan.add("pt_cont", update_continuous, "pt")
+    return plan
+
+def prefetch_all(days=180):
+    """并发预取，返回 {数据名: DataFrame}，失败项为 None"""
     end = datetime.datetime.now()
-    start = end - datetime.timedelta(days=180)
-    
-    try:
-        # SHFE
-        shfe = ak.futures_main_sina(symbol="au0", start_date=start.strftime("%Y%m%d"))
-        shfe['日期'] = pd.to_datetime(shfe['日期'])
-        shfe.set_index('日期', inplace=True)
-        
-        # COMEX (仅价格)
-        comex = ak.futures_foreign_hist(symbol="GC")
-        comex['date'] = pd.to_datetime(comex['date'])
-        comex.set_index('date', inplace=True)
-        comex = comex[comex.index > start]
-        
-        # 汇率
-        fx = get_real_fx(start, end)
-    except Exception as e:
-        print(f"   ❌ 黄金数据中断: {e}")
-        return
+    start = end - datetime.timedelta(days=days)
+    plan = plan_fetches(start, end)
+    data = plan.run()
+    for name, e in plan.errors.items():
+        print(f"   ⚠️ {name} 获取失败: {e}")
+    return data
 
-    # [1] 溢价图
-    df = pd.DataFrame({'SHFE': shfe['收盘价']})
-    df = df.join(comex['close'], how='inner').rename(columns={'close':'COMEX'})
-    df = df.join(fx.rename('fx'), how='left').ffill().fillna(7.25)
-    
-    # 公式: (SHFE / (COMEX * FX / 31.1035)) - 1
-    df['Implied'] = (df['COMEX'] * df['fx']) / 31.1035
-    df['Premium'] = (df['SHFE'] / df['Implied'] - 1) * 100
-    
-    fig, ax = plt.subplots(figsize=(10, 5))
-    ax.plot(df.index, df['Premium'], color='#d62728')
-    ax.axhline(0, color='black', linestyle='--')
-    ax.fill_between(df.index, 0, df['Premium'], where=(df['Premium']>=0), facecolor='red', alpha=0.1)
-    ax.fill_between(df.index, 0, df['Premium'], where=(df['Premium']<0), facecolor='green', alpha=0.1)
-    plt.title(f'Gold Premium: {df["Premium"].iloc[-1]:.2f}%', fontsize=12)
-    plt.savefig(f"{OUTPUT_DIR}/1_Gold_Premium.png", dpi=300)
-    print(f"   ✅ 生成: 1_Gold_Premium.png")
-    
-    # [2] 成交量 vs 持仓量
-    plot_dual_axis(shfe, '成交量', '持仓量', 'Gold (SHFE): Vol vs Open Interest', '2_Gold_Vol_OI.png')
-    
-    # [3] 单边成交量 (替代对比图)
-    plt.figure(figsize=(10, 5))
-    plt.plot(shfe.index, shfe['成交量'], color='green', label='SHFE Vol')
-    plt.title('Gold Volume (SHFE Only)', fontsize=12)
-    plt.grid(True, alpha=0.3)
-    plt.savefig(f"{OUTPUT_DIR}/3_Gold_Vol_Single.png", dpi=300)
-    print(f"   ✅ 生成: 3_Gold_Vol_Single.png")
+def stored_history():
+    """本地已存的全部历史 (不发请求)，滚动统计首次建档时用；缺的数据项为空表"""
+    data = {name: load_history(source, symbol) for name, (source, symbol) in HISTORY_SOURCES.items()}
+    data["pt_cont"] = load_continuous("pt")
+    return data
+
+def _missing(data, keys):
+    return [k for k in keys if data.get(k) is None]
+
+# 溢价引擎输入: 金属 -> (国内数据名, 国内价格列, 国外数据名, 国外价格列)
+PREMIUM_INPUTS = {
+    "Gold": ("au_shfe", "收盘价", "au_comex", "close"),
+    "Silver": ("ag_shfe", "收盘价", "ag_comex", "close"),
+    # 铂金期现溢价用未复权的拼接价，复权价只适合看趋势
+    "Platinum": ("pt_cont", "raw_close", "pt_sge", "close"),
+}
+
+def compute_metal_premiums(data):
+    """金/银/铂 溢价一次算完 (premium_engine 宽表)，缺数据的金属不出现在结果里"""
+    domestic, foreign = {}, {}
+    for metal, (dom_key, dom_col, fgn_key, fgn_col) in PREMIUM_INPUTS.items():
+        dom, fgn = data.get(dom_key), data.get(fgn_key)
+        if dom is None or fgn is None or dom.empty or fgn.empty:
+            continue
+        domestic[metal], foreign[metal] = dom[dom_col], fgn[fgn_col]
+    return compute_premiums(domestic, foreign, data.get("fx"))
+
+def _fx_note(premiums):
+    """汇率用了固定值兜底时在标题上注明"""
+    return f" [FX fallback {DEFAULT_FX}]" if premiums.attrs.get("fx_fallback") else ""
+
+# ==========================================
+# 4. 业务逻辑 (只做计算与绘图，数据来自预取结果)
+# ==========================================
+
+def gold_charts(data, premiums=None):
+    print("\n🌟 [任务 1] 黄金 (Gold)...")
+    missing = _missing(data, ["au_shfe", "au_comex", "fx"])
+    if missing:
+        print(f"   ❌ 黄金数据中断: 缺少 {missing}")
+        return []
+    shfe = data["au_shfe"]
+    if premiums is None:
+        premiums = compute_metal_premiums(data)
+
+    return [
+        # [1] 溢价图 (SHFE 元/克 vs COMEX 美元/盎司 折算)
+        chart('1_Gold_Premium.png', "draw_premium", metal_view(premiums, "Gold")['Premium'],
+              title='Gold Premium' + _fx_note(premiums)),
+        # [2] 成交量 vs 持仓量
+        dual_axis_chart(shfe, '成交量', '持仓量', 'Gold (SHFE): Vol vs Open Interest', '2_Gold_Vol_OI.png'),
+        # [3] 单边成交量 (替代对比图)
+        chart('3_Gold_Vol_Single.png', "draw_volume", shfe['成交量'],
+              title='Gold Volume (SHFE Only)', color='green'),
+    ]
 
 
-def run_silver_task():
+def silver_charts(data, premiums=None):
     print("\n🌟 [任务 2] 白银 (Silver)...")
-    end = datetime.datetime.now()
-    start = end - datetime.timedelta(days=180)
-    
-    try:
-        shfe = ak.futures_main_sina(symbol="ag0", start_date=start.strftime("%Y%m%d"))
-        shfe['日期'] = pd.to_datetime(shfe['日期'])
-        shfe.set_index('日期', inplace=True)
-        
-        comex = ak.futures_foreign_hist(symbol="SI")
-        comex['date'] = pd.to_datetime(comex['date'])
-        comex.set_index('date', inplace=True)
-        comex = comex[comex.index > start]
-        
-        fx = get_real_fx(start, end)
-    except Exception as e:
-        print(f"   ❌ 白银数据中断: {e}")
-        return
+    missing = _missing(data, ["ag_shfe", "ag_comex", "fx"])
+    if missing:
+        print(f"   ❌ 白银数据中断: 缺少 {missing}")
+        return []
+    shfe = data["ag_shfe"]
+    if premiums is None:
+        premiums = compute_metal_premiums(data)
 
-    # [4] 溢价图
-    df = pd.DataFrame({'SHFE': shfe['收盘价']})
-    df = df.join(comex['close'], how='inner').rename(columns={'close':'COMEX'})
-    df = df.join(fx.rename('fx'), how='left').ffill().fillna(7.25)
-    
-    # 白银换算: 1kg = 32.1507 oz
-    df['Implied'] = (df['COMEX'] * 32.1507) * df['fx']
-    df['Premium'] = (df['SHFE'] / df['Implied'] - 1) * 100
-    
-    fig, ax = plt.subplots(figsize=(10, 5))
-    ax.plot(df.index, df['Premium'], color='#d62728')
-    ax.axhline(0, color='black', linestyle='--')
-    ax.fill_between(df.index, 0, df['Premium'], where=(df['Premium']>=0), facecolor='red', alpha=0.1)
-    plt.title(f'Silver Premium: {df["Premium"].iloc[-1]:.2f}%', fontsize=12)
-    plt.savefig(f"{OUTPUT_DIR}/4_Silver_Premium.png", dpi=300)
-    print(f"   ✅ 生成: 4_Silver_Premium.png")
-    
-    # [5] 成交量 vs 持仓量
-    plot_dual_axis(shfe, '成交量', '持仓量', 'Silver (SHFE): Vol vs Open Interest', '5_Silver_Vol_OI.png')
-
-    # [6] 单边成交量
-    plt.figure(figsize=(10, 5))
-    plt.plot(shfe.index, shfe['成交量'], color='#1f77b4', label='SHFE Vol')
-    plt.title('Silver Volume (SHFE Only)', fontsize=12)
-    plt.grid(True, alpha=0.3)
-    plt.savefig(f"{OUTPUT_DIR}/6_Silver_Vol_Single.png", dpi=300)
-    print(f"   ✅ 生成: 6_Silver_Vol_Single.png")
+    specs = [
+        # [4] 溢价图 (SHFE 元/千克 vs COMEX 美元/盎司 折算)
+        chart('4_Silver_Premium.png', "draw_premium", metal_view(premiums, "Silver")['Premium'],
+              title='Silver Premium' + _fx_note(premiums), show_discount=False),
+        # [5] 成交量 vs 持仓量
+        dual_axis_chart(shfe, '成交量', '持仓量', 'Silver (SHFE): Vol vs Open Interest', '5_Silver_Vol_OI.png'),
+        # [6] 单边成交量
+        chart('6_Silver_Vol_Single.png', "draw_volume", shfe['成交量'],
+              title='Silver Volume (SHFE Only)', color='#1f77b4'),
+    ]
     
     # [7] 库存 (Stocks) - 使用仓单数据
     try:
-        # 尝试获取仓单
-        stock = ak.futures_shfe_warehouse_receipt(symbol="ag")
+        # 仓单 (预取)
+        stock = data["ag_stock"].copy()
         stock['date'] = pd.to_datetime(stock['date'])
         stock.set_index('date', inplace=True)
-        stock = stock[stock.index > start]
+        stock = stock[stock.index >= shfe.index[0]]
         # 字段兼容
         col = 'receipt' if 'receipt' in stock.columns else stock.columns[0]
-        
-        plt.figure(figsize=(10, 5))
-        plt.plot(stock.index, stock[col], color='#2ca02c')
-        plt.fill_between(stock.index, 0, stock[col], color='#2ca02c', alpha=0.1)
-        plt.title('Silver SHFE Stocks (Warehouse Receipts)', fontsize=12)
-        plt.savefig(f"{OUTPUT_DIR}/7_Silver_Stocks.png", dpi=300)
-        print(f"   ✅ 生成: 7_Silver_Stocks.png")
+        specs.append(chart('7_Silver_Stocks.png', "draw_stocks", stock[col],
+                           title='Silver SHFE Stocks (Warehouse Receipts)'))
     except:
         print("   ⚠️ 白银库存数据暂不可用 (接口维护中)")
+    return specs
 
-def run_platinum_task():
+def platinum_charts(data, premiums=None):
     print("\n🌟 [任务 3] 铂金 (Platinum)...")
     
-    # 暴力搜索活跃合约
-    candidates = [f"pt260{i}" for i in range(1, 7)] + ["pt2512"]
-    shfe_pt = pd.DataFrame()
-    code = ""
-    for c in candidates:
-        try:
-            df = ak.futures_zh_daily_sina(symbol=c)
-            if len(df) > len(shfe_pt):
-                shfe_pt = df
-                code = c
-        except: pass
-    
-    if shfe_pt.empty:
+    # 连续主力 (预取)，取最近半年
+    shfe_pt = data.get("pt_cont")
+    if shfe_pt is None or shfe_pt.empty:
         print("   ❌ 未找到铂金合约")
-        return
+        return []
 
-    shfe_pt['date'] = pd.to_datetime(shfe_pt['date'])
-    shfe_pt.set_index('date', inplace=True)
-    # 关键修复: 重命名列
-    rename_map = {'volume': '成交量', 'open_interest': '持仓量', 'hold': '持仓量', 'close': '收盘价'}
+    shfe_pt = shfe_pt[shfe_pt.index > shfe_pt.index[-1] - datetime.timedelta(days=180)].copy()
+    code = f"main, now {shfe_pt['contract'].iloc[-1]}"
+    # 关键修复: 重命名列 (期现溢价用未复权的拼接价，复权价只适合看趋势)
+    rename_map = {'volume': '成交量', 'hold': '持仓量', 'raw_close': '收盘价', 'close': '复权收盘价'}
     shfe_pt.rename(columns=rename_map, inplace=True)
+    specs = []
 
     # [8] 溢价图 (VS SGE Spot)
     try:
-        sge = ak.spot_hist_sge(symbol="Pt99.95")
-        sge['date'] = pd.to_datetime(sge['date'])
-        sge.set_index('date', inplace=True)
-        
-        df = pd.DataFrame({'Futures': shfe_pt['收盘价']})
-        # 时区对其
-        if df.index.tz: df.index = df.index.tz_localize(None)
-        bench = sge['close']
-        if bench.index.tz: bench.index = bench.index.tz_localize(None)
-        
-        df = df.join(bench.rename('Spot'), how='inner')
-        df['Premium'] = (df['Futures'] / df['Spot'] - 1) * 100
-        
-        plt.figure(figsize=(10, 5))
-        plt.plot(df.index, df['Premium'], color='#9467bd')
-        plt.axhline(0, color='black', linestyle='--')
-        plt.fill_between(df.index, 0, df['Premium'], where=(df['Premium']>=0), facecolor='#9467bd', alpha=0.2)
-        plt.title(f'Platinum Premium ({code} vs SGE): {df["Premium"].iloc[-1]:.2f}%', fontsize=12)
-        plt.savefig(f"{OUTPUT_DIR}/8_Platinum_Premium.png", dpi=300)
-        print(f"   ✅ 生成: 8_Platinum_Premium.png")
+        if data.get("pt_sge") is None:
+            raise ValueError("SGE 现货数据缺失")
+        if premiums is None:
+            premiums = compute_metal_premiums(data)
+        df = metal_view(premiums, "Platinum")
+        df = df[df.index >= shfe_pt.index[0]]
+        if df.empty:
+            raise ValueError("期货与现货没有重叠日期")
+        specs.append(chart('8_Platinum_Premium.png', "draw_premium", df['Premium'],
+                           title=f'Platinum Premium ({code} vs SGE)',
+                           color='#9467bd', fill='#9467bd', alpha=0.2, show_discount=False))
     except Exception as e:
         print(f"   ❌ 铂金溢价图失败: {e}")
 
     # [9] 量仓图
-    plot_dual_axis(shfe_pt, '成交量', '持仓量', f'Platinum ({code}): Vol vs Open Interest', '9_Platinum_Vol_OI.png')
+    specs.append(dual_axis_chart(shfe_pt, '成交量', '持仓量', f'Platinum ({code}): Vol vs Open Interest',
+                                 '9_Platinum_Vol_OI.png'))
+    return specs
+
+def metal_charts(data, premiums=None):
+    """金/银/铂 全部 9 张图的 ChartSpec"""
+    if premiums is None:
+        premiums = compute_metal_premiums(data)
+    return gold_charts(data, premiums) + silver_charts(data, premiums) + platinum_charts(data, premiums)
+
+def run_gold_task(data, premiums=None):
+    return render_charts(gold_charts(data, premiums))
+
+def run_silver_task(data, premiums=None):
+    return render_charts(silver_charts(data, premiums))
+
+def run_platinum_task(data, premiums=None):
+    return render_charts(platinum_charts(data, premiums))
 
 if __name__ == "__main__":
-    run_gold_task()
-    run_silver_task()
-    run_platinum_task()
-    print(f"\n🎉 全部完成！请查看 ./{OUTPUT_DIR}/ 文件夹 (应有 9 张图片)")
\ No newline at end of file
+    data = prefetch_all()
+    render_charts(metal_charts(data))
+    print(f"\n🎉 全部完成！请查看 ./{OUTPUT_DIR}/ 文件夹 (应有 9 张图片)")
@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+# ==========================================
+# metalquant 统一命令行
+# ==========================================
+# 顶层只导入标准库；akshare / pandas / matplotlib / yfinance / notion_client 都在子命令真正用到时才导入，
+# status 这类查询命令只读本地小 JSON，不到 0.1 秒就能出结果。
+#
+#   python metalquant.py fetch                     # 只抓数据
+#   python metalquant.py compute                   # 溢价 / 报告 (自动带上所需的抓取)
+#   python metalquant.py render cftc --profile web # 单个节点: render.cftc
+#   python metalquant.py publish                   # 推送 Notion
+#   python metalquant.py status                    # 最新溢价 / 汇率 / 上次运行 (读快照)
+#   python metalquant.py imports                   # 各模块冷启动导入耗时
+
+STAGES = ["fetch", "compute", "render", "publish"]
+OUTPUT_DIR = "charts_final"     # 与 main.OUTPUT_DIR 相同 (status 不导入 main)
+
+# 冷启动最慢的几个依赖，imports 命令会标出每个模块拖进来了哪些
+HEAVY = ["pandas", "matplotlib.pyplot", "akshare", "yfinance", "notion_client"]
+
+# imports 命令默认测量的模块 (项目模块 + 重依赖本身)
+IMPORT_TARGETS = ["metalquant", "snapshot", "pipeline", "instrumentation", "data_cache", "premium_engine",
+                  "chart_renderer", "main", "update_notion", "cftc_fetcher", "forward_curve", "comex_comparison",
+                  *HEAVY]
+STATUS_BUDGET = 1.0     # `metalquant status` 冷启动的目标上限 (秒)
+
+
+# ==========================================
+# fetch / compute / render / publish
+# ==========================================
+
+def run_stage(stage, nodes, workers=None, profile=None, budget=None):
+    """nodes 可以写简称 ('cftc' -> 'render.cftc')，不写则跑整个阶段"""
+    import pipeline
+    targets = [n if "." in n else f"{stage}.{n}" for n in nodes] or [stage]
+    status = pipeline.execute(targets, workers or pipeline.DEFAULT_WORKERS, profile, budget)
+    return 1 if any(s != "ok" for s in status.values()) else 0
+
+
+# ==========================================
+# status
+# ==========================================
+
+def _last_run_digest():
+    """instrumentation 的 history.jsonl 最后一行"""
+    import instrumentation
+    path = os.path.join(instrumentation.RUN_DIR, instrumentation.HISTORY_NAME)
+    try:
+        with open(path, "rb") as fp:
+            fp.seek(0, os.SEEK_END)
+            fp.seek(max(0, fp.tell() - 65536))
+            lines = fp.read().decode("utf-8", "ignore").strip().splitlines()
+        return json.loads(lines[-1]) if lines else None
+    except Exception:
+        return None
+
+
+def collect_status():
+    import snapshot
+    status = snapshot.load()
+    try:
+        with open(os.path.join(OUTPUT_DIR, "manifest.json"), encoding="utf-8") as fp:
+            manifest = json.load(fp)
+        status["charts"] = {"count": len(manifest),
+                            "rendered": max((m.get("rendered", "") for m in manifest.values()), default=None)}
+    except Exception:
+        pass
+    digest = _last_run_digest()
+    if digest:
+        status["metrics"] = {"started": digest["started"], "seconds": digest["seconds"],
+                             "errors": {k: s["errors"] for k, s in digest["sources"].items() if s["errors"]}}
+    return status
+
+
+def print_status(status):
+    if not status:
+        print("❌ 还没有快照，先跑一次 `python metalquant.py compute`")
+        return
+    prem = status.get("premiums")
+    if prem:
+        print(f"📌 最新溢价 (数据日期 {prem.get('date')}，更新于 {prem['updated']})")
+        for metal, value in prem.get("values", {}).items():
+            print(f"   {metal:<10} {value:+.2f}%")
+        note = " ⚠️ 固定汇率兜底" if prem.get("fx_fallback") else ""
+        if prem.get("fx"):
+            print(f"💱 USD/CNY {prem['fx']:.4f}{note}")
+    run = status.get("run")
+    if run:
+        ok = len(run["status"]) - len(run["failed"])
+        print(f"🕒 上次运行 {run['updated']}: {' '.join(run['targets'])}，成功 {ok}/{len(run['status'])}，"
+              f"{run['seconds']:.0f}s")
+        if run["failed"]:
+            print(f"   ❌ 失败/跳过: {', '.join(run['failed'])}")
+        if run.get("tripped"):
+            print(f"   🔌 熔断: {run['tripped']}")
+    metrics = status.get("metrics")
+    if metrics and metrics["errors"]:
+        print("   ⚠️ 上游失败: " + ", ".join(f"{k} ×{n}" for k, n in metrics["errors"].items()))
+    intraday = status.get("intraday")
+    if intraday:
+        print(f"📡 盘中 (更新于 {intraday['updated']})")
+        for metal, r in intraday.items():
+            if isinstance(r, dict) and r.get("premium") is not None:
+                z = f" z {r['zscore']:+.1f}" if r.get("zscore") is not None else ""
+                print(f"   {metal:<10} {r['premium']:+.2f}%{z} @ {r['bar']}")
+    charts = status.get("charts")
+    if charts:
+        print(f"🖼️ 图表 {charts['count']} 张，最近渲染 {charts['rendered']}")
+
+
+# ==========================================
+# imports: 冷启动导入耗时
+# ==========================================
+
+def time_import(module, repeat=3, cwd=None):
+    """新解释器里 import module 的墙钟耗时 (取最小值) 以及拖进来的重依赖；导入失败返回 (None, 错误)"""
+    code = f"import sys, {module}; print(','.join(m for m in {HEAVY!r} if m in sys.modules))"
+    return _time_command([sys.executable, "-c", code], repeat, cwd)
+
+
+def _time_command(cmd, repeat, cwd):
+    best, out = None, ""
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        proc = subprocess.run(cmd, capture_output=True, text=True, cwd=cwd)
+        cost = time.perf_counter() - t0
+        if proc.returncode != 0:
+            return None, (proc.stderr.strip().splitlines() or ["?"])[-1]
+        best = cost if best is None else min(best, cost)
+        out = proc.stdout.strip().splitlines()[-1] if proc.stdout.strip() else ""
+    return best, out
+
+
+def import_benchmark(modules=None, repeat=3):
+    """返回 {'interpreter': 秒, 'status': 秒, 'modules': {模块: {'seconds', 'net', 'heavy' / 'error'}}}"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    base, _ = _time_command([sys.executable, "-c", "pass"], repeat, here)
+    results = {}
+    for module in modules or IMPORT_TARGETS:
+        seconds, out = time_import(module, repeat, here)
+        if seconds is None:
+            results[module] = {"error": out}
+        else:
+            results[module] = {"seconds": round(seconds, 3), "net": round(seconds - base, 3),
+                               "heavy": [m for m in out.split(",") if m]}
+    status, _ = _time_command([sys.executable, os.path.join(here, "metalquant.py"), "status"], repeat, here)
+    return {"interpreter": round(base, 3), "status": None if status is None else round(status, 3),
+            "modules": results}
+
+
+def print_import_benchmark(result):
+    print(f"⏱️ 冷启动导入耗时 (解释器本身 {result['interpreter']:.2f}s，下表为总耗时 / 去掉解释器后的净耗时)")
+    for module, r in result["modules"].items():
+        if "error" in r:
+            print(f"   {module:<20} {'-':>6}         ❌ {r['error']}")
+            continue
+        heavy = ", ".join(r["heavy"]) or "-"
+        print(f"   {module:<20} {r['seconds']:>5.2f}s {r['net']:>6.2f}s  {heavy}")
+    if result["status"] is not None:
+        flag = "✅" if result["status"] < STATUS_BUDGET else "⚠️"
+        print(f"{flag} `metalquant status` 端到端 {result['status']:.2f}s (目标 < {STATUS_BUDGET:.1f}s)")
+
+
+# ==========================================
+# 入口
+# ==========================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="metalquant", description="Metal Quant 命令行")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    for stage in STAGES:
+        p = sub.add_parser(stage, help=f"运行 {stage} 阶段 (自动带上依赖)")
+        p.add_argument("nodes", nargs="*", help=f"只跑部分节点，如 {stage}.xxx 或简写 xxx")
+        p.add_argument("--workers", type=int, help="并发节点数")
+        p.add_argument("--profile", help="图表输出规格 (print/web/webp/vector)")
+        p.add_argument("--budget", type=float, help="上游请求总预算 (秒)")
+
+    p_status = sub.add_parser("status", help="最新溢价 / 汇率 / 上次运行 (只读本地快照)")
+    p_status.add_argument("--json", action="store_true", help="输出 JSON")
+
+    p_imports = sub.add_parser("imports", help="各模块冷启动导入耗时")
+    p_imports.add_argument("modules", nargs="*", help=f"默认: {', '.join(IMPORT_TARGETS)}")
+    p_imports.add_argument("--repeat", type=int, default=3, help="每个模块测几次取最小值")
+    p_imports.add_argument("--json", help="同时把结果写入该文件")
+    p_imports.add_argument("--check", action="store_true",
+                           help=f"status 冷启动超过 {STATUS_BUDGET:.1f}s 时退出码为 1")
+    args = parser.parse_args(argv)
+
+    if args.command in STAGES:
+        return run_stage(args.command, args.nodes, args.workers, args.profile, args.budget)
+
+    if args.command == "status":
+        status = collect_status()
+        if args.json:
+            print(json.dumps(status, indent=1, ensure_ascii=False))
+        else:
+            print_status(status)
+        return 0
+
+    result = import_benchmark(args.modules, args.repeat)
+    print_import_benchmark(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fp:
+            json.dump(result, fp, indent=1, ensure_ascii=False)
+    if args.check and (result["status"] is None or result["status"] >= STATUS_BUDGET):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,11 @@
-import akshare as ak
+from data_cache import ak
 import pandas as pd
 import matplotlib.pyplot as plt
 import datetime
 import platform
+from contract_discovery import find_main_contract
+from premium_engine import compute_premiums, metal_view
+from fx_service import get_usdcny
 
 # --- 基础设置 ---
 system_name = platform.system()
@@ -12,57 +15,15 @@ elif system_name == "Darwin":
     plt.rcParams['font.sans-serif'] = ['Arial Unicode MS']
 plt.rcParams['axes.unicode_minus'] = False
 
-def get_real_fx():
-    """获取汇率，失败则用固定值"""
-    try:
-        end = datetime.datetime.now()
-        start = end - datetime.timedelta(days=180)
-        fx_df = ak.currency_boc_sina(symbol="美元", start_date=start.strftime("%Y%m%d"), end_date=end.strftime("%Y%m%d"))
-        fx_df['date'] = pd.to_datetime(fx_df['日期'])
-        fx_df.set_index('date', inplace=True)
-        fx_rate = fx_df['中行折算价'].astype(float) / 100
-        return fx_rate.resample('D').ffill()
-    except:
-        return None
-
 def find_active_contract(symbol_root):
     """
-    暴力搜索活跃合约 (针对 GFEX 这种新交易所)
-    策略：尝试抓取 pt2601 - pt2606，谁有数据且量大就用谁
+    活跃合约 (针对 GFEX 这种新交易所)
+    策略：按当前日期生成挂牌月份并发探测，取最新持仓量最大的合约 (当天结果有缓存)
     """
-    print(f"   🔍 正在暴力搜索 {symbol_root} 的活跃合约...")
-    # 生成潜在合约列表 (假设当前是2026年初)
-    candidates = [f"{symbol_root}260{i}" for i in range(1, 7)] + [f"{symbol_root}2512"]
-    
-    best_df = pd.DataFrame()
-    best_code = ""
-    max_len = 0
-    
-    for code in candidates:
-        try:
-            # print(f"      试探: {code} ...", end="")
-            # 使用日线行情接口
-            df = ak.futures_zh_daily_sina(symbol=code)
-            if not df.empty and len(df) > 5: # 至少得有几天数据
-                # print(f" 有数据 ({len(df)}条)")
-                if len(df) > max_len:
-                    max_len = len(df)
-                    best_df = df
-                    best_code = code
-            else:
-                pass
-                # print(" 无效")
-        except:
-            pass
-            
-    if not best_df.empty:
-        print(f"   ✅ 锁定主力合约: {best_code} ({len(best_df)}条数据)")
-        best_df['date'] = pd.to_datetime(best_df['date'])
-        best_df.set_index('date', inplace=True)
-        return best_df, best_code
-    else:
-        print(f"   ❌ {symbol_root} 全系合约搜索失败 (可能未上市或无成交)")
+    code, df = find_main_contract(symbol_root)
+    if df is None:
         return None, None
+    return df, code
 
 def get_benchmark_price(metal_type):
     """
@@ -111,7 +72,7 @@ def get_benchmark_price(metal_type):
 def plot_pgm_final(metal_name, root_code):
     print(f"\n🎨 [处理 {metal_name}] ------------------")
     
-    # 1. 获取国内期货 (暴力搜索)
+    # 1. 获取国内期货 (主力合约)
     dom_df, dom_code = find_active_contract(root_code)
     if dom_df is None:
         return
@@ -125,39 +86,16 @@ def plot_pgm_final(metal_name, root_code):
         plt.savefig(f'{metal_name}_price_only.png')
         return
 
-    # 3. 对齐
-    df = pd.DataFrame()
-    df['Futures'] = dom_df['close']
-    
-    # 清洗时区
-    if df.index.tz is not None: df.index = df.index.tz_localize(None)
-    if bench_series.index.tz is not None: bench_series.index = bench_series.index.tz_localize(None)
-    
-    df = df.join(bench_series.rename('Benchmark'), how='inner')
-    
-    # 4. 计算溢价
-    if currency == "USD":
-        # 需要汇率换算
-        fx = get_real_fx()
-        if fx is None: fx = pd.Series(7.25, index=df.index)
-        
-        # 1 oz = 31.1035 g
-        # Benchmark(USD/oz) -> CNY/g
-        if isinstance(fx, pd.Series):
-             # 对齐汇率
-             df = df.join(fx.rename('fx'), how='left').fillna(method='ffill')
-             df['fx'] = df['fx'].fillna(7.25)
-             df['Bench_CNY'] = (df['Benchmark'] / 31.1035) * df['fx']
-        else:
-             df['Bench_CNY'] = (df['Benchmark'] / 31.1035) * 7.25
-             
-    else:
-        # 都是人民币 (SGE Spot)，直接比
-        # SGE 是 元/克，GFEX 也是 元/克，直接比
-        df['Bench_CNY'] = df['Benchmark']
-
-    # 计算溢价 %
-    df['Premium'] = (df['Futures'] / df['Bench_CNY'] - 1) * 100
+    # 3. 对齐 + 计算溢价 (premium_engine)
+    # NYMEX: 美元/盎司 -> 元/克 (1 oz = 31.1035 g，需要汇率)
+    # SGE 现货: 元/克，与 GFEX 同单位直接比
+    key = f"{metal_name}_NYMEX" if currency == "USD" else metal_name
+    fx = get_usdcny(datetime.datetime.now() - datetime.timedelta(days=180)) if currency == "USD" else None
+    premiums = compute_premiums({key: dom_df['close']}, {key: bench_series}, fx)
+    df = metal_view(premiums, key)
+    if df.empty:
+        print(f"   ❌ {dom_code} 与 {bench_name} 没有重叠日期")
+        return
     
     # 5. 绘图
     fig, ax = plt.subplots(figsize=(10, 5))
@@ -0,0 +1,268 @@
+import sys
+import time
+import argparse
+import instrumentation
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# ==========================================
+# 单进程 DAG 流水线: fetch -> compute -> render -> publish
+# ==========================================
+# 原来 daily_run.yml 里四个脚本各起一个 Python 进程，
+# 各自 import 一遍 akshare/pandas/matplotlib 并重复下载重叠数据。
+# 这里把它们建模成依赖图: 共享节点只跑一次，互不依赖的节点并发执行。
+#
+# 用法:
+#   python pipeline.py                 # 跑全部 (不含 publish)
+#   python pipeline.py render          # 按阶段名选择
+#   python pipeline.py render.cftc     # 按节点名选择 (自动带上依赖)
+#   python pipeline.py --list          # 列出全部节点
+
+DEFAULT_WORKERS = 6
+STAGES = ["fetch", "compute", "render", "publish"]
+
+NODES = {}
+
+
+class Node:
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+
+def node(name, deps=()):
+    """注册节点；函数按 deps 的顺序接收上游节点的结果"""
+    def decorator(func):
+        NODES[name] = Node(name, func, deps)
+        return func
+    return decorator
+
+
+# ==========================================
+# 节点定义 (模块在节点内部导入，只跑部分节点时不付多余的 import 成本)
+# ==========================================
+
+@node("fetch.metals")
+def fetch_metals():
+    import main
+    return main.prefetch_all()
+
+
+@node("fetch.forward")
+def fetch_forward():
+    """全部挂牌月份的期限结构 {品种: TermStructure}，绘图和报告共用"""
+    import datetime
+    import forward_curve
+    from fetch_planner import FetchPlan
+    from term_structure import build_term_structure
+    start = datetime.datetime.now() - datetime.timedelta(days=180)
+    plan = FetchPlan()
+    for root, _, _ in forward_curve.TERM_ROOTS:
+        plan.add(root, build_term_structure, root, start=start)
+    return {root: ts for root, ts in plan.run().items() if ts is not None}
+
+
+@node("fetch.cftc")
+def fetch_cftc():
+    import cftc_fetcher
+    return cftc_fetcher.load_cot_dataset()
+
+
+@node("fetch.compare")
+def fetch_compare():
+    import datetime
+    import comex_comparison
+    from fetch_planner import FetchPlan
+    start_date = (datetime.datetime.now() - datetime.timedelta(days=180)).strftime("%Y-%m-%d")
+    plan = FetchPlan()
+    for symbol_shfe, symbol_comex, metal_name, _ in comex_comparison.COMPARE_PAIRS:
+        plan.add(metal_name, comex_comparison.get_data, symbol_shfe, symbol_comex, start_date)
+    return plan.run()
+
+
+@node("compute.premiums", deps=["fetch.metals"])
+def compute_premiums(data):
+    """金/银/铂 溢价宽表，绘图和报告共用 (最新值另存一份快照给 status 命令)"""
+    import main
+    import snapshot
+    premiums = main.compute_metal_premiums(data)
+    try:
+        snapshot.save_premiums(premiums)
+    except Exception as e:
+        print(f"   ⚠️ 溢价快照写入失败: {e}")
+    return premiums
+
+
+@node("compute.report", deps=["fetch.forward", "fetch.cftc", "compute.premiums"])
+def compute_report(forward, cot, premiums):
+    import update_notion
+    return update_notion.build_report_safely(curves=forward, premiums=premiums, cot=cot)
+
+
+@node("render.metals", deps=["fetch.metals", "compute.premiums"])
+def render_metals(data, premiums):
+    import main
+    from chart_renderer import render_charts
+    return render_charts(main.metal_charts(data, premiums))
+
+
+@node("render.forward", deps=["fetch.forward"])
+def render_forward(curves):
+    import forward_curve
+    return forward_curve.run_forward_analysis(curves)
+
+
+@node("render.cftc", deps=["fetch.cftc"])
+def render_cftc(raw_df):
+    import cftc_fetcher
+    from chart_renderer import render_charts
+    if raw_df is None or raw_df.empty:
+        print("❌ 未获取到有效 CFTC 数据。")
+        return
+    return render_charts([
+        cftc_fetcher.cftc_chart(raw_df, metal_name, cftc_code, output_file,
+                                history=cftc_fetcher.load_cftc_history(cftc_code))
+        for metal_name, cftc_code, output_file in cftc_fetcher.CFTC_CHARTS
+    ])
+
+
+@node("render.compare", deps=["fetch.compare"])
+def render_compare(frames):
+    import comex_comparison
+    from chart_renderer import render_charts
+    return render_charts([
+        comex_comparison.comparison_chart(frames.get(metal_name), metal_name, file_path)
+        for _, _, metal_name, file_path in comex_comparison.COMPARE_PAIRS
+    ])
+
+
+# Notion 通过 GitHub raw 链接引用图片，图片需先提交推送 (见 daily_run.yml)，
+# 所以 publish 只依赖报告文本，不会重跑绘图
+@node("publish.notion", deps=["compute.report"])
+def publish_notion(report):
+    import update_notion
+    update_notion.update_page(analysis_comment=report)
+
+
+# ==========================================
+# 调度器
+# ==========================================
+
+def resolve(targets):
+    """目标 (阶段名 / 节点名) -> 需要执行的节点集合 (含全部上游)"""
+    selected = set()
+    for t in targets:
+        if t in NODES:
+            selected.add(t)
+        elif t in STAGES:
+            selected.update(n for n in NODES if n.startswith(t + "."))
+        else:
+            raise KeyError(f"未知目标: {t} (可用: {', '.join(STAGES + sorted(NODES))})")
+
+    stack = list(selected)
+    while stack:
+        for dep in NODES[stack.pop()].deps:
+            if dep not in selected:
+                selected.add(dep)
+                stack.append(dep)
+    return selected
+
+
+def _execute(n, inputs):
+    t0 = time.perf_counter()
+    with instrumentation.timer("node", n.name):
+        result = n.func(*inputs)
+    return result, time.perf_counter() - t0
+
+
+def run(targets, workers=DEFAULT_WORKERS):
+    """
+    按依赖顺序并发执行
+    返回 {节点名: 'ok' / 'failed' / 'skipped'}；上游失败的节点直接跳过
+    """
+    pending = resolve(targets)
+    results, status = {}, {}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            for name in sorted(pending):
+                deps = NODES[name].deps
+                if any(status.get(d) in ("failed", "skipped") for d in deps):
+                    status[name] = "skipped"
+                    pending.discard(name)
+                    print(f"⏭️ [{name}] 上游失败，跳过")
+                elif all(status.get(d) == "ok" for d in deps):
+                    pending.discard(name)
+                    inputs = [results[d] for d in deps]
+                    print(f"▶️ [{name}] 开始")
+                    running[pool.submit(_execute, NODES[name], inputs)] = name
+
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                name = running.pop(fut)
+                try:
+                    results[name], cost = fut.result()
+                    status[name] = "ok"
+                    print(f"✅ [{name}] 完成 ({cost:.1f}s)")
+                except Exception as e:
+                    status[name] = "failed"
+                    print(f"❌ [{name}] 失败: {e}")
+    instrumentation.emit("nodes", status=status)
+    return status
+
+
+def execute(targets, workers=DEFAULT_WORKERS, profile=None, budget=None):
+    """
+    命令行入口 (pipeline.py / metalquant.py) 共用:
+    设置输出规格与运行预算 -> run -> 关闭渲染进程池，记录运行指标和状态快照；返回 {节点名: 状态}
+    """
+    import resilience
+    import snapshot
+    if profile:
+        import chart_renderer
+        chart_renderer.DEFAULT_PROFILE = profile
+
+    t0 = time.perf_counter()
+    instrumentation.start_run("pipeline " + " ".join(targets))
+    resilience.set_budget(budget or resilience.RUN_BUDGET)
+    status = run(targets, workers)
+    if "chart_renderer" in sys.modules:
+        sys.modules["chart_renderer"].shutdown()
+    failed = [n for n, s in status.items() if s != "ok"]
+    tripped = {site: s for site, s in resilience.state().items() if s != "closed"}
+    if tripped:
+        print(f"🔌 熔断中的数据源: {tripped}")
+    instrumentation.finish_run("failed" if failed else "ok")
+    seconds = time.perf_counter() - t0
+    snapshot.update("run", {"targets": list(targets), "status": status, "failed": failed,
+                            "seconds": round(seconds, 1), "tripped": tripped})
+    print(f"\n🎉 流水线结束 {seconds:.1f}s，成功 {len(status) - len(failed)} / {len(status)}")
+    return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Metal Quant 每日流水线")
+    parser.add_argument("targets", nargs="*", default=["fetch", "compute", "render"],
+                        help="阶段名 (fetch/compute/render/publish) 或节点名")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="并发节点数")
+    parser.add_argument("--list", action="store_true", help="列出全部节点及依赖")
+    parser.add_argument("--profile", help="图表输出规格 (print/web/webp/vector，默认取 METALQUANT_CHART_PROFILE)")
+    parser.add_argument("--budget", type=float, default=None,
+                        help="上游请求的总时间预算 (秒，默认取 METALQUANT_RUN_BUDGET 或 900)；用完后全部退回本地数据")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name in sorted(NODES):
+            deps = ", ".join(NODES[name].deps) or "-"
+            print(f"{name:<18} <- {deps}")
+        return 0
+
+    status = execute(args.targets, args.workers, args.profile, args.budget)
+    return 1 if any(s != "ok" for s in status.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import pandas as pd
+from fx_service import DEFAULT_FX, is_fallback
+
+# ==========================================
+# 多金属溢价引擎
+# ==========================================
+# 国内价 vs 国外价折算的理论价 (进口平价):
+#   Implied = Foreign * (国内计价单位折合的国外计价单位) * 汇率 [* (1 + 增值税)]
+#   Premium = (Domestic / Implied - 1) * 100
+# 所有金属对齐到一张宽表上一次算完，图表和 Notion 报告都读这里的结果。
+
+# 每个计价单位折合多少盎司
+UNITS = {
+    "oz": 1.0,
+    "g": 1 / 31.1035,   # 1 oz = 31.1035 g
+    "kg": 32.1507,      # 1 kg = 32.1507 oz
+}
+
+VAT_RATE = 0.13     # 进口增值税
+
+# 金属登记表: 国内代码 / 国外代码 / 国内单位 / 国外单位 / 国外报价币种
+METALS = {
+    "Gold": {"domestic": "au0", "foreign": "GC", "unit": "g", "foreign_unit": "oz", "currency": "USD"},
+    "Silver": {"domestic": "ag0", "foreign": "SI", "unit": "kg", "foreign_unit": "oz", "currency": "USD"},
+    # 铂金对标上金所现货 (人民币/克)，算的是期现溢价
+    "Platinum": {"domestic": "pt", "foreign": "Pt99.95", "unit": "g", "foreign_unit": "g", "currency": "CNY"},
+    "Platinum_NYMEX": {"domestic": "pt", "foreign": "PL", "unit": "g", "foreign_unit": "oz", "currency": "USD"},
+    "Palladium_NYMEX": {"domestic": "pa", "foreign": "PA", "unit": "g", "foreign_unit": "oz", "currency": "USD"},
+}
+
+FIELDS = ["Domestic", "Foreign", "FX", "Implied", "Premium"]
+
+
+def unit_factor(spec):
+    """1 个国内计价单位 = 多少个国外计价单位"""
+    return UNITS[spec["unit"]] / UNITS[spec["foreign_unit"]]
+
+
+def premium_quote(metal, domestic, foreign, fx=DEFAULT_FX, vat=False):
+    """单个报价的溢价 % (与 compute_premiums 同一公式，盘中监控 / 告警逐笔用)"""
+    spec = METALS[metal]
+    rate = fx if spec["currency"] == "USD" else 1.0
+    implied = foreign * unit_factor(spec) * rate * ((1 + VAT_RATE) if vat else 1.0)
+    return (domestic / implied - 1) * 100
+
+
+def compute_premiums(domestic, foreign, fx=None, metals=None, vat=False):
+    """
+    domestic / foreign: {金属名: 以日期为索引的价格 Series}
+    fx: USD/CNY 日序列 (缺失日期前向填充，仍缺用 DEFAULT_FX)
+    vat: True 时理论价含 13% 增值税 (含税平价)
+    返回列为 (字段, 金属) 的宽表，字段见 FIELDS；某金属某日缺价则为 NaN
+    attrs["fx_fallback"]: 美元报价的金属用了固定汇率兜底
+    """
+    names = [m for m in (metals or METALS) if m in domestic and m in foreign]
+    if not names:
+        return pd.DataFrame(columns=pd.MultiIndex.from_product([FIELDS, []]))
+
+    dom = pd.DataFrame({m: domestic[m] for m in names})
+    fgn = pd.DataFrame({m: foreign[m] for m in names})
+    for frame in (dom, fgn):
+        if frame.index.tz is not None:
+            frame.index = frame.index.tz_localize(None)
+    index = dom.index.union(fgn.index)
+    dom, fgn = dom.reindex(index), fgn.reindex(index)
+
+    # 汇率: 美元报价的列乘 USD/CNY，人民币报价的列乘 1
+    if fx is not None and len(fx):
+        rate = fx.reindex(index.union(fx.index)).sort_index().ffill().reindex(index).fillna(DEFAULT_FX)
+    else:
+        rate = pd.Series(DEFAULT_FX, index=index)
+    usd = [METALS[m]["currency"] == "USD" for m in names]
+    fx_wide = pd.DataFrame({m: rate if is_usd else 1.0 for m, is_usd in zip(names, usd)}, index=index)
+
+    factors = pd.Series({m: unit_factor(METALS[m]) for m in names})
+    implied = fgn * factors * fx_wide * ((1 + VAT_RATE) if vat else 1.0)
+    premium = (dom / implied - 1) * 100
+
+    out = pd.concat({"Domestic": dom, "Foreign": fgn, "FX": fx_wide,
+                     "Implied": implied, "Premium": premium}, axis=1)
+    out.attrs["fx_fallback"] = any(usd) and is_fallback(fx)
+    return out
+
+
+def metal_view(premiums, metal):
+    """单个金属的 Domestic / Foreign / FX / Implied / Premium (只保留两边都有价的日期)"""
+    if premiums.empty or metal not in premiums.columns.get_level_values(1):
+        return pd.DataFrame(columns=FIELDS)
+    return premiums.xs(metal, axis=1, level=1).dropna(subset=["Domestic", "Foreign"])
+
+
+def latest_premiums(premiums):
+    """{金属: 最新溢价 %}"""
+    if premiums.empty:
+        return {}
+    prem = premiums["Premium"]
+    return {m: float(prem[m].dropna().iloc[-1]) for m in prem.columns if prem[m].notna().any()}
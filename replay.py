@@ -0,0 +1,268 @@
+import os
+import re
+import json
+import time
+import pickle
+import hashlib
+import threading
+from collections import Counter, defaultdict
+import instrumentation
+import resilience
+
+# ==========================================
+# 上游数据 录制 / 回放
+# ==========================================
+# 所有外部数据源 (akshare / yfinance / requests.get) 都经过这里:
+#   METALQUANT_DATA_MODE=live    (默认) 直接请求
+#   METALQUANT_DATA_MODE=record  请求的同时把返回值存进夹具目录
+#   METALQUANT_DATA_MODE=replay  不联网，从夹具目录读回，可注入延迟
+# 夹具目录: METALQUANT_FIXTURES (默认 fixtures/)
+# 注入延迟: METALQUANT_REPLAY_LATENCY，秒数 ("0.2") 或按来源 ("akshare=0.3,yfinance=0.5,http=1")
+# live / record 模式下的真实请求都经过 resilience.guarded (时限 / 重试 / 熔断 / 运行预算)。
+#
+# 录制时请配合空的 METALQUANT_CACHE_DIR，否则命中本地缓存的请求不会被录下来。
+# 回放时日期类参数 (start_date 等) 对不上会退回到同一接口 + 同一品种最近录制的那份。
+
+MODE = os.getenv("METALQUANT_DATA_MODE", "live")
+FIXTURE_DIR = os.getenv("METALQUANT_FIXTURES", "fixtures")
+INDEX_NAME = "index.json"
+
+# 参数名里带这些词的视为日期参数，回放时可以放宽匹配
+DATE_PARAM = re.compile(r"date|start|end|period", re.I)
+
+CALLS = Counter()   # (来源, 接口) -> 次数，benchmark 用
+SECONDS = defaultdict(float)   # 来源 -> 累计耗时 (并发请求会重叠计算)
+_lock = threading.Lock()
+
+
+class FixtureMissing(KeyError):
+    """回放模式下没有对应的录制数据"""
+
+
+class RecordedError(RuntimeError):
+    """录制时上游抛出的异常，回放时原样抛出 (消息相同)"""
+
+
+class Response:
+    """requests.Response 的最小替身 (回放 HTTP 用)"""
+
+    def __init__(self, url, status_code, headers, content):
+        from requests.structures import CaseInsensitiveDict
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            import requests
+            raise requests.HTTPError(f"{self.status_code} for url: {self.url}")
+
+
+def mode():
+    return MODE
+
+
+def parse_latency(text):
+    """'0.2' -> {'*': 0.2}；'akshare=0.3,http=1' -> {'akshare': 0.3, 'http': 1.0}"""
+    latency = {}
+    for part in filter(None, (p.strip() for p in (text or "").split(","))):
+        if "=" in part:
+            kind, sec = part.split("=", 1)
+            latency[kind.strip()] = float(sec)
+        else:
+            latency["*"] = float(part)
+    return latency
+
+
+LATENCY = parse_latency(os.getenv("METALQUANT_REPLAY_LATENCY"))
+
+
+def _key(kind, name, params):
+    raw = json.dumps({"kind": kind, "name": name, "params": params}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _paths(kind, name, key):
+    folder = os.path.join(FIXTURE_DIR, kind, re.sub(r"[^\w.]", "_", name))
+    return os.path.join(folder, key + ".pkl"), os.path.join(FIXTURE_DIR, INDEX_NAME)
+
+
+def _load_index():
+    path = os.path.join(FIXTURE_DIR, INDEX_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as fp:
+        return json.load(fp)
+
+
+def _strip_dates(params):
+    return {k: v for k, v in params.items() if not DATE_PARAM.search(k)}
+
+
+def save(kind, name, params, payload):
+    """写一份夹具 (payload: {'value': ...} 或 {'error': ...})，并登记到 index.json"""
+    key = _key(kind, name, params)
+    path, index_path = _paths(kind, name, key)
+    with _lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as fp:
+            pickle.dump(payload, fp)
+        os.replace(path + ".tmp", path)
+        index = _load_index()
+        index[key] = {"kind": kind, "name": name, "params": params, "recorded": time.time()}
+        with open(index_path + ".tmp", "w", encoding="utf-8") as fp:
+            json.dump(index, fp, indent=1, ensure_ascii=False, default=str)
+        os.replace(index_path + ".tmp", index_path)
+
+
+def exists(kind, name, params):
+    return os.path.exists(_paths(kind, name, _key(kind, name, params))[0])
+
+
+def load(kind, name, params):
+    """先精确匹配参数；没有则放宽日期参数，取同接口同品种最近录制的一份"""
+    key = _key(kind, name, params)
+    path = _paths(kind, name, key)[0]
+    if not os.path.exists(path):
+        loose = _strip_dates(params)
+        candidates = [(meta.get("recorded", 0), k) for k, meta in _load_index().items()
+                      if meta["kind"] == kind and meta["name"] == name
+                      and _strip_dates(meta.get("params", {})) == loose]
+        if not candidates:
+            raise FixtureMissing(f"{kind}:{name} {params}")
+        path = _paths(kind, name, max(candidates)[1])[0]
+    with open(path, "rb") as fp:
+        return pickle.load(fp)
+
+
+def call(kind, name, func, params, should_record=None):
+    """
+    按当前模式执行一次上游调用
+    func: 无参函数，live / record 模式下真正发请求
+    should_record: record 模式下判断返回值是否值得存 (默认都存)
+    """
+    with _lock:
+        CALLS[(kind, name)] += 1
+    t0 = time.perf_counter()
+    result = error = None
+    try:
+        result = _call(kind, name, func, params, should_record)
+        return result
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        seconds = time.perf_counter() - t0
+        with _lock:
+            SECONDS[kind] += seconds
+        instrumentation.upstream(kind, name, params, seconds, result, error)
+
+
+def _call(kind, name, func, params, should_record):
+    if MODE == "replay":
+        delay = LATENCY.get(kind, LATENCY.get("*", 0))
+        if delay:
+            time.sleep(delay)
+        payload = load(kind, name, params)
+        if "error" in payload:
+            raise RecordedError(payload["error"])
+        return payload["value"]
+
+    if MODE != "record":
+        return resilience.guarded(kind, name, func)
+    try:
+        value = resilience.guarded(kind, name, func)
+    except (resilience.CircuitOpen, resilience.BudgetExhausted):
+        raise    # 本地主动放弃的请求不算上游的行为，不录
+    except Exception as e:
+        # 已经录到正常数据的不被一次失败覆盖
+        if not exists(kind, name, params):
+            save(kind, name, params, {"error": f"{type(e).__name__}: {e}"})
+        raise
+    if should_record is None or should_record(value):
+        save(kind, name, params, {"value": value})
+    return value
+
+
+# ==========================================
+# 各数据源的入口
+# ==========================================
+
+def akshare_call(name, **params):
+    """akshare 接口 (data_cache.ak 的底层)"""
+    def live():
+        import akshare
+        return getattr(akshare, name)(**params)
+    return call("akshare", name, live, params)
+
+
+def download(tickers, **kwargs):
+    """yfinance.download 的替身"""
+    def live():
+        import yfinance as yf
+        return yf.download(tickers, **kwargs)
+    params = {"tickers": tickers, **{k: v for k, v in kwargs.items() if k != "progress"}}
+    return call("yfinance", "download", live, params)
+
+
+_session = [None]
+
+
+def session():
+    """进程内共用的 requests.Session (连接池 + keep-alive，CFTC 逐年下载和告警 webhook 共用)"""
+    with _lock:
+        if _session[0] is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            _session[0] = s
+        return _session[0]
+
+
+def http_get(url, **kwargs):
+    """
+    requests.get 的替身 (只录 状态码 / 响应头 / 原始字节)
+    条件请求头不进键: 回放时总是返回录到的完整响应；已录到 200 时不会被 304 覆盖
+    未指定 timeout 时用 resilience.HTTP_TIMEOUT；5xx / 429 抛 HTTPError (可重试)
+    """
+    import requests
+    kwargs.setdefault("timeout", resilience.HTTP_TIMEOUT)
+
+    def get():
+        r = session().get(url, **kwargs)
+        if r.status_code >= 500 or r.status_code == 429:
+            raise requests.HTTPError(f"{r.status_code} for url: {url}", response=r)
+        return r
+
+    if MODE not in ("record", "replay"):
+        return call("http", "get", get, {"url": url})
+
+    def live():
+        r = get()
+        return Response(url, r.status_code, dict(r.headers), r.content)
+
+    params = {"url": url}
+
+    def worth(resp):
+        return resp.status_code == 200 or not exists("http", "get", params)
+
+    return call("http", "get", live, params, should_record=worth)
+
+
+def stats():
+    """本进程各来源的调用次数 {'akshare:futures_main_sina': 3, ...}"""
+    with _lock:
+        items = sorted(CALLS.items())
+    return {f"{kind}:{name}": n for (kind, name), n in items}
+
+
+if __name__ == "__main__":
+    index = _load_index()
+    by_source = Counter(f"{m['kind']}:{m['name']}" for m in index.values())
+    print(f"📼 夹具目录 {FIXTURE_DIR}: {len(index)} 份录制")
+    for source, n in sorted(by_source.items()):
+        print(f"   {source:<45} {n}")
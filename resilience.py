@@ -0,0 +1,218 @@
+import os
+import time
+import random
+import socket
+import threading
+import instrumentation
+
+# ==========================================
+# 有界延迟的上游调用: 时限 + 退避重试 + 熔断 + 运行总预算
+# ==========================================
+# replay.call 在 live / record 模式下通过 guarded() 发出每一次真实请求:
+# - 时限: 每个站点一个单次时限，请求在后台线程里跑，超时即放弃 (akshare 接口本身不收 timeout 参数)
+# - 重试: 只重试网络类错误 (超时 / 连接失败 / 5xx / 429)，指数退避 + 全抖动；
+#         "没有这个合约" 之类的数据错误直接抛出，不重试，也不计入熔断
+# - 熔断: 同一站点连续 FAILURE_THRESHOLD 次网络错误后熔断 COOLDOWN 秒，期间直接抛 CircuitOpen，
+#         冷却后放一个探测请求，成功则恢复
+# - 预算: set_budget(秒) 之后所有请求的时限都不超过剩余预算，预算用完直接抛 BudgetExhausted
+# 上面三种失败都由调用方退回到最近一次成功的本地数据 (data_cache 的过期缓存、history_store 的本地历史、
+# 汇率库、CFTC 本地解析结果)，所以站点降级时整次运行仍在预算内结束。
+
+# 接口 -> 实际的上游站点 (同一站点共用一个熔断器和时限配置)
+BACKENDS = {
+    "akshare:futures_main_sina": "sina",
+    "akshare:futures_zh_daily_sina": "sina",
+    "akshare:futures_foreign_hist": "sina",
+    "akshare:futures_zh_minute_sina": "sina",
+    "akshare:currency_boc_sina": "boc",
+    "akshare:spot_hist_sge": "sge",
+    "akshare:futures_shfe_warehouse_receipt": "shfe",
+    "yfinance:download": "yahoo",
+    "http:get": "cftc",
+}
+
+# timeout: 单次请求时限 (秒)；retries: 失败后最多再试几次
+POLICIES = {
+    "sina": {"timeout": 20, "retries": 2},
+    "boc": {"timeout": 15, "retries": 1},    # 中行接口慢，fx_service 另有 Yahoo 对冲
+    "sge": {"timeout": 20, "retries": 2},
+    "shfe": {"timeout": 20, "retries": 1},
+    "yahoo": {"timeout": 30, "retries": 2},
+    "cftc": {"timeout": 90, "retries": 2},   # 年度 ZIP 几 MB
+    "default": {"timeout": 30, "retries": 2},
+}
+
+BACKOFF_BASE = 0.5          # 第 n 次重试前等待 U(0, min(BACKOFF_CAP, BASE * 2^n)) 秒
+BACKOFF_CAP = 8.0
+FAILURE_THRESHOLD = 3       # 连续网络错误几次后熔断
+COOLDOWN = 120              # 熔断持续秒数
+
+# requests 的 (连接, 读取) 超时，http_get 未指定时使用
+HTTP_TIMEOUT = (10, 60)
+
+# pipeline 的默认运行预算 (秒)：超过后不再发上游请求，全部退回本地数据
+RUN_BUDGET = float(os.getenv("METALQUANT_RUN_BUDGET", "900"))
+
+_lock = threading.Lock()
+_breakers = {}              # 站点 -> {"failures": n, "opened": 时间戳 / None, "probing": bool}
+_deadline = [None]          # 运行预算截止时间 (monotonic)
+
+
+class DeadlineExceeded(TimeoutError):
+    """单次请求超过站点时限"""
+
+
+class CircuitOpen(RuntimeError):
+    """站点处于熔断期，未发出请求"""
+
+
+class BudgetExhausted(TimeoutError):
+    """运行总预算已用完，未发出请求"""
+
+
+def backend(kind, name):
+    return BACKENDS.get(f"{kind}:{name}", kind)
+
+
+def policy(site):
+    return {**POLICIES["default"], **POLICIES.get(site, {})}
+
+
+# ==========================================
+# 运行预算
+# ==========================================
+
+def set_budget(seconds):
+    """从现在起最多再花 seconds 秒在上游请求上 (None 取消预算)"""
+    _deadline[0] = None if seconds is None else time.monotonic() + seconds
+
+
+def remaining():
+    """剩余预算秒数，没有预算返回 None"""
+    if _deadline[0] is None:
+        return None
+    return _deadline[0] - time.monotonic()
+
+
+# ==========================================
+# 熔断器
+# ==========================================
+
+def _admit(site):
+    """请求前检查熔断状态，不放行则抛 CircuitOpen"""
+    with _lock:
+        b = _breakers.setdefault(site, {"failures": 0, "opened": None, "probing": False})
+        if b["opened"] is None:
+            return
+        if time.monotonic() - b["opened"] < COOLDOWN or b["probing"]:
+            raise CircuitOpen(f"{site} 熔断中 (连续失败 {b['failures']} 次)")
+        b["probing"] = True    # 冷却结束，只放一个探测请求
+
+
+def _record(site, ok):
+    with _lock:
+        b = _breakers.setdefault(site, {"failures": 0, "opened": None, "probing": False})
+        b["probing"] = False
+        if ok:
+            b["failures"], b["opened"] = 0, None
+            return
+        b["failures"] += 1
+        tripped = b["failures"] >= FAILURE_THRESHOLD and b["opened"] is None
+        if b["failures"] >= FAILURE_THRESHOLD:
+            b["opened"] = time.monotonic()
+    if tripped:
+        print(f"   🔌 {site} 连续失败 {FAILURE_THRESHOLD} 次，熔断 {COOLDOWN}s")
+        instrumentation.count("circuit_open", source=site)
+
+
+def state():
+    """各站点熔断状态 {'sina': 'closed' / 'open' / 'half-open'}"""
+    now = time.monotonic()
+    with _lock:
+        return {site: "closed" if b["opened"] is None
+                else "open" if now - b["opened"] < COOLDOWN else "half-open"
+                for site, b in sorted(_breakers.items())}
+
+
+def reset():
+    with _lock:
+        _breakers.clear()
+    set_budget(None)
+
+
+# ==========================================
+# 单次调用
+# ==========================================
+
+def is_transient(exc):
+    """网络类错误 (值得重试、计入熔断)；数据错误 (空表、解析失败、合约不存在) 返回 False"""
+    if isinstance(exc, (DeadlineExceeded, TimeoutError, ConnectionError, socket.timeout)):
+        return True
+    # 返回内容解析失败 (含 requests 的 JSONDecodeError，它同时是 RequestException) 是数据问题，重试也一样
+    if isinstance(exc, ValueError):
+        return False
+    try:
+        import requests
+        if isinstance(exc, requests.exceptions.HTTPError):
+            status = getattr(exc.response, "status_code", None)
+            return status is None or status >= 500 or status == 429
+        if isinstance(exc, requests.exceptions.RequestException):
+            return True
+    except ImportError:
+        pass
+    return False
+
+
+def _with_deadline(func, timeout, label):
+    """在后台线程里执行 func，超过 timeout 秒抛 DeadlineExceeded (线程被放弃，自行结束)"""
+    box = {}
+    done = threading.Event()
+
+    def target():
+        try:
+            box["value"] = func()
+        except BaseException as e:
+            box["error"] = e
+        finally:
+            done.set()
+
+    threading.Thread(target=target, daemon=True, name=f"fetch-{label}").start()
+    if not done.wait(timeout):
+        raise DeadlineExceeded(f"{label} 超过 {timeout:.0f}s 未返回")
+    if "error" in box:
+        raise box["error"]
+    return box["value"]
+
+
+def guarded(kind, name, func):
+    """按站点策略执行一次上游调用 (时限 / 重试 / 熔断 / 预算)，最终失败时抛出最后一个异常"""
+    site = backend(kind, name)
+    conf = policy(site)
+    label = f"{kind}:{name}"
+    attempt = 0
+    while True:
+        left = remaining()
+        if left is not None and left <= 0:
+            raise BudgetExhausted(f"运行预算已用完，跳过 {label}")
+        _admit(site)
+        timeout = conf["timeout"] if left is None else min(conf["timeout"], left)
+        try:
+            value = _with_deadline(func, timeout, label)
+        except Exception as e:
+            if not is_transient(e):
+                _record(site, True)    # 站点有响应，只是数据不对
+                raise
+            _record(site, False)
+            if attempt >= conf["retries"]:
+                raise
+            attempt += 1
+            wait = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+            left = remaining()
+            if left is not None and wait >= left:
+                raise
+            print(f"   🔁 {label} 第 {attempt} 次重试 ({wait:.1f}s 后): {e}")
+            instrumentation.count("retry", source=label, attempt=attempt, error=f"{type(e).__name__}: {e}")
+            time.sleep(wait)
+            continue
+        _record(site, True)
+        return value
@@ -0,0 +1,203 @@
+import os
+import json
+import bisect
+from collections import deque
+import pandas as pd
+from data_cache import CACHE_DIR
+
+# ==========================================
+# 增量滚动统计 (溢价 / 价差 / 换手率 / 持仓 / CFTC 净多)
+# ==========================================
+# 每条派生序列在多个窗口 (3m / 1y / 3y) 上维护 均值、标准差、z 值、分位数:
+# - 每个窗口是一个定长 deque + 和 / 平方和 + 有序表，新观测进来时
+#   均值方差 O(1)，分位数二分定位 (窗口最多几百个点)
+# - 状态 (每条序列最后一个观测的日期 + 最长窗口内的原始值) 存到 .cache/rolling_stats.json，
+#   每天只推入上次之后的新观测，不用从全历史重算
+# - 第一次见到的序列用调用方给的 seed (本地历史库里的全部历史) 自举，最多取最长窗口那么多
+#
+# update_notion 用这里的分位 / z 值代替写死的阈值 (换手率 > 3、持仓 > 20000 手、CFTC 周变化 > 5000 手)，
+# 报告里写成 "3y 第 97 百分位"。
+
+STATE_PATH = os.path.join(CACHE_DIR, "rolling_stats.json")
+
+PERIODS_PER_YEAR = {"daily": 252, "weekly": 52}
+WINDOWS = {"3m": 0.25, "1y": 1, "3y": 3}   # 窗口名 -> 年数
+MIN_OBS = {"daily": 20, "weekly": 8}        # 窗口内少于这么多观测不给统计 (周频的 3m 窗口只有 13 个点)
+
+
+class RollingWindow:
+    """定长滚动窗口: push O(1)，同时维护和 / 平方和；ranked=True 时另维护有序表算分位"""
+
+    def __init__(self, size, ranked=False):
+        self.values = deque(maxlen=size)
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.ranked = [] if ranked else None
+
+    def push(self, x):
+        if len(self.values) == self.values.maxlen:
+            old = self.values[0]
+            self.total -= old
+            self.total_sq -= old * old
+            if self.ranked is not None:
+                del self.ranked[bisect.bisect_left(self.ranked, old)]
+        self.values.append(x)
+        self.total += x
+        self.total_sq += x * x
+        if self.ranked is not None:
+            bisect.insort(self.ranked, x)
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def full(self):
+        return len(self.values) == self.values.maxlen
+
+    @property
+    def last(self):
+        return self.values[-1] if self.values else None
+
+    def mean(self):
+        return self.total / len(self.values) if self.values else None
+
+    def std(self):
+        n = len(self.values)
+        if n < 2:
+            return None
+        var = (self.total_sq - self.total * self.total / n) / (n - 1)
+        return max(var, 0.0) ** 0.5
+
+    def zscore(self, x=None):
+        x = self.last if x is None else x
+        sd = self.std()
+        return None if x is None or not sd else (x - self.mean()) / sd
+
+    def percentile(self, x=None):
+        """x 在窗口内的分位 (0-100，<= x 的占比)"""
+        x = self.last if x is None else x
+        if x is None or not self.ranked:
+            return None
+        return bisect.bisect_right(self.ranked, x) / len(self.ranked) * 100
+
+
+class SeriesStats:
+    """一条序列在各窗口上的滚动统计"""
+
+    def __init__(self, freq="daily", last=None, values=()):
+        self.freq = freq
+        self.last = last        # 最后一个观测的日期 (ISO 字符串)
+        per_year = PERIODS_PER_YEAR[freq]
+        self.windows = {label: RollingWindow(max(2, round(years * per_year)), ranked=True)
+                        for label, years in WINDOWS.items()}
+        for v in values:
+            self.push(v)
+
+    def push(self, x):
+        for w in self.windows.values():
+            w.push(x)
+
+    @property
+    def longest(self):
+        return max(self.windows.values(), key=lambda w: w.values.maxlen)
+
+    @property
+    def value(self):
+        return self.longest.last
+
+    def summary(self, label):
+        """某个窗口的 {n, full, mean, std, z, pct}；观测不足 MIN_OBS 返回 None"""
+        w = self.windows[label]
+        if len(w) < MIN_OBS[self.freq]:
+            return None
+        return {"n": len(w), "full": w.full, "mean": w.mean(), "std": w.std(),
+                "z": w.zscore(), "pct": w.percentile()}
+
+    def best(self):
+        """(窗口名, 统计) —— 优先取已填满的最长窗口，否则取观测数够的最长窗口"""
+        ready = [(label, self.summary(label)) for label in sorted(
+            self.windows, key=lambda k: self.windows[k].values.maxlen, reverse=True)]
+        ready = [(label, s) for label, s in ready if s]
+        full = [(label, s) for label, s in ready if s["full"]]
+        return (full or ready or [(None, None)])[0]
+
+    def percentile(self, x, label="1y"):
+        """x 在 label 窗口内的分位；该窗口观测不足时用 best() 的窗口，都不够返回 None"""
+        if self.summary(label) is None:
+            label = self.best()[0]
+        return None if label is None else self.windows[label].percentile(x)
+
+    def describe(self):
+        """'3y 第 97 百分位' / '近 180 期第 60 百分位'；观测不足返回 None"""
+        label, s = self.best()
+        if s is None:
+            return None
+        span = label if s["full"] else f"近 {s['n']} 期"
+        return f"{span} 第 {s['pct']:.0f} 百分位"
+
+    def to_state(self):
+        return {"freq": self.freq, "last": self.last, "values": [round(v, 6) for v in self.longest.values]}
+
+
+class RollingStats:
+    """全部序列的滚动统计，load() / update() / save()"""
+
+    def __init__(self, path=STATE_PATH):
+        self.path = path
+        self.series = {}
+
+    @classmethod
+    def load(cls, path=STATE_PATH):
+        store = cls(path)
+        try:
+            with open(path, encoding="utf-8") as fp:
+                state = json.load(fp)
+        except (OSError, ValueError):
+            state = {}
+        for name, s in state.items():
+            store.series[name] = SeriesStats(s["freq"], s["last"], s["values"])
+        return store
+
+    def update(self, name, series, freq="daily", seed=None):
+        """
+        把 series (日期索引) 中上次之后的新观测推进 name 的窗口，返回 SeriesStats
+        第一次见到的序列先用 seed() 返回的长历史，series 只补 seed 最后一天之后的观测
+        (series 可能是换月后的具体合约，重叠日期上不能盖掉连续序列)，只取最后 "最长窗口" 个观测自举
+        """
+        stats = self.series.get(name)
+        if stats is None or stats.freq != freq:
+            stats = self.series[name] = SeriesStats(freq)
+        if stats.last is None and seed is not None:
+            try:
+                history = seed()
+            except Exception as e:
+                print(f"   ⚠️ {name} 历史自举失败: {e}")
+                history = None
+            if history is not None and not history.empty:
+                history = history.dropna()
+                if series is not None and not history.empty:
+                    series = pd.concat([history, series[series.index > history.index.max()]])
+                elif not history.empty:
+                    series = history
+        if series is None or series.empty:
+            return stats
+        s = series.dropna()
+        s = s[~s.index.duplicated(keep="last")].sort_index()
+        if stats.last is not None:
+            s = s[s.index > pd.Timestamp(stats.last)]
+        else:
+            s = s.tail(stats.longest.values.maxlen)
+        for v in s.values:
+            stats.push(float(v))
+        if not s.empty:
+            stats.last = pd.Timestamp(s.index[-1]).isoformat()
+        return stats
+
+    def get(self, name):
+        return self.series.get(name)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as fp:
+            json.dump({name: s.to_state() for name, s in self.series.items()}, fp, ensure_ascii=False)
+        os.replace(self.path + ".tmp", self.path)
@@ -1,8 +1,10 @@
-import akshare as ak
+from data_cache import ak
 import pandas as pd
 import matplotlib.pyplot as plt
 import datetime
 import platform
+from premium_engine import compute_premiums, metal_view
+from fx_service import get_usdcny
 
 # --- 基础设置 ---
 system_name = platform.system()
@@ -41,16 +43,7 @@ def get_data_v3():
 
     # 3. 汇率 (USD/CNY)
     print("   -> 真实汇率...")
-    try:
-        fx_df = ak.currency_boc_sina(symbol="美元", start_date=start_date_str, end_date=end_date.strftime("%Y%m%d"))
-        fx_df['date'] = pd.to_datetime(fx_df['日期'])
-        fx_df.set_index('date', inplace=True)
-        fx_df.sort_index(inplace=True)
-        fx_rate = fx_df['中行折算价'].astype(float) / 100
-        fx_rate = fx_rate.resample('D').ffill()
-    except:
-        print("⚠️ 汇率获取失败，使用固定汇率 7.25")
-        fx_rate = pd.Series(7.25, index=shfe.index)
+    fx_rate = get_usdcny(start_date, end_date)
 
     # 4. CFTC 持仓数据 (带容错机制)
     print("   -> CFTC 投机头寸...")
@@ -87,22 +80,10 @@ def get_data_v3():
 def plot_final_premium(shfe, comex, fx_rate):
     print("🎨 [2/3] 绘制溢价图 (恢复含税逻辑，匹配研报)...")
     
-    df = pd.DataFrame()
-    df['SHFE_Price'] = shfe['收盘价'] # 含税价
-    
-    df = df.join(comex['close'], how='inner')
-    df.rename(columns={'close': 'COMEX_USD'}, inplace=True)
-    
-    df = df.join(fx_rate.rename('fx'), how='left')
-    df['fx'] = df['fx'].ffill().fillna(7.25)
-
-    # 理论价格 (未加税)
-    # 1kg = 32.1507 oz
+    # 理论价格 (未加税, 1kg = 32.1507 oz)
     # 我们不手动除以 1.13，因为我们要看的是“市场报价价差”
-    df['Implied_CNY'] = (df['COMEX_USD'] * 32.1507) * df['fx']
-    
-    # 溢价率
-    df['Premium'] = (df['SHFE_Price'] / df['Implied_CNY'] - 1) * 100
+    premiums = compute_premiums({"Silver": shfe['收盘价']}, {"Silver": comex['close']}, fx_rate)
+    df = metal_view(premiums, "Silver")
     
     # 绘图
     fig, ax = plt.subplots(figsize=(10, 5))
@@ -0,0 +1,53 @@
+import os
+import json
+import datetime
+import threading
+
+# ==========================================
+# 运行快照 (给 `metalquant status` 秒开用)
+# ==========================================
+# pipeline 在算完溢价、跑完一轮之后把几个关键数字写进一个小 JSON:
+#   premiums  最新溢价 / 汇率 / 数据日期
+#   run       上次运行的时间、结果、耗时、熔断中的数据源
+#   intraday  盘中监控 (intraday.py) 最新一根分钟线的溢价 / z 值 / 量仓比 / 价差
+# 读取时只用标准库，不导入 pandas / akshare / matplotlib。
+
+# 与 data_cache.CACHE_DIR 相同 (这里不导入 data_cache，它会带上 pandas)
+STATUS_PATH = os.path.join(os.getenv("METALQUANT_CACHE_DIR", ".cache"), "status.json")
+
+_lock = threading.Lock()
+
+
+def load():
+    try:
+        with open(STATUS_PATH, encoding="utf-8") as fp:
+            return json.load(fp)
+    except Exception:
+        return {}
+
+
+def update(section, payload):
+    """合并写入一个小节 (自动加 updated 时间)"""
+    with _lock:
+        status = load()
+        status[section] = {**payload, "updated": datetime.datetime.now().isoformat(timespec="seconds")}
+        os.makedirs(os.path.dirname(STATUS_PATH) or ".", exist_ok=True)
+        with open(STATUS_PATH + ".tmp", "w", encoding="utf-8") as fp:
+            json.dump(status, fp, indent=1, ensure_ascii=False, default=str)
+        os.replace(STATUS_PATH + ".tmp", STATUS_PATH)
+
+
+def save_premiums(premiums):
+    """premium_engine 溢价宽表 -> premiums 小节"""
+    from premium_engine import METALS, latest_premiums
+    if premiums is None or premiums.empty:
+        return
+    prem = premiums["Premium"].dropna(how="all")
+    usd = [m for m in premiums["FX"].columns if METALS[m]["currency"] == "USD"]
+    fx = premiums["FX"][usd[0]].dropna() if usd else None
+    update("premiums", {
+        "date": f"{prem.index[-1]:%Y-%m-%d}" if not prem.empty else None,
+        "values": {m: round(v, 4) for m, v in latest_premiums(premiums).items()},
+        "fx": round(float(fx.iloc[-1]), 4) if fx is not None and not fx.empty else None,
+        "fx_fallback": bool(premiums.attrs.get("fx_fallback")),
+    })
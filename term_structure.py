@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+from contract_discovery import listed_contracts, pick_term_pair
+from continuous_series import fetch_contracts, expiry_date
+
+# ==========================================
+# 期限结构引擎 (全部挂牌月份)
+# ==========================================
+# 并发拉取某品种全部挂牌合约 -> 日期 x 合约 的价格矩阵，
+# 价差、年化展期收益、曲线快照都在 numpy 数组上一次算完。
+# 合约按当天挂牌月份生成，不再因为写死的合约到期而失效。
+
+
+class TermStructure:
+    def __init__(self, root, prices):
+        """prices: 日期 x 合约 的收盘价宽表 (列按到期先后排序)"""
+        self.root = root
+        self.prices = prices
+        self.expiries = pd.DatetimeIndex([expiry_date(c) for c in prices.columns])
+
+    @property
+    def contracts(self):
+        return list(self.prices.columns)
+
+    def days_to_expiry(self):
+        """日期 x 合约 的剩余天数矩阵"""
+        dte = (self.expiries.values[None, :] - self.prices.index.values[:, None]) / np.timedelta64(1, "D")
+        return pd.DataFrame(dte, index=self.prices.index, columns=self.prices.columns)
+
+    def _front(self):
+        """每个日期最近的在交易合约 (列位置)，没有则为 -1"""
+        valid = self.prices.notna().to_numpy()
+        idx = valid.argmax(axis=1)
+        idx[~valid.any(axis=1)] = -1
+        return idx
+
+    def spreads(self):
+        """各合约相对当日近月的价差 %: (F / F_front - 1) * 100"""
+        p = self.prices.to_numpy(dtype=float)
+        front = self._front()
+        rows = np.arange(len(p))
+        base = np.where(front >= 0, p[rows, front], np.nan)
+        return pd.DataFrame((p / base[:, None] - 1) * 100, index=self.prices.index, columns=self.prices.columns)
+
+    def roll_yield(self):
+        """
+        相对近月的年化展期收益 %: ((F / F_front) ^ (365 / 天数差) - 1) * 100
+        负值 = Backwardation (Tightness)
+        """
+        p = self.prices.to_numpy(dtype=float)
+        dte = self.days_to_expiry().to_numpy()
+        front = self._front()
+        rows = np.arange(len(p))
+        base_p = np.where(front >= 0, p[rows, front], np.nan)
+        base_d = np.where(front >= 0, dte[rows, front], np.nan)
+        gap = dte - base_d[:, None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ry = np.where(gap > 0, ((p / base_p[:, None]) ** (365.0 / gap) - 1) * 100, np.nan)
+        return pd.DataFrame(ry, index=self.prices.index, columns=self.prices.columns)
+
+    def spread(self, near, far):
+        """两个指定合约的价差序列 %: (Far / Near - 1) * 100"""
+        pair = self.prices[[near, far]].dropna()
+        return (pair[far] / pair[near] - 1) * 100
+
+    def snapshot(self, date=None):
+        """
+        某日 (默认最新) 的曲线: 每个在交易合约的价格 / 剩余天数 / 价差 / 年化展期收益
+        """
+        date = self.prices.index[-1] if date is None else pd.Timestamp(date)
+        snap = pd.DataFrame({
+            "price": self.prices.loc[date],
+            "dte": self.days_to_expiry().loc[date],
+            "spread_pct": self.spreads().loc[date],
+            "roll_yield_pct": self.roll_yield().loc[date],
+        })
+        return snap.dropna(subset=["price"])
+
+
+def build_term_structure(root, start=None):
+    """
+    并发拉取当前全部挂牌合约，返回 TermStructure (没有任何数据返回 None)
+    start: 只保留该日期之后的数据
+    """
+    frames = fetch_contracts(listed_contracts(root))
+    if not frames:
+        return None
+    codes = sorted(frames)
+    prices = pd.DataFrame({c: frames[c]["close"] for c in codes}).sort_index()
+    if start is not None:
+        prices = prices[prices.index > pd.to_datetime(start)]
+    return TermStructure(root, prices)
+
+
+def main_spread(ts):
+    """主力 vs 远月 (contract_discovery.pick_term_pair) 的价差序列，及合约对"""
+    near, far = pick_term_pair(ts.root)
+    if near not in ts.prices.columns or far not in ts.prices.columns:
+        return None, near, far
+    return ts.spread(near, far), near, far
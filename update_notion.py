@@ -1,18 +1,21 @@
 import os
-import io
-import zipfile
-import requests
+import json
 import pandas as pd
-import akshare as ak
-from notion_client import Client
+from data_cache import ak
+from cftc_fetcher import load_cot_dataset
+from fetch_planner import FetchPlan
+from contract_discovery import rank_contracts
+from term_structure import build_term_structure, main_spread
+from premium_engine import latest_premiums
+from rolling_stats import RollingStats
+from fx_service import DEFAULT_FX
 from datetime import datetime
-import pytz
 
 # ================= 配置区 =================
 GITHUB_REPOSITORY = os.getenv("GITHUB_REPOSITORY")
 BRANCH = "main"
 
-# 1. 定义图片列表 (顺序决定 Notion 显示顺序)
+# 1. 定义图片列表 (顺序决定 Notion 显示顺序；实际扩展名按 manifest.json 里的输出规格确定)
 IMAGES_LIST = [
     # --- A. 宏观对比 (新) ---
     "charts_final/Fig_Compare_Gold.png",
@@ -76,18 +79,85 @@ TITLES = {
 
 # ================= 🧠 V3.0 超级分析引擎 =================
 
+def resolve_image(img_path):
+    """
+    IMAGES_LIST 里的 .png 路径 -> 实际输出的文件
+    webp / vector 规格下扩展名会变 (chart_renderer.ChartSpec.resolve)，按 manifest 里同名图最近一次渲染的文件为准
+    """
+    folder, file_name = os.path.split(img_path)
+    stem = os.path.splitext(file_name)[0]
+    try:
+        with open(os.path.join(folder or ".", "manifest.json"), encoding="utf-8") as fp:
+            manifest = json.load(fp)
+    except Exception:
+        manifest = {}
+    candidates = []
+    for name, entry in manifest.items():
+        path = os.path.join(folder, name)
+        if os.path.splitext(name)[0] == stem and os.path.exists(path):
+            # 同一天换过规格时按文件修改时间取最新的
+            candidates.append((entry.get("rendered", ""), os.path.getmtime(path), path))
+    return max(candidates)[2] if candidates else img_path
+
 def safe_float(val):
     try: return float(val)
     except: return 0.0
 
-def get_trend_health(symbol_code):
+# 本次报告用到的合约日线 (按合约只下载一次，报告生成前后清空)
+_RUN_FRAMES = {}
+
+def fetch_daily(symbol_code):
+    """
+    报告内的合约日线 memo: 同一合约在趋势/量仓/价差里共用一份数据
+    失败也会被记住，避免同一个坏接口被重复请求
+    """
+    if symbol_code is None:
+        raise ValueError("合约未确定")
+    if symbol_code not in _RUN_FRAMES:
+        try:
+            _RUN_FRAMES[symbol_code] = ak.futures_zh_daily_sina(symbol=symbol_code)
+        except Exception as e:
+            _RUN_FRAMES[symbol_code] = e
+    result = _RUN_FRAMES[symbol_code]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+def prefetch_daily(codes):
+    """并发预取报告所需的全部合约，结果写入 memo"""
+    plan = FetchPlan()
+    for code in codes:
+        if code not in _RUN_FRAMES:
+            plan.add(code, ak.futures_zh_daily_sina, symbol=code)
+    results = plan.run()
+    for code, df in results.items():
+        _RUN_FRAMES[code] = plan.errors.get(code, df)
+
+def _stat(stats, label="1y"):
+    """滚动统计里 label 窗口的摘要，不够则用 best()；没有历史返回 None"""
+    if stats is None:
+        return None
+    return stats.summary(label) or stats.best()[1]
+
+def _rank_note(stats, fmt=" ({})"):
+    """' (3y 第 97 百分位)'；历史不足返回空串"""
+    text = stats.describe() if stats is not None else None
+    return fmt.format(text) if text else ""
+
+def _is_hot(stats, value, fallback):
+    """value 处于 1y 的 HOT_PCT 分位以上；历史不足时退回固定阈值"""
+    pct = stats.percentile(value) if stats is not None else None
+    return value > fallback if pct is None else pct >= HOT_PCT
+
+def get_trend_health(symbol_code, oi_stats=None):
     """
     分析趋势健康度 (OI Change vs Price Change)
+    oi_stats: 该品种持仓日变化的滚动统计，|z| < NOISE_Z 的持仓变化视为噪音
     返回: (状态描述, 信号强度emoji)
     """
     try:
         # 获取最近5天数据来判断趋势
-        df = ak.futures_zh_daily_sina(symbol=symbol_code)
+        df = fetch_daily(symbol_code)
         if df.empty or len(df) < 5: return ("数据不足", "")
         
         # 提取最近两天的持仓和价格
@@ -98,24 +168,30 @@ def get_trend_health(symbol_code):
         last_close = df['close'].iloc[-1]
         prev_close = df['close'].iloc[-2]
         price_change = last_close - prev_close
+
+        s = _stat(oi_stats)
+        z = s["z"] if s else None
+        if z is not None and abs(z) < NOISE_Z:
+            oi_change = 0
+        note = f" · 持仓变化 z {z:+.1f}" if z is not None else ""
         
         # 逻辑判断
         if price_change > 0 and oi_change > 0:
-            return ("量价齐升 (新多入场)", "🟢")
+            return ("量价齐升 (新多入场)" + note, "🟢")
         elif price_change > 0 and oi_change < 0:
-            return ("缩量上涨 (空头回补)", "⚠️")
+            return ("缩量上涨 (空头回补)" + note, "⚠️")
         elif price_change < 0 and oi_change > 0:
-            return ("增仓下跌 (新空入场)", "🔴")
+            return ("增仓下跌 (新空入场)" + note, "🔴")
         elif price_change < 0 and oi_change < 0:
-            return ("缩量下跌 (多头止损)", "⚪️")
+            return ("缩量下跌 (多头止损)" + note, "⚪️")
         else:
-            return ("震荡整理", "➖")
+            return ("震荡整理" + note, "➖")
     except:
         return ("分析失败", "")
 
 def get_market_metrics(symbol_root, main_code):
     try:
-        df = ak.futures_zh_daily_sina(symbol=main_code)
+        df = fetch_daily(main_code)
         if df.empty: return None
         last = df.iloc[-1]
         vol = safe_float(last['volume'])
@@ -124,72 +200,186 @@ def get_market_metrics(symbol_root, main_code):
         return {"vol": vol, "oi": oi, "ratio": ratio}
     except: return None
 
-def get_forward_spread(symbol_root, near, far):
+def get_forward_spread(curve):
+    """主力 vs 远月最新价差 % (与 Fig6 远期结构图同一套合约选择)"""
     try:
-        df_n = ak.futures_zh_daily_sina(symbol=f"{symbol_root}{near}")
-        df_f = ak.futures_zh_daily_sina(symbol=f"{symbol_root}{far}")
-        if df_n.empty or df_f.empty: return None
-        p1 = df_n['close'].iloc[-1]
-        p2 = df_f['close'].iloc[-1]
-        return (p2 / p1 - 1) * 100
+        if curve is None: return None
+        s, _, _ = main_spread(curve)
+        if s is None or s.empty: return None
+        return s.iloc[-1]
     except: return None
 
-def get_cftc_status(code):
-    """获取 CFTC 资金流向 (实时下载分析)"""
+def get_cftc_status(code, cot=None, stats=None):
+    """
+    获取 CFTC 资金流向 (复用 cftc_fetcher 的共享数据集，不再单独下载解析)
+    stats: RollingStats，周变化 |z| > BIG_Z 为大幅，并给出净多所处分位
+    """
     try:
-        year = datetime.now().year
-        url = f"https://www.cftc.gov/files/dea/history/deacot{year}.zip"
-        r = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'})
-        if r.status_code != 200: return "数据暂缺"
-
-        with zipfile.ZipFile(io.BytesIO(r.content)) as z:
-            with z.open(z.namelist()[0]) as f:
-                df = pd.read_csv(f, low_memory=False)
-                # 模糊匹配列名
-                col_code = next(c for c in df.columns if "Code" in str(c) or "CODE" in str(c))
-                col_long = next(c for c in df.columns if "Non" in str(c) and "Long" in str(c))
-                col_short = next(c for c in df.columns if "Non" in str(c) and "Short" in str(c))
-                
-                df['Code'] = df[col_code].astype(str).str.strip().str.zfill(6)
-                data = df[df['Code'] == code].copy()
-                if data.empty: return "无数据"
-                
-                # 计算净多头
-                data['Net'] = pd.to_numeric(data[col_long], errors='coerce') - pd.to_numeric(data[col_short], errors='coerce')
-                vals = data['Net'].tail(3).values
-                
-                if len(vals) < 2: return "数据不足"
-                
-                current = vals[-1]
-                prev = vals[-2]
-                diff = current - prev
-                
-                trend = "加仓" if diff > 0 else "减仓"
-                strength = "大幅" if abs(diff) > 5000 else "小幅"
-                return f"{trend} {strength} ({int(current):,}手)"
+        if cot is None:
+            cot = load_cot_dataset()
+        if cot.empty: return "数据暂缺"
+
+        data = cot[cot['Code'] == code]
+        if data.empty: return "无数据"
+        
+        # 计算净多头
+        vals = (data['Long'] - data['Short']).tail(3).values
+        
+        if len(vals) < 2: return "数据不足"
+        
+        current = vals[-1]
+        prev = vals[-2]
+        diff = current - prev
+        
+        trend = "加仓" if diff > 0 else "减仓"
+        s = _stat(stats.get(f"cftc_change.{code}"), "3y") if stats else None
+        big = abs(diff) > FALLBACK_CFTC if s is None or s["z"] is None else abs(s["z"]) > BIG_Z
+        strength = "大幅" if big else "小幅"
+        rank = stats.get(f"cftc_net.{code}").describe() if stats and stats.get(f"cftc_net.{code}") else None
+        return f"{trend} {strength} ({int(current):,}手{'，净多 ' + rank if rank else ''})"
     except:
         return "获取失败"
 
-def generate_full_report():
+# 报告覆盖的品种
+REPORT_ROOTS = ["au", "ag", "pt"]
+COT_CODES = {"au": "088691", "ag": "084691", "pt": "076651"}
+
+# 信号阈值: 按 rolling_stats 的滚动分位 / z 值判断，历史不足时退回 FALLBACK_* 固定阈值
+HOT_PCT = 90            # 换手率 / 持仓处于 1y 该分位以上视为过热 / 吸筹
+BIG_Z = 1.5             # CFTC 净多周变化 |z| 超过视为大幅
+NOISE_Z = 0.5           # 持仓日变化 |z| 低于视为噪音
+FALLBACK_RATIO = 3      # 换手率 (倍)
+FALLBACK_OI = 20000     # 铂金持仓 (手)
+FALLBACK_CFTC = 5000    # CFTC 净多周变化 (手)
+
+# ---- 滚动统计首次建档的长历史 (只读本地库；报告本身只拿到最近 180 天) ----
+
+def _seed_premiums():
+    """本地历史库重算的全部溢价 {金属: Series} (汇率库不够早时先回补；只保留汇率覆盖到的日期)"""
+    from main import stored_history, compute_metal_premiums
+    from fx_service import backfill_fx, get_usdcny
+    data = stored_history()
+    starts = [df.index[0] for df in data.values() if df is not None and not df.empty]
+    if not starts:
+        return {}
+    fx_start = backfill_fx(min(starts))
+    if fx_start is None:
+        return {}
+    data["fx"] = get_usdcny(fx_start)
+    premium = compute_metal_premiums(data)["Premium"]
+    return {m: premium[m][premium.index >= fx_start] for m in premium.columns}
+
+def _seed_contract(root):
+    """主力连续的 成交量 / 持仓 历史: 金银用新浪主连，铂金用拼接的连续主力"""
+    if root == "pt":
+        from continuous_series import load_continuous
+        return load_continuous("pt")[["volume", "hold"]].astype(float)
+    from history_store import load_history
+    df = load_history("futures_main_sina", f"{root}0")
+    return df.rename(columns={"成交量": "volume", "持仓量": "hold"})[["volume", "hold"]].astype(float)
+
+def _seed_cftc(code):
+    from cftc_fetcher import load_cftc_history
+    df = load_cftc_history(code)
+    return (df["Long"] - df["Short"]).astype(float) if not df.empty else pd.Series(dtype=float)
+
+def update_stats(store, mains, curves, premiums=None, cot=None):
+    """
+    把报告用到的派生序列的新观测推进滚动统计 (溢价 / 价差 / 换手率 / 持仓 / CFTC 净多)
+    第一次见到的序列用本地历史库自举，3y 窗口当天就能填满 (近远月价差没有长历史，从头累积)
+    """
+    seeded = {}
+
+    def once(key, func):
+        # 同一份长历史给几条序列共用，只算一次
+        if key not in seeded:
+            seeded[key] = func()
+        return seeded[key]
+
+    if premiums is not None and not premiums.empty:
+        for metal in premiums["Premium"].columns:
+            store.update(f"premium.{metal}", premiums["Premium"][metal],
+                         seed=lambda m=metal: once("premium", _seed_premiums).get(m))
+    for root, curve in curves.items():
+        try:
+            spread, _, _ = main_spread(curve)
+            store.update(f"spread.{root}", spread)
+        except Exception:
+            pass
+    for root, code in mains.items():
+        try:
+            df = fetch_daily(code)
+        except Exception:
+            continue
+        df = df.set_index(pd.to_datetime(df["date"]))
+        hold = df["hold"].astype(float)
+        seed = lambda r=root: once(r, lambda: _seed_contract(r))
+        store.update(f"vol_oi.{root}", df["volume"].astype(float) / hold.where(hold > 0),
+                     seed=lambda s=seed: s()["volume"] / s()["hold"].where(s()["hold"] > 0))
+        store.update(f"oi.{root}", hold, seed=lambda s=seed: s()["hold"])
+        store.update(f"oi_change.{root}", hold.diff(), seed=lambda s=seed: s()["hold"].diff())
+    if cot is not None and not cot.empty:
+        for code in COT_CODES.values():
+            data = cot[cot["Code"] == code]
+            net = (data["Long"] - data["Short"]).astype(float)
+            seed = lambda c=code: once(c, lambda: _seed_cftc(c))
+            store.update(f"cftc_net.{code}", net, freq="weekly", seed=seed)
+            store.update(f"cftc_change.{code}", net.diff(), freq="weekly", seed=lambda s=seed: s().diff())
+
+def generate_full_report(curves=None, premiums=None, cot=None):
+    """
+    curves: {品种: TermStructure} (pipeline 预取)，缺省则现场构建
+    premiums: premium_engine 溢价宽表 (pipeline 预算)，缺省则报告不含溢价行
+    cot: CFTC 数据集 (pipeline 的 fetch.cftc)，缺省则现场加载
+    """
     print("🧠 正在进行 V3.0 全维度量化分析...")
-    
-    # 1. 黄金 Au (假设主力合约，可按需修改)
-    au_spread = get_forward_spread("au", "2606", "2612")
-    au_metrics = get_market_metrics("au", "au2606")
-    au_health, au_icon = get_trend_health("au2606")
-    au_cftc = get_cftc_status("088691")
+    curves = dict(curves or {})
+    _RUN_FRAMES.clear()
+    try:
+        for root in ("au", "ag"):
+            if root not in curves:
+                curves[root] = build_term_structure(root)
+        # 主力合约由 contract_discovery 按当日持仓选出
+        mains = {}
+        for root in REPORT_ROOTS:
+            ranking = rank_contracts(root)
+            mains[root] = ranking[0][0] if ranking else None
+        prefetch_daily([c for c in mains.values() if c])
+        return _build_report(mains, curves, premiums, cot)
+    finally:
+        _RUN_FRAMES.clear()
+
+def _build_report(mains, curves, premiums=None, cot=None):
+    au_main, ag_main, pt_main = mains["au"], mains["ag"], mains["pt"]
+    prem = latest_premiums(premiums) if premiums is not None else {}
+    if cot is None:
+        cot = load_cot_dataset()
+
+    # 0. 滚动统计: 只推入上次之后的新观测
+    stats = RollingStats.load()
+    try:
+        update_stats(stats, mains, curves, premiums, cot)
+        stats.save()
+    except Exception as e:
+        print(f"⚠️ 滚动统计更新失败: {e}")
+    get = stats.get
+
+    # 1. 黄金 Au
+    au_spread = get_forward_spread(curves.get("au"))
+    au_metrics = get_market_metrics("au", au_main)
+    au_health, au_icon = get_trend_health(au_main, get("oi_change.au"))
+    au_cftc = get_cftc_status(COT_CODES["au"], cot, stats)
     
     # 2. 白银 Ag
-    ag_spread = get_forward_spread("ag", "2606", "2612")
-    ag_metrics = get_market_metrics("ag", "ag2606")
-    ag_health, ag_icon = get_trend_health("ag2606")
-    ag_cftc = get_cftc_status("084691")
+    ag_spread = get_forward_spread(curves.get("ag"))
+    ag_metrics = get_market_metrics("ag", ag_main)
+    ag_health, ag_icon = get_trend_health(ag_main, get("oi_change.ag"))
+    ag_cftc = get_cftc_status(COT_CODES["ag"], cot, stats)
     
-    # 3. 铂金 Pt (主力通常是 pt2605 或 pt2609)
-    # 为了稳健，我们分析 pt2605
-    pt_health, pt_icon = get_trend_health("pt2605") 
-    pt_metrics = get_market_metrics("pt", "pt2605")
-    pt_cftc = get_cftc_status("076651")
+    # 3. 铂金 Pt (主力按持仓量动态选择)
+    pt_health, pt_icon = get_trend_health(pt_main, get("oi_change.pt"))
+    pt_metrics = get_market_metrics("pt", pt_main)
+    pt_cftc = get_cftc_status(COT_CODES["pt"], cot, stats)
 
     lines = []
     lines.append("🤖 **AI 量化深度解析 (V3.0)**\n")
@@ -199,6 +389,8 @@ def generate_full_report():
     lines.append(f"• **趋势状态 (SHFE):** {au_health} {au_icon}")
     if au_spread:
         lines.append(f"• **期限结构:** {'Contango (正常)' if au_spread>0 else 'Backwardation'} (价差 {au_spread:.2f}%)")
+    if "Gold" in prem:
+        lines.append(f"• **国内外溢价:** {prem['Gold']:+.2f}%{_rank_note(get('premium.Gold'))}")
     lines.append(f"• **美盘资金 (CFTC):** {au_cftc}")
     
     # --- 白银 ---
@@ -209,20 +401,28 @@ def generate_full_report():
         if ag_spread < 0:
             lines.append(f"• 🚨 **逼空信号:** 现货贴水 {ag_spread:.2f}% (Backwardation)！现货极度缺货。")
         else:
-            lines.append(f"• **期限结构:** Contango (价差 {ag_spread:.2f}%)")
+            lines.append(f"• **期限结构:** Contango (价差 {ag_spread:.2f}%{_rank_note(get('spread.ag'), '，{}')})")
             
-    if ag_metrics and ag_metrics['ratio'] > 3:
-        lines.append(f"• 🔥 **投机热度:** 极度过热！换手率 {ag_metrics['ratio']:.1f}x，日内博弈剧烈。")
+    if ag_metrics and _is_hot(get("vol_oi.ag"), ag_metrics['ratio'], FALLBACK_RATIO):
+        lines.append(f"• 🔥 **投机热度:** 极度过热！换手率 {ag_metrics['ratio']:.1f}x{_rank_note(get('vol_oi.ag'))}，日内博弈剧烈。")
+
+    if "Silver" in prem:
+        lines.append(f"• **国内外溢价:** {prem['Silver']:+.2f}%{_rank_note(get('premium.Silver'))}")
         
     lines.append(f"• **美盘资金 (CFTC):** {ag_cftc}")
 
     # --- 铂金 ---
     lines.append("\n⚙️ **铂金 (Platinum): 底部异动**")
     lines.append(f"• **趋势状态 (SHFE):** {pt_health} {pt_icon}")
+    if "Platinum" in prem:
+        lines.append(f"• **期现溢价 (vs SGE):** {prem['Platinum']:+.2f}%{_rank_note(get('premium.Platinum'))}")
     lines.append(f"• **美盘资金 (CFTC):** {pt_cftc}")
     
-    if pt_metrics and pt_metrics['oi'] > 20000: 
-        lines.append(f"• 📢 **吸筹确认:** 持仓量 {int(pt_metrics['oi']):,} 手。如果价格低位+持仓激增，通常是主力底部建仓信号。")
+    if pt_metrics and _is_hot(get("oi.pt"), pt_metrics['oi'], FALLBACK_OI):
+        lines.append(f"• 📢 **吸筹确认:** 持仓量 {int(pt_metrics['oi']):,} 手{_rank_note(get('oi.pt'))}。如果价格低位+持仓激增，通常是主力底部建仓信号。")
+
+    if premiums is not None and premiums.attrs.get("fx_fallback"):
+        lines.append(f"\n⚠️ 汇率源全部失败，溢价按固定汇率 {DEFAULT_FX} 估算。")
 
     # --- 总结 ---
     lines.append("\n💡 **Insight:**")
@@ -231,9 +431,18 @@ def generate_full_report():
     
     return "\n".join(lines)
 
+def build_report_safely(curves=None, premiums=None, cot=None):
+    try:
+        return generate_full_report(curves, premiums, cot)
+    except Exception as e:
+        print(f"⚠️ 分析生成失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return "🤖 分析生成暂时不可用"
+
 # ================= 主程序 =================
 
-def update_page():
+def update_page(analysis_comment=None):
     token = os.getenv("NOTION_TOKEN")
     database_id = os.getenv("NOTION_PAGE_ID")
     
@@ -241,6 +450,9 @@ def update_page():
         print("❌ 错误：密钥缺失")
         return
 
+    # 只有推送时才需要，不拖慢其他阶段的导入
+    import pytz
+    from notion_client import Client
     notion = Client(auth=token)
     base_url = f"https://raw.githubusercontent.com/{GITHUB_REPOSITORY}/{BRANCH}"
     
@@ -250,14 +462,9 @@ def update_page():
     time_str = now.strftime("%H:%M")
     report_title = f"📅 Daily Metal Report: {today_str}"
     
-    # 1. 生成 AI 分析
-    try:
-        analysis_comment = generate_full_report()
-    except Exception as e:
-        print(f"⚠️ 分析生成失败: {e}")
-        import traceback
-        traceback.print_exc()
-        analysis_comment = "🤖 分析生成暂时不可用"
+    # 1. 生成 AI 分析 (pipeline 会预先算好传进来)
+    if analysis_comment is None:
+        analysis_comment = build_report_safely()
 
     # 2. 构造 Notion 内容块
     children_blocks = [
@@ -274,14 +481,15 @@ def update_page():
     
     count = 0
     # 3. 循环添加图片
-    for img_path in IMAGES_LIST:
+    for listed in IMAGES_LIST:
+        img_path = resolve_image(listed)
         # 智能跳过不存在的图片 (防裂图)
         if not os.path.exists(img_path): 
             # print(f"跳过缺失图片: {img_path}")
             continue
         
         img_url = f"{base_url}/{img_path}?t={int(now.timestamp())}"
-        file_name = img_path.split("/")[-1]
+        file_name = listed.split("/")[-1]
         display_title = TITLES.get(file_name, file_name)
         
         children_blocks.append({